@@ -17,8 +17,21 @@ def print_version_screen():
 def print_help_screen(exit_code: typing.Optional[int] = None):
     print('\n'
           '-h --help                   Print this help screen\n'
-          '   --map=filename.log       Pathfinder log file\n'
-          '   --verbose                Show additional information while working (verbose mode)'
+          '   --map=filename.log       Pathfinder log file (can be repeated, wildcards are allowed)\n'
+          '   --verbose                Show additional information while working (verbose mode)\n'
+          '   --jobs=N                 Number of worker processes to decode the log file with\n'
+          '   --no-cache               Do not use (and do not update) compiled event cache of the log file\n'
+          '   --follow                 Follow the growing log file and apply new events as they are written\n'
+          '   --frames=directory       Render time-lapse frames into numbered PNG files (\'-\' - raw RGB24 to stdout)\n'
+          '   --tick=seconds           Simulated time between the frames (default: 60)\n'
+          '   --size=WxH               Size of the frames in pixels (default: 1280x720)\n'
+          '   --validate=level         Validation of the log records: strict, report (default) or off\n'
+          '   --channel=name           Channel to build the map of (can be repeated, \'*\' - all channels)\n'
+          '   --stats                  Print profile of the processing stages (json) to stderr at exit\n'
+          '   --progress=seconds       Print progress lines to stderr with the given interval\n'
+          '   --activity               Print activity of the characters (json) at exit\n'
+          '   --coalesce=seconds       Fold events of the same object within the window into one change (no cache)\n'
+          '   --url=url                Fetch new part of the log from the server into the local copy (--map)\n'
           '-v --version                Print version info\n'
           '\n'
           'Usage: ./pftm --map=map_2.log\n'.
@@ -32,7 +45,21 @@ def get_argv_prms(additional_longopts: typing.List[str] = None):
     # имя пилота ранее зарегистрированного и для которого имеется аутентификационный токен, регистрация нового и т.д.
     res = {
         "map": 'map_1.log',
+        "maps": [],
         "verbose_mode": False,
+        "jobs": 1,
+        "cache": True,
+        "follow": False,
+        "frames": None,
+        "tick": 60,
+        "size": (1280, 720),
+        "validate": 'report',
+        "channels": [],
+        "stats": False,
+        "progress": None,
+        "activity": False,
+        "coalesce": None,
+        "url": None,
     }
     # для всех дополнительных (настраиваемых) длинных параметров запуска будет выдаваться список строк-значений, при
     # условии, что параметр содержит символ '=' в конце наименования, либо bool-значение в том случае, если не модержит
@@ -46,7 +73,7 @@ def get_argv_prms(additional_longopts: typing.List[str] = None):
     exit_or_wrong_getopt = None
     print_version_only = False
     try:
-        longopts = ["help", "version", "map=", "verbose"]
+        longopts = ["help", "version", "map=", "verbose", "jobs=", "no-cache", "follow", "frames=", "tick=", "size=", "validate=", "channel=", "stats", "progress=", "activity", "coalesce=", "url="]
         if additional_longopts:
             longopts.extend(additional_longopts)
         opts, args = getopt.getopt(sys.argv[1:], "hv", longopts)
@@ -54,22 +81,57 @@ def get_argv_prms(additional_longopts: typing.List[str] = None):
         exit_or_wrong_getopt = 2
 
     if exit_or_wrong_getopt is None:
-        for opt, arg in opts:  # noqa
-            if opt in ('-h', "--help"):
-                exit_or_wrong_getopt = 0
-                break
-            elif opt in ('-v', "--version"):
-                exit_or_wrong_getopt = 0
-                print_version_only = True
-                break
-            elif opt in "--verbose":
-                res["verbose_mode"] = True
-            elif opt in "--map":
-                res["map"] = arg
-            elif opt.startswith('--') and (opt[2:]+'=' in additional_longopts):
-                res[opt[2:]].append(arg)
-            elif opt.startswith('--') and opt[2:] in additional_longopts:
-                res[opt[2:]] = True
+        try:
+            for opt, arg in opts:  # noqa
+                if opt in ('-h', "--help"):
+                    exit_or_wrong_getopt = 0
+                    break
+                elif opt in ('-v', "--version"):
+                    exit_or_wrong_getopt = 0
+                    print_version_only = True
+                    break
+                elif opt in "--verbose":
+                    res["verbose_mode"] = True
+                elif opt in "--map":
+                    res["map"] = arg
+                    res["maps"].append(arg)
+                elif opt in "--jobs":
+                    res["jobs"] = max(1, int(arg))
+                elif opt in "--no-cache":
+                    res["cache"] = False
+                elif opt in "--follow":
+                    res["follow"] = True
+                elif opt in "--frames":
+                    res["frames"] = arg
+                elif opt in "--tick":
+                    res["tick"] = max(1, int(arg))
+                elif opt in "--size":
+                    width, height = arg.lower().split('x')
+                    res["size"] = (max(16, int(width)), max(16, int(height)))
+                elif opt in "--validate":
+                    if arg not in ('strict', 'report', 'off'):
+                        exit_or_wrong_getopt = 2
+                        break
+                    res["validate"] = arg
+                elif opt in "--channel":
+                    res["channels"].append(arg)
+                elif opt in "--stats":
+                    res["stats"] = True
+                elif opt in "--progress":
+                    res["progress"] = max(0.1, float(arg))
+                elif opt in "--activity":
+                    res["activity"] = True
+                elif opt in "--coalesce":
+                    res["coalesce"] = max(0, int(arg))
+                elif opt in "--url":
+                    res["url"] = arg
+                elif opt.startswith('--') and (opt[2:]+'=' in additional_longopts):
+                    res[opt[2:]].append(arg)
+                elif opt.startswith('--') and opt[2:] in additional_longopts:
+                    res[opt[2:]] = True
+        except ValueError:
+            # числовые значения параметров (--jobs=N, --size=WxH и т.п.) указаны неверно
+            exit_or_wrong_getopt = 2
         # д.б. либо указано имя, либо флаг регистрации нового пилота
         # упразднено: if (len(res["character_names"]) == 0) == (res["signup_new_character"] == False):
         # упразднено:     exit_or_wrong_getopt = 0
@@ -0,0 +1,180 @@
+# -*- encoding: utf-8 -*-
+""" Activity of the characters on the map
+
+Events are counted by character, time bucket, action and kind of the object while the log is ingested. Events come in
+chronological order, so counters of the current bucket are accumulated in a dict and are flushed into numpy columns
+(bucket, character, counters) when the bucket is over. Rows are stored only for characters active in the bucket, so
+the memory depends on the activity rather than on the time span of the log.
+"""
+import typing
+import datetime
+
+import numpy
+
+import pf_cache
+import pf_events
+
+ACTIONS: typing.Tuple[str, ...] = ('created', 'updated', 'deleted')
+KINDS: typing.Tuple[str, ...] = ('system', 'connection', 'signature')
+# номер счётчика по действию и типу объекта
+SLOTS: typing.Dict[typing.Tuple[str, str], int] = {
+  (action, kind): a * len(KINDS) + k for a, action in enumerate(ACTIONS) for k, kind in enumerate(KINDS)}
+DEFAULT_BUCKET: int = 60  # секунд
+
+
+class PfActivity:
+  def __init__(self, bucket: int = DEFAULT_BUCKET):
+    self.bucket: int = bucket
+    self.characters: typing.List[str] = []
+    self.character_ids: typing.Dict[str, int] = {}
+    self.size: int = 0
+    self.buckets: numpy.ndarray = numpy.zeros(64, dtype=numpy.int64)
+    self.character: numpy.ndarray = numpy.zeros(64, dtype=numpy.int32)
+    self.counts: numpy.ndarray = numpy.zeros((64, len(SLOTS)), dtype=numpy.uint32)
+    # счётчики текущего интервала по id персонажа
+    self.current: typing.Dict[int, typing.List[int]] = {}
+    self.current_bucket: typing.Optional[int] = None
+    self.current_dt: typing.Optional[datetime.datetime] = None
+    self.ordered: bool = True
+
+  def character_id_of(self, name: str) -> int:
+    character_id: typing.Optional[int] = self.character_ids.get(name)
+    if character_id is None:
+      character_id = self.character_ids[name] = len(self.characters)
+      self.characters.append(name)
+    return character_id
+
+  def count(self, event: pf_events.PfEvent):
+    # записи одной секунды разделяют один объект datetime (см. pf_reader.parse_datetime)
+    if event.dt is not self.current_dt:
+      self.current_dt = event.dt
+      bucket: int = pf_cache.to_timestamp(event.dt) // self.bucket
+      if bucket != self.current_bucket:
+        self.flush()
+        self.current_bucket = bucket
+    character_id: int = self.character_id_of(event.character.get('name') or '')
+    counters: typing.Optional[typing.List[int]] = self.current.get(character_id)
+    if counters is None:
+      counters = self.current[character_id] = [0] * len(SLOTS)
+    counters[SLOTS[(event.action, event.message_type)]] += 1
+
+  def flush(self):
+    """ moves counters of the current bucket into columns """
+    if not self.current:
+      return
+    size: int = self.size + len(self.current)
+    if size > len(self.buckets):
+      capacity: int = max(size, 2 * len(self.buckets))
+      self.buckets = numpy.resize(self.buckets, capacity)
+      self.character = numpy.resize(self.character, capacity)
+      self.counts = numpy.resize(self.counts, (capacity, len(SLOTS)))
+    if self.size and self.current_bucket < self.buckets[self.size - 1]:
+      self.ordered = False
+    rows: slice = slice(self.size, size)
+    self.buckets[rows] = self.current_bucket
+    self.character[rows] = list(self.current.keys())
+    self.counts[rows] = list(self.current.values())
+    self.size = size
+    self.current.clear()
+
+  def select(self, dt1: typing.Optional[datetime.datetime], dt2: typing.Optional[datetime.datetime]) -> slice:
+    # строки интервалов, пересекающихся с [dt1, dt2]
+    self.flush()
+    if not self.ordered:
+      # логи пришли не в хронологическом порядке, строки упорядочиваются один раз перед запросом
+      order: numpy.ndarray = numpy.argsort(self.buckets[:self.size], kind='stable')
+      self.buckets[:self.size] = self.buckets[order]
+      self.character[:self.size] = self.character[order]
+      self.counts[:self.size] = self.counts[order]
+      self.ordered = True
+    buckets: numpy.ndarray = self.buckets[:self.size]
+    start: int = 0 if dt1 is None else int(numpy.searchsorted(buckets, pf_cache.to_timestamp(dt1) // self.bucket, 'left'))
+    stop: int = self.size if dt2 is None else int(numpy.searchsorted(buckets, pf_cache.to_timestamp(dt2) // self.bucket, 'right'))
+    return slice(start, stop)
+
+  def totals(self,
+             dt1: typing.Optional[datetime.datetime] = None,
+             dt2: typing.Optional[datetime.datetime] = None) -> numpy.ndarray:
+    """ returns counters of the characters in the time range, array of shape (characters, actions, kinds) """
+    rows: slice = self.select(dt1, dt2)
+    res: numpy.ndarray = numpy.zeros((len(self.characters), len(SLOTS)), dtype=numpy.int64)
+    numpy.add.at(res, self.character[rows], self.counts[rows])
+    return res.reshape((len(self.characters), len(ACTIONS), len(KINDS)))
+
+  def heatmap(self,
+              dt1: datetime.datetime,
+              dt2: datetime.datetime,
+              action: typing.Optional[str] = None,
+              kind: typing.Optional[str] = None) -> numpy.ndarray:
+    """ returns number of events of the characters by buckets of the time range, array of shape (buckets, characters),
+    events can be limited by action and kind of the objects
+    """
+    rows: slice = self.select(dt1, dt2)
+    first: int = pf_cache.to_timestamp(dt1) // self.bucket
+    last: int = pf_cache.to_timestamp(dt2) // self.bucket
+    slots: typing.List[int] = [SLOTS[(a, k)] for a in ACTIONS for k in KINDS
+                               if (action is None or a == action) and (kind is None or k == kind)]
+    res: numpy.ndarray = numpy.zeros((last - first + 1, len(self.characters)), dtype=numpy.int64)
+    numpy.add.at(res, (self.buckets[rows] - first, self.character[rows]), self.counts[rows][:, slots].sum(axis=1))
+    return res
+
+  def summary(self,
+              dt1: typing.Optional[datetime.datetime] = None,
+              dt2: typing.Optional[datetime.datetime] = None) -> typing.Dict[str, typing.Dict[str, int]]:
+    """ returns non-zero counters of the characters in the time range ('created system' etc.) """
+    totals: numpy.ndarray = self.totals(dt1, dt2)
+    res: typing.Dict[str, typing.Dict[str, int]] = {}
+    for character_id, name in enumerate(self.characters):
+      counters: typing.Dict[str, int] = {
+        action + ' ' + kind: int(totals[character_id, a, k])
+        for a, action in enumerate(ACTIONS) for k, kind in enumerate(KINDS) if totals[character_id, a, k]}
+      if counters:
+        res[name] = counters
+    return res
+
+  def dump_state(self) -> dict:
+    """ returns counters as lists (the state is saved to the checkpoint of the follow mode) """
+    self.flush()
+    return {
+      'bucket': self.bucket,
+      'characters': self.characters,
+      'buckets': self.buckets[:self.size].tolist(),
+      'character': self.character[:self.size].tolist(),
+      'counts': self.counts[:self.size].tolist()}
+
+  def load_state(self, state: dict):
+    size: int = len(state['buckets'])
+    buckets: numpy.ndarray = numpy.array(state['buckets'], dtype=numpy.int64)
+    character: numpy.ndarray = numpy.array(state['character'], dtype=numpy.int32)
+    counts: numpy.ndarray = numpy.array(state['counts'], dtype=numpy.uint32).reshape((size, len(SLOTS)))
+    if len(character) != size or (size and int(character.max()) >= len(state['characters'])):
+      raise ValueError('inconsistent activity state')
+    self.bucket = state['bucket']
+    self.characters = list(state['characters'])
+    self.character_ids = {name: character_id for character_id, name in enumerate(self.characters)}
+    self.buckets, self.character, self.counts = buckets, character, counts
+    self.size = size
+    self.current.clear()
+    self.current_bucket = None
+    self.current_dt = None
+    self.ordered = bool(numpy.all(buckets[1:] >= buckets[:-1]))
+
+  def save(self, f: typing.BinaryIO):
+    self.flush()
+    f.write(self.buckets[:self.size].astype('<i8').tobytes())
+    f.write(self.character[:self.size].astype('<i4').tobytes())
+    f.write(self.counts[:self.size].astype('<u4').tobytes())
+
+  @classmethod
+  def load(cls, f: typing.BinaryIO, bucket: int, size: int, characters: typing.List[str]) -> 'PfActivity':
+    activity: PfActivity = cls(bucket)
+    activity.characters = characters
+    activity.character_ids = {name: character_id for character_id, name in enumerate(characters)}
+    activity.buckets = numpy.frombuffer(f.read(8 * size), dtype='<i8').astype(numpy.int64)
+    activity.character = numpy.frombuffer(f.read(4 * size), dtype='<i4').astype(numpy.int32)
+    activity.counts = numpy.frombuffer(f.read(4 * size * len(SLOTS)), dtype='<u4').astype(numpy.uint32).reshape((size, len(SLOTS)))
+    if len(activity.buckets) != size or len(activity.counts) != size:
+      raise EOFError
+    activity.size = size
+    activity.ordered = bool(numpy.all(activity.buckets[1:] >= activity.buckets[:-1]))
+    return activity
@@ -0,0 +1,333 @@
+#!/usr/bin/python3
+
+""" Q.Pathfinder Time Machine: benchmarks
+
+Measures throughput of the log processing stages (lines per second) and memory used by the map storage. The whole
+ingest (pftm.py run in a separate process) is measured on the synthetic logs of the given sizes (peak memory is also
+measured on the gzip copy of the log, which is read without mmap), results are appended to the json lines file.
+
+$ python pf_benchmark.py --map=filename.log
+$ python pf_benchmark.py --ingest=10000,1000000,10000000 --workdir=/tmp --results=ingest.jsonl
+"""
+import os
+import sys
+import gzip
+import json
+import time
+import typing
+import shutil
+import datetime
+import subprocess
+import tracemalloc
+
+import console_app
+import pf_generator
+import pf_events
+import pf_reader
+import pf_storage
+import pftm
+
+g_channel_filter: pf_reader.PfChannelFilter = pf_reader.make_channel_filter(['SRG-C'])
+
+
+def legacy_decode_line(line: str):
+  # так строки лога разбирались изначально (json.loads + strptime), оставлено для сравнения
+  obj = json.loads(line)
+  message = obj.get('message')
+  message_parts = message.split(' ', 1)
+  data = obj.get('context').get('data')
+  channel = data.get('channel')
+  dt = datetime.datetime.strptime(obj.get('datetime'), "%Y-%m-%dT%H:%M:%S.%f+00:00")
+  dt = dt.replace(microsecond=0)
+  path = obj.get('extra').get('path')
+  return message_parts[0], message_parts[1], dt, channel.get('channelName'), path
+
+
+def bench_legacy_decode(lines_txt: typing.List[str], lines_bin: typing.List[bytes]) -> int:
+  for line in lines_txt:
+    legacy_decode_line(line)
+  return len(lines_txt)
+
+
+def bench_fast_decode(lines_txt: typing.List[str], lines_bin: typing.List[bytes]) -> int:
+  pf_reader.g_datetime_cache.clear()
+  decode_line = pf_reader.decode_line
+  for line in lines_bin:
+    decode_line(line)
+  return len(lines_bin)
+
+
+def bench_prefiltered_decode(lines_txt: typing.List[str], lines_bin: typing.List[bytes]) -> int:
+  pf_reader.g_datetime_cache.clear()
+  decode_line = pf_reader.decode_line
+  prefilter = pf_reader.make_prefilter(g_channel_filter)
+  for line in lines_bin:
+    if prefilter(line):
+      decode_line(line)
+  return len(lines_bin)
+
+
+g_dispatch_events: typing.Optional[typing.List[typing.Tuple[str, pf_events.PfEvent]]] = None
+
+
+def get_dispatch_events(lines_bin: typing.List[bytes]) -> typing.List[typing.Tuple[str, pf_events.PfEvent]]:
+  # события декодируются один раз, в замерах участвуют разбор extra.path, выбор обработчика и сами обработчики
+  global g_dispatch_events
+  if g_dispatch_events is None:
+    g_dispatch_events = []
+    prefilter = pf_reader.make_prefilter(g_channel_filter)
+    for line in lines_bin:
+      if prefilter(line):
+        rec: pf_reader.PfRecord = pf_reader.decode_line(line)
+        event: typing.Optional[pf_events.PfEvent] = pf_events.normalize_record(rec, g_channel_filter)
+        if event is not None:
+          g_dispatch_events.append((rec.path, event))
+  return g_dispatch_events
+
+
+def bench_legacy_dispatch(lines_txt: typing.List[str], lines_bin: typing.List[bytes]) -> int:
+  # так события применялись к карте изначально: цепочка сравнений extra.path и выбор обработчика цепочкой if/elif
+  # (обработчики и их окружение те же, что и в PfMap.apply, различается только диспетчеризация)
+  events = get_dispatch_events(lines_bin)
+  map: pftm.PfMap = pftm.PfMap()
+  for path, event in events:
+    path_base = None
+    path_ids = None
+    if path == '/cron/deleteEolConnections' or \
+       path == '/cron/deleteExpiredConnections' or \
+       path == '/api/Map/updateData' or \
+       path == '/api/Map/updateUserData' or \
+       path == '/api/Map/updateUnloadData':
+      path_base = path
+    elif path.startswith('/api/rest/Connection'):
+      path_base = '/api/rest/Connection'
+      path_ids = path[len(path_base)+1:]
+      path_ids = [] if not path_ids else path_ids.split(',')
+    elif path.startswith('/api/rest/System'):
+      path_base = '/api/rest/System'
+      path_ids = path[len(path_base)+1:]
+      path_ids = [] if not path_ids else path_ids.split(',')
+    elif path.startswith('/api/rest/Signature'):
+      path_base = '/api/rest/Signature'
+      path_ids = path[len(path_base)+1:]
+      path_ids = [] if not path_ids else path_ids.split(',')
+    message_type = event.message_type
+    try:
+      if map.activity is not None:
+        map.activity.count(event)
+      if event.action == 'deleted':
+        if message_type == 'connection':
+          map.deleted_connection(event)
+        elif message_type == 'system':
+          map.deleted_system(event)
+        elif message_type == 'signature':
+          map.deleted_signature(event)
+      elif event.action == 'updated':
+        if message_type == 'connection':
+          map.updated_connection(event)
+        elif message_type == 'system':
+          map.updated_system(event)
+        elif message_type == 'signature':
+          map.updated_signature(event)
+      else:
+        if message_type == 'connection':
+          map.created_connection(event)
+        elif message_type == 'system':
+          map.created_system(event)
+        elif message_type == 'signature':
+          map.created_signature(event)
+    except (KeyError, IndexError, TypeError, ValueError, AttributeError) as e:
+      map.validator.malformed(event, e)
+  return len(events)
+
+
+def bench_table_dispatch(lines_txt: typing.List[str], lines_bin: typing.List[bytes]) -> int:
+  # так события применяются к карте сейчас: разбор extra.path (с кешем) и PfMap.apply (таблица обработчиков)
+  events = get_dispatch_events(lines_bin)
+  map: pftm.PfMap = pftm.PfMap()
+  pf_events.g_path_cache.clear()
+  split_path = pf_events.split_path
+  apply = map.apply
+  for path, event in events:
+    split_path(path, None)
+    apply(event)
+  return len(events)
+
+
+g_benchmarks: typing.Dict[str, typing.Callable[[typing.List[str], typing.List[bytes]], int]] = {
+  'decode.legacy': bench_legacy_decode,
+  'decode.fast': bench_fast_decode,
+  'decode.prefiltered': bench_prefiltered_decode,
+  'dispatch.legacy': bench_legacy_dispatch,
+  'dispatch.table': bench_table_dispatch,
+}
+# подготовка данных, которая не должна попадать в замер (выполняется до первого прогона)
+g_benchmark_setups: typing.Dict[str, typing.Callable[[typing.List[bytes]], typing.Any]] = {
+  'dispatch.legacy': get_dispatch_events,
+  'dispatch.table': get_dispatch_events,
+}
+
+
+class LegacySystem:
+  # так системы хранились изначально (атрибуты в словаре объекта), оставлено для сравнения
+  def __init__(self, id: int, nm: str, at: datetime.datetime):
+    self.id: int = id
+    self.nm: str = nm
+    self.at: datetime.datetime = at
+    self.last: datetime.datetime = at
+    self.locked: typing.Optional[bool] = None
+    self.statusId: typing.Optional[bool] = None
+
+
+class LegacyConnection:
+  def __init__(self, id: int, source: int, target: int, at: datetime.datetime):
+    self.id: int = id
+    self.source: int = source
+    self.target: int = target
+
+
+def memory_legacy(count: int):
+  at: datetime.datetime = datetime.datetime(2023, 10, 27)
+  objects: typing.Dict[str, str] = {}
+  systems: typing.Dict[int, LegacySystem] = {}
+  connections: typing.Dict[int, LegacyConnection] = {}
+  for i in range(count):
+    # названия систем повторяются, но после json.loads каждое название - отдельная строка
+    nm: str = 'J{:06d}'.format(i % 2000)
+    systems[i] = LegacySystem(i, nm, at)
+    connections[i] = LegacyConnection(i, i, i + 1, at)
+    objects[str(i)] = nm
+  return objects, systems, connections
+
+
+def memory_compact(count: int):
+  # реестра названий всех встречавшихся объектов больше нет, названия хранятся только в объектах карты
+  at: datetime.datetime = datetime.datetime(2023, 10, 27)
+  systems: typing.Dict[int, pf_storage.PfSystem] = {}
+  connections: typing.Dict[int, pf_storage.PfConnection] = {}
+  for i in range(count):
+    nm: str = 'J{:06d}'.format(i % 2000)
+    systems[i] = pf_storage.PfSystem(i, nm, at)
+    connections[i] = pf_storage.PfConnection(i, i, i + 1, at)
+  return systems, connections
+
+
+g_memory_benchmarks: typing.Dict[str, typing.Callable[[int], typing.Any]] = {
+  'memory.legacy': memory_legacy,
+  'memory.compact': memory_compact,
+}
+
+
+def run_memory_benchmark(name: str, count: int) -> int:
+  # пиковый объём памяти, занятой системами, соединениями и реестром названий объектов
+  tracemalloc.start()
+  built = g_memory_benchmarks[name](count)
+  _, peak = tracemalloc.get_traced_memory()
+  tracemalloc.stop()
+  del built
+  return peak
+
+
+def run_benchmark(name: str, lines_txt: typing.List[str], lines_bin: typing.List[bytes], repeat: int) -> float:
+  best: typing.Optional[float] = None
+  processed: int = 0
+  if name in g_benchmark_setups:
+    g_benchmark_setups[name](lines_bin)
+  for _ in range(repeat):
+    started = time.perf_counter()
+    processed = g_benchmarks[name](lines_txt, lines_bin)
+    elapsed = time.perf_counter() - started
+    if best is None or elapsed < best:
+      best = elapsed
+  return processed / best if best else 0.0
+
+
+def run_pftm(filename: str, jobs: int) -> typing.Tuple[float, dict]:
+  # отдельный процесс, чтобы пиковый объём памяти относился только к обработке этого лога
+  pftm: str = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'pftm.py')
+  started: float = time.perf_counter()
+  proc = subprocess.run(
+    [sys.executable, pftm, '--map=' + filename, '--channel=*', '--no-cache', '--stats', '--jobs={}'.format(jobs)],
+    stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, encoding='utf-8', check=True)
+  elapsed: float = time.perf_counter() - started
+  return elapsed, json.loads(proc.stderr[proc.stderr.rindex('{\n  "elapsed"'):])
+
+
+def run_ingest_benchmark(count: int, workdir: str, jobs: int) -> dict:
+  # синтетический лог генерируется один раз и используется повторно
+  filename: str = os.path.join(workdir, 'synthetic_{}.log'.format(count))
+  if not os.path.exists(filename):
+    pf_generator.generate(filename + '.tmp', count)
+    os.replace(filename + '.tmp', filename)
+  # ru_maxrss включает страницы лога, отображённого в память (несжатый лог читается через mmap и к концу чтения
+  # оказывается в памяти целиком), поэтому память карт измеряется отдельным запуском по сжатой копии лога, которая
+  # читается потоком через буфер
+  compressed: str = filename + '.gz'
+  if not os.path.exists(compressed):
+    with open(filename, 'rb') as src, gzip.open(compressed + '.tmp', 'wb', compresslevel=1) as dst:
+      shutil.copyfileobj(src, dst)
+    os.replace(compressed + '.tmp', compressed)
+  elapsed, stats = run_pftm(filename, jobs)
+  _, buffered = run_pftm(compressed, jobs)
+  peak: int = max(stats['peak_rss'] or 0, stats['peak_rss_workers'] or 0)
+  peak_buffered: int = max(buffered['peak_rss'] or 0, buffered['peak_rss_workers'] or 0)
+  return {
+    'date': datetime.datetime.now().isoformat(timespec='seconds'),
+    'lines': count,
+    'bytes': os.path.getsize(filename),
+    'jobs': jobs,
+    'json_backend': pf_reader.json_backend,
+    'elapsed': round(elapsed, 3),
+    'lines_per_sec': round(count / elapsed, 1),
+    'events': stats['events'],
+    'events_per_sec': stats['events_per_sec'],
+    'peak_rss': peak or None,
+    'peak_rss_buffered': peak_buffered or None,
+  }
+
+
+def main_ingest(argv_prms):
+  workdir: str = argv_prms['workdir'][-1] if argv_prms['workdir'] else '.'
+  results: typing.Optional[str] = argv_prms['results'][-1] if argv_prms['results'] else None
+  for count in [int(n) for sizes in argv_prms['ingest'] for n in sizes.split(',')]:
+    result: dict = run_ingest_benchmark(count, workdir, argv_prms['jobs'])
+    print('ingest {:<12} {:>12.0f} lines/sec {:>12.0f} events/sec, peak rss {} ({} reading without mmap)'.format(
+      count, result['lines_per_sec'], result['events_per_sec'] or 0.0,
+      '{:.1f} MiB'.format(result['peak_rss'] / (1024 * 1024)) if result['peak_rss'] else 'n/a',
+      '{:.1f} MiB'.format(result['peak_rss_buffered'] / (1024 * 1024)) if result['peak_rss_buffered'] else 'n/a'))
+    if results:
+      with open(results, 'a', encoding='utf-8') as f:
+        f.write(json.dumps(result) + '\n')
+
+
+def main():
+  global g_channel_filter
+
+  argv_prms = console_app.get_argv_prms(['repeat=', 'bench=', 'objects=', 'ingest=', 'workdir=', 'results='])
+  if argv_prms['ingest']:
+    main_ingest(argv_prms)
+    return
+  if argv_prms['channels']:
+    g_channel_filter = None if '*' in argv_prms['channels'] else pf_reader.make_channel_filter(argv_prms['channels'])
+  repeat: int = int(argv_prms['repeat'][-1]) if argv_prms['repeat'] else 3
+  names: typing.List[str] = argv_prms['bench'] if argv_prms['bench'] else \
+    list(g_benchmarks.keys()) + list(g_memory_benchmarks.keys())
+  objects: int = int(argv_prms['objects'][-1]) if argv_prms['objects'] else 200000
+
+  with open(argv_prms['map'], 'rb') as f:
+    lines_bin: typing.List[bytes] = [line for line in f if line.strip()]
+  lines_txt: typing.List[str] = [line.decode('utf-8') for line in lines_bin]
+
+  print('json backend: {}, lines: {}, repeat: {}'.format(pf_reader.json_backend, len(lines_bin), repeat))
+  for name in names:
+    if name in g_memory_benchmarks:
+      peak: int = run_memory_benchmark(name, objects)
+      print('{:<24} {:>12.0f} bytes/object (peak {:.1f} MiB for {} objects)'.format(
+        name, peak / objects, peak / (1024 * 1024), objects))
+    else:
+      lps: float = run_benchmark(name, lines_txt, lines_bin, repeat)
+      print('{:<24} {:>12.0f} lines/sec'.format(name, lps))
+
+
+if __name__ == "__main__":
+  main()
@@ -0,0 +1,484 @@
+# -*- encoding: utf-8 -*-
+""" Compiled event cache of the Pathfinder log
+
+Mutations of the map storage are compiled into a compact columnar journal which is saved next to the log file, so
+the log has to be parsed again only when it is changed (and only the appended part if the log has just grown). The
+final state of the storage and the snapshots of the time machine are saved along with the journal, so the unchanged
+log is restored without replay of the journal. The file consists of sections: the journal sections (new records are
+appended as the next section when the log grows) and the final section with the state of the maps, which is rewritten
+on every save.
+"""
+import os
+import sys
+import json
+import array
+import typing
+import hashlib
+import marshal
+import datetime
+
+import pf_reader
+
+CACHE_SUFFIX: str = '.pftmc'
+CACHE_MAGIC: bytes = b'PFTMC'
+CACHE_VERSION: int = 7
+# размер фрагментов лога, по которым вычисляется хеш содержимого (начало лога и окрестность последней разобранной
+# позиции, последнее нужно, чтобы убедиться, что лог не переписан, а только дополнен)
+HASH_WINDOW: int = 64 * 1024
+
+ACTION_CREATE: int = 0
+ACTION_UPDATE: int = 1
+ACTION_DELETE: int = 2
+
+KIND_SYSTEM: int = 0
+KIND_CONNECTION: int = 1
+KIND_SIGNATURE: int = 2
+
+NONE: int = -1  # отсутствующее значение в числовых колонках
+UNLINKED: int = 0  # сигнатура отвязана от соединения (в колонке target записей о сигнатурах)
+
+EPOCH: datetime.datetime = datetime.datetime(1970, 1, 1)
+
+
+def to_timestamp(dt: datetime.datetime) -> int:
+  return int((dt - EPOCH).total_seconds())
+
+
+def from_timestamp(ts: int) -> datetime.datetime:
+  return EPOCH + datetime.timedelta(seconds=ts)
+
+
+class PfEventColumns:
+  # типы колонок (array.array), порядок колонок совпадает с порядком их записи в файл
+  COLUMNS: typing.Tuple[typing.Tuple[str, str], ...] = (
+    ('ts', 'q'),
+    ('action', 'b'),
+    ('kind', 'b'),
+    ('obj_id', 'q'),
+    ('name_id', 'i'),
+    ('source', 'q'),
+    ('target', 'q'),
+    ('locked', 'b'),
+    ('status_id', 'i'),
+    ('group_id', 'i'),
+    ('type_id', 'i'),
+  )
+
+  def __init__(self):
+    self.ts: array.array = array.array('q')
+    self.action: array.array = array.array('b')
+    self.kind: array.array = array.array('b')
+    self.obj_id: array.array = array.array('q')
+    self.name_id: array.array = array.array('i')
+    self.source: array.array = array.array('q')
+    self.target: array.array = array.array('q')
+    self.locked: array.array = array.array('b')
+    self.status_id: array.array = array.array('i')
+    # у сигнатур в колонке source хранится id системы, в которой она находится, в колонке target - id соединения
+    self.group_id: array.array = array.array('i')
+    self.type_id: array.array = array.array('i')
+    # названия систем хранятся один раз, в колонке name_id - номер названия
+    self.names: typing.List[str] = []
+    self.name_ids: typing.Dict[str, int] = {}
+
+  def __len__(self) -> int:
+    return len(self.ts)
+
+  def name_id_of(self, name: typing.Optional[str]) -> int:
+    if name is None:
+      return NONE
+    name_id: typing.Optional[int] = self.name_ids.get(name)
+    if name_id is None:
+      name_id = len(self.names)
+      self.names.append(name)
+      self.name_ids[name] = name_id
+    return name_id
+
+  def append(self,
+             action: int,
+             kind: int,
+             obj_id: int,
+             name: typing.Optional[str],
+             dt: datetime.datetime,
+             source: typing.Optional[int] = None,
+             target: typing.Optional[int] = None,
+             locked: typing.Optional[bool] = None,
+             status_id: typing.Optional[int] = None,
+             group_id: typing.Optional[int] = None,
+             type_id: typing.Optional[int] = None):
+    self.ts.append(to_timestamp(dt))
+    self.action.append(action)
+    self.kind.append(kind)
+    self.obj_id.append(obj_id)
+    self.name_id.append(self.name_id_of(name))
+    self.source.append(NONE if source is None else source)
+    self.target.append(NONE if target is None else target)
+    self.locked.append(NONE if locked is None else int(locked))
+    self.status_id.append(NONE if status_id is None else int(status_id))
+    self.group_id.append(NONE if group_id is None else int(group_id))
+    self.type_id.append(NONE if type_id is None else int(type_id))
+
+  def replay(self, storage, start: int = 0, stop: typing.Optional[int] = None):
+    """ applies journaled mutations [start, stop) to the storage (PfStorage) """
+    dt_cache: typing.Dict[int, datetime.datetime] = {}
+    names: typing.List[str] = self.names
+    for i in range(start, len(self) if stop is None else stop):
+      ts: int = self.ts[i]
+      dt: typing.Optional[datetime.datetime] = dt_cache.get(ts)
+      if dt is None:
+        if len(dt_cache) > 4096:
+          dt_cache.clear()
+        dt = dt_cache[ts] = from_timestamp(ts)
+      action: int = self.action[i]
+      kind: int = self.kind[i]
+      obj_id: int = self.obj_id[i]
+      if kind == KIND_SYSTEM:
+        if action == ACTION_DELETE:
+          storage.del_system(obj_id, dt)
+        else:
+          name_id: int = self.name_id[i]
+          locked: typing.Optional[bool] = True if self.locked[i] == 1 else None
+          status_id: typing.Optional[int] = None if self.status_id[i] == NONE else self.status_id[i]
+          if action == ACTION_CREATE:
+            storage.add_system(obj_id, names[name_id], dt, locked, status_id)
+          else:
+            storage.upd_system(obj_id, names[name_id], dt, locked, status_id)
+      elif kind == KIND_CONNECTION:
+        if action == ACTION_DELETE:
+          storage.del_connection(obj_id, dt)
+        else:
+          storage.add_connection(obj_id, self.source[i], self.target[i], dt)
+      elif kind == KIND_SIGNATURE:
+        if action == ACTION_DELETE:
+          storage.del_signature(obj_id, dt)
+        else:
+          name_id = self.name_id[i]
+          system_id: typing.Optional[int] = None if self.source[i] == NONE else self.source[i]
+          connection_id: typing.Optional[int] = None if self.target[i] == NONE else self.target[i]
+          group_id: typing.Optional[int] = None if self.group_id[i] == NONE else self.group_id[i]
+          type_id: typing.Optional[int] = None if self.type_id[i] == NONE else self.type_id[i]
+          if action == ACTION_CREATE:
+            storage.add_signature(obj_id, names[name_id], dt, system_id, connection_id, group_id, type_id)
+          else:
+            name: typing.Optional[str] = None if name_id == NONE else names[name_id]
+            storage.upd_signature(obj_id, name, dt, system_id, connection_id, group_id, type_id)
+
+  def columns(self) -> typing.Iterator[typing.Tuple[str, array.array]]:
+    for name, _ in self.COLUMNS:
+      yield name, getattr(self, name)
+
+
+class PfLogIdentity(typing.NamedTuple):
+  size: int
+  mtime_ns: int
+  head_hash: str  # хеш начала лога
+  tail_hash: str  # хеш фрагмента перед позицией offset
+  offset: int  # позиция в логе, до которой события попали в кеш
+
+
+def hash_range(f: typing.BinaryIO, start: int, end: int) -> str:
+  f.seek(max(0, start))
+  return hashlib.blake2b(f.read(max(0, end - max(0, start))), digest_size=16).hexdigest()
+
+
+def find_lines_end(f: typing.BinaryIO, size: int) -> int:
+  # позиция сразу за последним символом '\n' в файле
+  end: int = size
+  while end > 0:
+    start: int = max(0, end - HASH_WINDOW)
+    f.seek(start)
+    eol: int = f.read(end - start).rfind(b'\n')
+    if eol >= 0:
+      return start + eol + 1
+    end = start
+  return 0
+
+
+def get_log_identity(filename: str, offset: typing.Optional[int] = None) -> PfLogIdentity:
+  """ returns identity of the log, by default offset is set to the end of the last complete line of the log (the
+  last line may still being written by pathfinder)
+  """
+  st = os.stat(filename)
+  _offset: int = st.st_size if offset is None else offset
+  with open(filename, 'rb') as f:
+    if offset is None and pf_reader.detect_compression(filename) is None:
+      _offset = find_lines_end(f, st.st_size)
+    head_hash: str = hash_range(f, 0, min(HASH_WINDOW, _offset))
+    tail_hash: str = hash_range(f, _offset - HASH_WINDOW, _offset)
+  return PfLogIdentity(st.st_size, st.st_mtime_ns, head_hash, tail_hash, _offset)
+
+
+def get_cache_filename(log_filename: str, channel_filter: pf_reader.PfChannelFilter = None) -> str:
+  """ returns name of the cache of the log built for the channels (<log>.pftmc for all channels), caches of different
+  sets of channels are kept side by side, so switching --channel doesn't overwrite them
+  """
+  if channel_filter is None:
+    return log_filename + CACHE_SUFFIX
+  digest: str = hashlib.blake2b('\n'.join(sorted(channel_filter)).encode('utf-8'), digest_size=4).hexdigest()
+  return '{}.{}{}'.format(log_filename, digest, CACHE_SUFFIX)
+
+
+class PfCacheLayout(typing.NamedTuple):
+  """ part of the journals stored in the cache file, new records of the journals are appended after it """
+  rows: typing.Dict[str, int]  # количество записей журналов по каналам
+  names: typing.Dict[str, int]  # количество названий
+  snapshots: typing.Dict[str, int]  # количество снимков
+  channel: typing.Optional[typing.List[str]]
+  trailer_offset: int  # позиция секции с итоговым состоянием карт (она переписывается при каждом сохранении)
+  size: int  # размер файла
+
+
+class PfCache(typing.NamedTuple):
+  identity: PfLogIdentity
+  channel: typing.Optional[typing.List[str]]  # названия каналов, для которых построен кеш (None - все каналы)
+  journals: typing.Dict[str, PfEventColumns]
+  snapshot_rows: typing.Dict[str, array.array]
+  snapshot_states: typing.Dict[str, typing.List[bytes]]
+  states: typing.Dict[str, dict]  # итоговое состояние хранилищ каналов (см. PfStorage.dump_state)
+  activities: typing.Optional[typing.Dict[str, typing.Any]]
+  validation: typing.Optional[dict]  # уровень проверки и найденные аномалии (см. PfValidator.dump_state)
+  layout: PfCacheLayout
+
+
+def write_section(f: typing.BinaryIO, tag: bytes, header: dict):
+  header_bytes: bytes = json.dumps(header, ensure_ascii=False).encode('utf-8')
+  f.write(tag)
+  f.write(len(header_bytes).to_bytes(4, 'little'))
+  f.write(header_bytes)
+
+
+def read_section(f: typing.BinaryIO) -> typing.Tuple[bytes, dict]:
+  tag: bytes = f.read(1)
+  size: bytes = f.read(4)
+  if len(size) != 4:
+    raise EOFError
+  data: bytes = f.read(int.from_bytes(size, 'little'))
+  if len(data) != int.from_bytes(size, 'little'):
+    raise EOFError
+  return tag, json.loads(data.decode('utf-8'))
+
+
+def read_bytes(f: typing.BinaryIO, size: int) -> bytes:
+  data: bytes = f.read(size)
+  if len(data) != size:
+    raise EOFError
+  return data
+
+
+def save_cache(
+    filename: str,
+    timelines: typing.Dict[str, typing.Any],
+    identity: PfLogIdentity,
+    channel_filter: pf_reader.PfChannelFilter,
+    activities: typing.Optional[typing.Dict[str, typing.Any]] = None,
+    layout: typing.Optional[PfCacheLayout] = None,
+    validation: typing.Optional[dict] = None) -> PfCacheLayout:
+  """ saves journals, snapshots and final state of the storages of the channels (pf_timeline.PfTimeline by channel
+  name), activity of the characters (pf_activity.PfActivity) and anomalies of the log, if layout of the existing cache file is passed, then
+  only records added to the journals after it are appended to the file, returns layout of the saved file
+  """
+  channel: typing.Optional[typing.List[str]] = None if channel_filter is None else sorted(channel_filter)
+  if layout is not None and not can_append(filename, timelines, channel, layout):
+    layout = None
+  if layout is None:
+    layout = PfCacheLayout({}, {}, {}, channel, 0, 0)
+    # новый файл записывается под временным именем и подменяется целиком, чтобы прерванный запуск не испортил кеш
+    tmp_filename: str = filename + '.tmp'
+    with open(tmp_filename, 'wb') as f:
+      f.write(CACHE_MAGIC)
+      write_section(f, b'H', {
+        'version': CACHE_VERSION,
+        'byteorder': sys.byteorder,
+        'marshal': marshal.version,
+        'channel': channel,
+        'columns': [[name, code, array.array(code).itemsize] for name, code in PfEventColumns.COLUMNS],
+      })
+      layout = write_journals(f, timelines, identity, activities, validation, layout)
+    os.replace(tmp_filename, filename)
+    return layout
+  # журналы только дописываются: секция с итоговым состоянием заменяется секцией с новыми записями журналов и
+  # новой секцией итогового состояния (прерванная запись делает кеш непригодным, и он будет построен заново)
+  with open(filename, 'r+b') as f:
+    f.seek(layout.trailer_offset)
+    f.truncate()
+    return write_journals(f, timelines, identity, activities, validation, layout)
+
+
+def can_append(
+    filename: str,
+    timelines: typing.Dict[str, typing.Any],
+    channel: typing.Optional[typing.List[str]],
+    layout: PfCacheLayout) -> bool:
+  # дописывать можно только в тот же файл (он не изменялся с момента загрузки или сохранения) и только продолжение
+  # тех же журналов
+  try:
+    if os.path.getsize(filename) != layout.size:
+      return False
+  except OSError:
+    return False
+  if layout.channel != channel or not set(layout.rows).issubset(timelines):
+    return False
+  return all(len(timelines[name].journal) >= rows and
+             len(timelines[name].journal.names) >= layout.names[name] and
+             len(timelines[name].snapshot_states) >= layout.snapshots[name] for name, rows in layout.rows.items())
+
+
+def write_journals(
+    f: typing.BinaryIO,
+    timelines: typing.Dict[str, typing.Any],
+    identity: PfLogIdentity,
+    activities: typing.Optional[typing.Dict[str, typing.Any]],
+    validation: typing.Optional[dict],
+    layout: PfCacheLayout) -> PfCacheLayout:
+  # записи журналов, названия и снимки, которых ещё нет в файле
+  segments: typing.List[dict] = []
+  for channel, timeline in timelines.items():
+    rows: int = layout.rows.get(channel, 0)
+    names: int = layout.names.get(channel, 0)
+    snapshots: int = layout.snapshots.get(channel, 0)
+    if len(timeline.journal) == rows and len(timeline.snapshot_states) == snapshots and channel in layout.rows:
+      continue
+    segments.append({
+      'channel': channel,
+      'count': len(timeline.journal) - rows,
+      'names': timeline.journal.names[names:],
+      'snapshots': [[row, len(state)] for row, state in
+                    zip(timeline.snapshot_rows[snapshots:], timeline.snapshot_states[snapshots:])],
+    })
+  if segments:
+    write_section(f, b'J', {'journals': segments})
+    for segment in segments:
+      timeline = timelines[segment['channel']]
+      rows = layout.rows.get(segment['channel'], 0)
+      for _, column in timeline.journal.columns():
+        column[rows:].tofile(f)
+      for state in timeline.snapshot_states[layout.snapshots.get(segment['channel'], 0):]:
+        f.write(state)
+  trailer_offset: int = f.tell()
+  states: typing.Dict[str, bytes] = {
+    channel: marshal.dumps(timeline.storage.dump_state()) for channel, timeline in timelines.items()}
+  if activities is not None:
+    for activity in activities.values():
+      activity.flush()
+  write_section(f, b'T', {
+    'identity': identity._asdict(),
+    'states': [[channel, len(state)] for channel, state in states.items()],
+    'activity': None if activities is None else [
+      {'channel': channel, 'bucket': activity.bucket, 'count': activity.size, 'characters': activity.characters}
+      for channel, activity in activities.items()],
+    'validation': validation,
+  })
+  for state in states.values():
+    f.write(state)
+  if activities is not None:
+    for activity in activities.values():
+      activity.save(f)
+  return PfCacheLayout(
+    {channel: len(timeline.journal) for channel, timeline in timelines.items()},
+    {channel: len(timeline.journal.names) for channel, timeline in timelines.items()},
+    {channel: len(timeline.snapshot_states) for channel, timeline in timelines.items()},
+    layout.channel,
+    trailer_offset,
+    f.tell())
+
+
+def load_cache(filename: str) -> typing.Optional[PfCache]:
+  """ returns journals, snapshots and final states of the storages of the channels, identity of the log,
+  activity of the characters by channels (None if it isn't cached) and anomalies of the log, None if cache is missing, damaged or has
+  incompatible format
+  """
+  if not os.path.isfile(filename):
+    return None
+  try:
+    with open(filename, 'rb') as f:
+      return read_cache(f)
+  except (OSError, EOFError, ValueError, KeyError, IndexError, TypeError):
+    return None
+
+
+def read_cache(f: typing.BinaryIO) -> typing.Optional[PfCache]:
+  if f.read(len(CACHE_MAGIC)) != CACHE_MAGIC:
+    return None
+  tag, header = read_section(f)
+  if tag != b'H' or header.get('version') != CACHE_VERSION or header.get('marshal') != marshal.version:
+    return None
+  if header['columns'] != [[name, code, array.array(code).itemsize] for name, code in PfEventColumns.COLUMNS]:
+    return None
+  journals: typing.Dict[str, PfEventColumns] = {}
+  snapshot_rows: typing.Dict[str, array.array] = {}
+  snapshot_states: typing.Dict[str, typing.List[bytes]] = {}
+  while True:
+    offset: int = f.tell()
+    tag, section = read_section(f)
+    if tag == b'T':
+      break
+    if tag != b'J':
+      return None
+    for segment in section['journals']:
+      channel: str = segment['channel']
+      columns: typing.Optional[PfEventColumns] = journals.get(channel)
+      if columns is None:
+        columns = journals[channel] = PfEventColumns()
+        snapshot_rows[channel] = array.array('q')
+        snapshot_states[channel] = []
+      for _, column in columns.columns():
+        part: array.array = array.array(column.typecode)
+        part.fromfile(f, segment['count'])
+        if header['byteorder'] != sys.byteorder:
+          part.byteswap()
+        column.extend(part)
+      for name in segment['names']:
+        columns.name_ids[name] = len(columns.names)
+        columns.names.append(name)
+      for row, size in segment['snapshots']:
+        snapshot_rows[channel].append(row)
+        snapshot_states[channel].append(read_bytes(f, size))
+  # итоговые состояния декодируются здесь же, чтобы повреждённый кеш был отброшен (и построен заново) целиком
+  states: typing.Dict[str, dict] = {channel: marshal.loads(read_bytes(f, size)) for channel, size in section['states']}
+  activities: typing.Optional[typing.Dict[str, typing.Any]] = None
+  if section['activity'] is not None:
+    try:
+      import pf_activity
+    except ImportError:  # numpy не установлен
+      return None
+    activities = {}
+    for activity in section['activity']:
+      activities[activity['channel']] = pf_activity.PfActivity.load(
+        f, activity['bucket'], activity['count'], activity['characters'])
+  size: int = f.tell()
+  if f.read(1) or set(states) != set(journals):
+    return None
+  layout: PfCacheLayout = PfCacheLayout(
+    {channel: len(columns) for channel, columns in journals.items()},
+    {channel: len(columns.names) for channel, columns in journals.items()},
+    {channel: len(states) for channel, states in snapshot_states.items()},
+    header['channel'],
+    offset,
+    size)
+  return PfCache(
+    PfLogIdentity(**section['identity']),
+    header['channel'],
+    journals,
+    snapshot_rows,
+    snapshot_states,
+    states,
+    activities,
+    section['validation'],
+    layout)
+
+
+def check_log_identity(filename: str, identity: PfLogIdentity) -> typing.Optional[str]:
+  """ compares log file with the identity stored in cache: returns 'same' if log is unchanged, 'grown' if the log
+  was just appended after the cached offset, and None if cache is outdated
+  """
+  st = os.stat(filename)
+  if st.st_size == identity.size and st.st_mtime_ns == identity.mtime_ns and identity.offset == identity.size:
+    return 'same'
+  if st.st_size <= identity.offset:
+    return None  # лог урезан, заменён или переписан
+  if pf_reader.detect_compression(filename) is not None:
+    return None  # сжатый лог дочитать с середины нельзя
+  current: PfLogIdentity = get_log_identity(filename, identity.offset)
+  if current.head_hash != identity.head_hash or current.tail_hash != identity.tail_hash:
+    return None
+  return 'grown'
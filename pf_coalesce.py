@@ -0,0 +1,158 @@
+# -*- encoding: utf-8 -*-
+""" Coalescing of the map events
+
+Events of the same object which follow each other within the window (seconds) are folded into the single net change
+before they are applied to the map: successive updates are merged into one update (old values of the first one and new
+values of the last one, fields returned to their old values are dropped along with the update which doesn't change
+anything), repeated deletions (browser resends cascaded deletions of the same systems) are dropped, and connections or
+signatures created and deleted within the window are not passed at all (with their updates between). Merged event takes
+position and datetime of the last folded one, so events stay in chronological order.
+"""
+import typing
+import datetime
+import collections
+
+import pf_events
+
+DEFAULT_WINDOW: int = 0  # секунд, 0 - события одной секунды (время записей в логе округляется до секунды)
+
+PfEventKey = typing.Tuple[typing.Optional[str], str, int]
+
+
+class PfCoalescer:
+  def __init__(self, window: int = DEFAULT_WINDOW):
+    self.window: datetime.timedelta = datetime.timedelta(seconds=window)
+    # ячейки ожидающих событий в порядке поступления (ячейка события, поглощённого другим, пуста)
+    self.pending: typing.Deque[typing.List[typing.Optional[pf_events.PfEvent]]] = collections.deque()
+    # ячейка последнего ожидающего события объекта
+    self.index: typing.Dict[PfEventKey, typing.List[typing.Optional[pf_events.PfEvent]]] = {}
+    # ячейки ожидающих событий объекта, созданного в пределах окна (создание отменяется удалением объекта), первая из
+    # них - ячейка события о создании
+    self.created: typing.Dict[PfEventKey, typing.List[typing.List[typing.Optional[pf_events.PfEvent]]]] = {}
+    self.received: int = 0
+    self.passed: int = 0
+
+  def push(self, event: pf_events.PfEvent) -> typing.Iterator[pf_events.PfEvent]:
+    """ takes the next event, yields events which went out of the window """
+    self.received += 1
+    while self.pending:
+      head: typing.Optional[pf_events.PfEvent] = self.pending[0][0]
+      if head is not None and head.dt + self.window >= event.dt:
+        break
+      yield from self.pop()
+    key: typing.Optional[PfEventKey] = key_of(event)
+    try:
+      self.barrier(event)
+    except (KeyError, TypeError, ValueError, AttributeError):
+      key = None  # запись неожиданной структуры передаётся как есть
+    slot: typing.Optional[typing.List[typing.Optional[pf_events.PfEvent]]] = self.index.get(key) if key else None
+    previous: typing.Optional[pf_events.PfEvent] = slot[0] if slot else None
+    if previous is not None:
+      if previous.action == 'updated' and event.action == 'updated' and self.mergeable(previous, event):
+        slot[0] = None
+        event = merge(previous, event)
+        if not event.main:
+          # изменения вернули объект в прежнее состояние
+          del self.index[key]
+          return
+      elif previous.action == 'deleted' and event.action == 'deleted' and \
+           previous.path_base == event.path_base and set(event.path_ids or ()).issubset(previous.path_ids or ()):
+        return
+    if key and event.action == 'deleted' and event.message_type != 'system':
+      # удаление системы удаляет и её связи, поэтому пара созданная/удалённая система сохраняется
+      created: typing.Optional[typing.List[typing.List[typing.Optional[pf_events.PfEvent]]]] = self.created.pop(key, None)
+      if created is not None:
+        for s in created:
+          s[0] = None
+        self.index.pop(key, None)
+        return
+    slot = [event]
+    self.pending.append(slot)
+    if key:
+      self.index[key] = slot
+      if event.action == 'created' and event.message_type != 'system':
+        # повторное создание объекта (например в пересекающихся логах) не отменяется
+        if previous is None and key not in self.created:
+          self.created[key] = [slot]
+        else:
+          self.created.pop(key, None)
+      elif key in self.created:
+        self.created[key].append(slot)
+
+  def barrier(self, event: pf_events.PfEvent):
+    # события, затрагивающие другие объекты, не позволяют переносить через себя изменения этих объектов (или
+    # отменять их создание), повторные удаления отбрасываются и после таких событий
+    if event.action == 'deleted' and event.message_type == 'system' and event.path_ids:
+      for id in event.path_ids:
+        self.release((event.channel_name, 'system', int(id)))
+    elif event.message_type == 'signature' and isinstance(event.main, dict) and 'connectionId' in event.main:
+      connection_id = event.main['connectionId'].get('new') or event.main['connectionId'].get('old')
+      if connection_id:
+        self.release((event.channel_name, 'connection', int(connection_id)))
+
+  def release(self, key: PfEventKey):
+    slot: typing.Optional[typing.List[typing.Optional[pf_events.PfEvent]]] = self.index.get(key)
+    if slot is not None and slot[0].action != 'deleted':
+      del self.index[key]
+    self.created.pop(key, None)
+
+  @staticmethod
+  def mergeable(previous: pf_events.PfEvent, event: pf_events.PfEvent) -> bool:
+    # связь сигнатуры с соединением зависит от наличия соединения в момент изменения, а активация системы равносильна
+    # её созданию, поэтому такие изменения не переносятся
+    return isinstance(previous.main, dict) and isinstance(event.main, dict) and \
+      'connectionId' not in previous.main and 'connectionId' not in event.main and \
+      'active' not in previous.main and 'active' not in event.main and \
+      all(isinstance(value, dict) for value in previous.main.values()) and \
+      all(isinstance(value, dict) for value in event.main.values())
+
+  def pop(self) -> typing.Iterator[pf_events.PfEvent]:
+    slot: typing.List[typing.Optional[pf_events.PfEvent]] = self.pending.popleft()
+    event: typing.Optional[pf_events.PfEvent] = slot[0]
+    if event is None:
+      return
+    key: typing.Optional[PfEventKey] = key_of(event)
+    if key and self.index.get(key) is slot:
+      del self.index[key]
+    if key and key in self.created and self.created[key][0] is slot:
+      del self.created[key]
+    self.passed += 1
+    yield event
+
+  def flush(self) -> typing.Iterator[pf_events.PfEvent]:
+    """ yields all pending events """
+    while self.pending:
+      yield from self.pop()
+
+
+def key_of(event: pf_events.PfEvent) -> typing.Optional[PfEventKey]:
+  try:
+    return event.channel_name, event.message_type, int(event.objct['objId'])
+  except (KeyError, TypeError, ValueError):
+    return None
+
+
+def merge(previous: pf_events.PfEvent, event: pf_events.PfEvent) -> pf_events.PfEvent:
+  """ returns update of the object with old values of the previous update and new values of the event (fields which
+  returned to their old values are dropped)
+  """
+  main: dict = {}
+  for name, value in previous.main.items():
+    new = event.main[name].get('new') if name in event.main else value.get('new')
+    if new != value.get('old'):
+      main[name] = {'old': value.get('old'), 'new': new}
+  for name, value in event.main.items():
+    if name not in previous.main:
+      main[name] = value
+  return event._replace(main=main)
+
+
+def iter_coalesced(
+    events: typing.Iterable[pf_events.PfEvent],
+    window: int = DEFAULT_WINDOW,
+    coalescer: typing.Optional[PfCoalescer] = None) -> typing.Iterator[pf_events.PfEvent]:
+  """ yields coalesced events (see PfCoalescer) """
+  c: PfCoalescer = coalescer if coalescer is not None else PfCoalescer(window)
+  for event in events:
+    yield from c.push(event)
+  yield from c.flush()
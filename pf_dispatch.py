@@ -0,0 +1,55 @@
+# -*- encoding: utf-8 -*-
+""" Table-driven dispatch of the map events
+
+Handlers are registered by (message_type, path_base, action) key, path_base can be omitted to handle events of any
+path. Message types of the registered handlers are accepted by pf_events.normalize_record, so new kinds of records are
+handled without changes of the core code. Handlers found for the key are resolved once and cached, so dispatching of the event costs one dict lookup
+instead of the chain of string comparisons.
+"""
+import typing
+
+import pf_events
+
+ANY_PATH: typing.Optional[str] = None  # обработчик событий с любым extra.path
+
+PfHandler = typing.Callable[[pf_events.PfEvent], None]
+PfHandlerKey = typing.Tuple[str, typing.Optional[str], str]
+
+
+class PfDispatcher:
+  def __init__(self):
+    self.handlers: typing.Dict[PfHandlerKey, typing.List[PfHandler]] = {}
+    # обработчики, найденные для ключей встречавшихся событий (с учётом обработчиков любого пути)
+    self.resolved: typing.Dict[PfHandlerKey, typing.Tuple[PfHandler, ...]] = {}
+
+  def register(self,
+               message_type: str,
+               action: str,
+               handler: PfHandler,
+               path_base: typing.Optional[str] = ANY_PATH):
+    """ registers handler of the events, handlers of the same key are called in the order of registration, handlers
+    of the exact path_base are called before handlers of any path
+    """
+    self.handlers.setdefault((message_type, path_base, action), []).append(handler)
+    self.resolved.clear()
+    # записи нового типа больше не отбрасываются при нормализации как записи неизвестного формата
+    pf_events.g_message_types.add(message_type)
+
+  def resolve(self, key: PfHandlerKey) -> typing.Tuple[PfHandler, ...]:
+    message_type, path_base, action = key
+    handlers: typing.List[PfHandler] = []
+    if path_base is not ANY_PATH:
+      handlers.extend(self.handlers.get(key, []))
+    handlers.extend(self.handlers.get((message_type, ANY_PATH, action), []))
+    self.resolved[key] = tuple(handlers)
+    return self.resolved[key]
+
+  def dispatch(self, event: pf_events.PfEvent) -> int:
+    """ calls handlers of the event, returns number of called handlers """
+    key: PfHandlerKey = (event.message_type, event.path_base, event.action)
+    handlers: typing.Optional[typing.Tuple[PfHandler, ...]] = self.resolved.get(key)
+    if handlers is None:
+      handlers = self.resolve(key)
+    for handler in handlers:
+      handler(event)
+    return len(handlers)
@@ -0,0 +1,182 @@
+# -*- encoding: utf-8 -*-
+""" Pathfinder log events: normalization of the decoded log records
+"""
+import typing
+import datetime
+
+import pf_reader
+from pf_reader import PfRecord, PfLogError
+
+
+class PfEvent(typing.NamedTuple):
+  action: str  # created, updated, deleted
+  message_type: str  # system, connection, signature
+  message_id: str
+  channel_name: typing.Optional[str]
+  dt: datetime.datetime
+  character: dict
+  objct: dict
+  main: typing.Union[dict, list, None]
+  path_base: typing.Optional[str]
+  path_ids: typing.Optional[typing.List[str]]
+  formatted: str
+  obj: typing.Optional[dict]  # исходная запись (может быть опущена при передаче между процессами)
+
+
+# типы сообщений, записи которых передаются карте: основные типы и типы, обработчики которых зарегистрированы в
+# диспетчере (pf_dispatch.PfDispatcher.register), записи остальных типов считаются записями неизвестного формата
+g_message_types: typing.Set[str] = {'system', 'signature', 'connection'}
+
+# пути, которые не содержат идентификаторов объектов
+PLAIN_PATHS: typing.FrozenSet[str] = frozenset([
+  '/cron/deleteEolConnections',
+  '/cron/deleteExpiredConnections',
+  '/api/Map/updateData',
+  '/api/Map/updateUserData',
+  '/api/Map/updateUnloadData',
+])
+# пути, в которых после базовой части через '/' перечисляются номера объектов (м.б. пустым списком)
+PATHS_WITH_IDS: typing.Tuple[str, ...] = (
+  '/api/rest/Connection',
+  '/api/rest/System',
+  '/api/rest/Signature',
+)
+# разобранные пути повторяются (в т.ч. с одними и теми же номерами объектов), поэтому результат разбора кешируется
+PATH_CACHE_SIZE: int = 4096
+g_path_cache: typing.Dict[str, typing.Tuple[str, typing.Optional[typing.List[str]]]] = {}
+
+
+def split_path(path: str, obj: typing.Optional[dict]) -> typing.Optional[typing.Tuple[str, typing.Optional[typing.List[str]]]]:
+  """ returns base of the path and list of object ids (the list is shared between events and must not be changed) """
+  res: typing.Optional[typing.Tuple[str, typing.Optional[typing.List[str]]]] = g_path_cache.get(path)
+  if res is not None:
+    return res
+  if path in PLAIN_PATHS:
+    res = path, None
+  else:
+    for path_base in PATHS_WITH_IDS:
+      if path.startswith(path_base):
+        path_ids = path[len(path_base)+1:]
+        res = path_base, [] if not path_ids else path_ids.split(',')
+        break
+  if res is not None:
+    if len(g_path_cache) >= PATH_CACHE_SIZE:
+      g_path_cache.clear()
+    g_path_cache[path] = res
+    return res
+  if path.startswith('/api/rest/Map/'):  # создание карты
+    return None
+  raise PfLogError('Unknown extra.path:', obj)
+
+
+def classify(message_type: str, main, formatted: str, obj: typing.Optional[dict]) -> str:
+  if not main or main.get('active') and main['active']['old'] and not main['active']['new']:
+    if not formatted.startswith("Deleted "+message_type):
+      raise PfLogError('Unknown deletion:', obj)
+    return 'deleted'
+  # определяем тип воздействия update-or-create
+  updation: bool = False
+  for key in main.keys():
+    # перехватываем те события, которые прямо свидетельствуют, что объект уже есть
+    if message_type == 'signature':
+      if key in ['connectionId']:
+        updation = True
+        break
+    elif message_type == 'system':
+      if key in ['description']:
+        updation = True
+        break
+    elif message_type == 'connection':
+      if key in ['sourceEndpointType','targetEndpointType']:
+        updation = True
+        break
+    if main[key]['old'] is not None:
+      updation = True
+      break
+  if updation:
+    if not formatted.startswith("Updated "+message_type):
+      raise PfLogError('Unknown updation:', obj)
+    return 'updated'
+  if not formatted.startswith("Created "+message_type):
+    raise PfLogError('Unknown creation:', obj)
+  return 'created'
+
+
+def normalize_record(
+    rec: PfRecord,
+    channel_filter: pf_reader.PfChannelFilter,
+    keep_obj: bool = True,
+    message_types: typing.Optional[typing.AbstractSet[str]] = None) -> typing.Optional[PfEvent]:
+  """ converts decoded log record into the map event, returns None for records to be skipped, raises PfLogError
+  for records of unknown format
+  """
+  if channel_filter is not None:
+    if rec.channel_name not in channel_filter:
+      return None
+  message_type: str = rec.message_type
+  if message_type == 'map':
+    return None
+  if message_type not in (g_message_types if message_types is None else message_types):
+    raise PfLogError('Unknown message_type:', rec.obj)
+  try:
+    path = split_path(rec.path, rec.obj)
+    if path is None:
+      return None
+    action: str = classify(message_type, rec.main, rec.formatted, rec.obj)
+  except (KeyError, IndexError, TypeError, ValueError, AttributeError) as e:
+    # поля main, formatted или extra.path неожиданного типа (или без ключей old/new)
+    raise PfLogError('Malformed record ({}):'.format(type(e).__name__), rec.obj)
+  return PfEvent(
+    action,
+    message_type,
+    rec.message_id,
+    rec.channel_name,
+    rec.dt,
+    rec.character,
+    rec.objct,
+    rec.main,
+    path[0],
+    path[1],
+    rec.formatted,
+    rec.obj if keep_obj else None)
+
+
+def iter_events(
+    filename: str,
+    channel_filter: pf_reader.PfChannelFilter,
+    start: int = 0,
+    end: typing.Optional[int] = None,
+    on_error: typing.Optional[typing.Callable[[PfLogError], None]] = None) -> typing.Iterator[PfEvent]:
+  """ yields events of the log, records of unknown format are passed to on_error and skipped (if it is set) """
+  # большая часть строк лога относится к другим каналам, их отбрасываем ещё до разбора json
+  prefilter = pf_reader.make_prefilter(channel_filter)
+  for line in pf_reader.iter_lines(filename, prefilter, start, end):
+    try:
+      event: typing.Optional[PfEvent] = normalize_record(pf_reader.decode_line(line), channel_filter)
+    except PfLogError as e:
+      if on_error is None:
+        raise
+      on_error(e)
+      continue
+    if event is not None:
+      yield event
+
+
+def iter_line_events(
+    lines: typing.Iterable[bytes],
+    channel_filter: pf_reader.PfChannelFilter,
+    on_error: typing.Optional[typing.Callable[[PfLogError], None]] = None) -> typing.Iterator[PfEvent]:
+  """ yields events of the lines of the log (e.g. received over network) """
+  prefilter = pf_reader.make_prefilter(channel_filter)
+  for line in lines:
+    if not prefilter(line) or not line.strip():
+      continue
+    try:
+      event: typing.Optional[PfEvent] = normalize_record(pf_reader.decode_line(line), channel_filter)
+    except PfLogError as e:
+      if on_error is None:
+        raise
+      on_error(e)
+      continue
+    if event is not None:
+      yield event
@@ -0,0 +1,268 @@
+# -*- encoding: utf-8 -*-
+""" Fetching of the Pathfinder logs from the server
+
+The log is mirrored into the local file: only bytes after the end of the local copy are requested (HTTP Range), the
+received bytes are appended to the local file and passed to the parser as they arrive. The local copy overlaps the
+requested range by a small window, so replacement of the log on the server (rotation) is detected by comparison of the
+overlapping bytes, then the local copy is kept under the name of the rotated log (<name>.1) and the log is fetched
+again. Requests are sent over one HTTP/1.1 connection kept alive between refreshes (asyncio streams).
+"""
+import os
+import ssl
+import typing
+import asyncio
+import urllib.parse
+
+OVERLAP: int = 4096  # байт локальной копии, запрашиваемых повторно для сверки с сервером
+READ_CHUNK_SIZE: int = 256 * 1024
+USER_AGENT: str = 'q.pftm'
+
+
+class PfFetchError(Exception):
+  pass
+
+
+class PfFetchReset(PfFetchError):
+  """ log on the server doesn't continue the local copy (it was rotated or rewritten) """
+  pass
+
+
+class PfHttpResponse:
+  def __init__(self, connection: 'PfHttpConnection', status: int, headers: typing.Dict[str, str]):
+    self.connection: PfHttpConnection = connection
+    self.status: int = status
+    self.headers: typing.Dict[str, str] = headers  # названия заголовков в нижнем регистре
+
+  async def iter_body(self) -> typing.AsyncIterator[bytes]:
+    reader: asyncio.StreamReader = self.connection.reader
+    if 'chunked' in self.headers.get('transfer-encoding', '').lower():
+      while True:
+        size: int = int((await reader.readline()).split(b';', 1)[0].strip(), 16)
+        if size == 0:
+          # завершающие заголовки (trailer) не используются
+          while (await reader.readline()).strip():
+            pass
+          break
+        while size > 0:
+          chunk: bytes = await reader.read(min(size, READ_CHUNK_SIZE))
+          if not chunk:
+            raise PfFetchError('Connection closed while receiving the log')
+          size -= len(chunk)
+          yield chunk
+        await reader.readexactly(2)
+    elif 'content-length' in self.headers:
+      left: int = int(self.headers['content-length'])
+      while left > 0:
+        chunk = await reader.read(min(left, READ_CHUNK_SIZE))
+        if not chunk:
+          raise PfFetchError('Connection closed while receiving the log')
+        left -= len(chunk)
+        yield chunk
+    else:
+      # длина ответа не указана, он заканчивается закрытием соединения
+      while True:
+        chunk = await reader.read(READ_CHUNK_SIZE)
+        if not chunk:
+          break
+        yield chunk
+      await self.connection.close()
+      return
+    if self.headers.get('connection', '').lower() == 'close':
+      await self.connection.close()
+
+  async def discard(self):
+    async for _ in self.iter_body():
+      pass
+
+
+class PfHttpConnection:
+  """ HTTP/1.1 connection to the server kept alive between requests """
+  def __init__(self, url: str):
+    parts: urllib.parse.SplitResult = urllib.parse.urlsplit(url)
+    if parts.scheme not in ('http', 'https') or not parts.hostname:
+      raise PfFetchError('Unsupported url: {}'.format(url))
+    self.host: str = parts.hostname
+    self.port: int = parts.port or (443 if parts.scheme == 'https' else 80)
+    self.ssl: typing.Optional[ssl.SSLContext] = ssl.create_default_context() if parts.scheme == 'https' else None
+    self.target: str = (parts.path or '/') + ('?' + parts.query if parts.query else '')
+    self.reader: typing.Optional[asyncio.StreamReader] = None
+    self.writer: typing.Optional[asyncio.StreamWriter] = None
+
+  async def connect(self):
+    if self.writer is None or self.writer.is_closing():
+      self.reader, self.writer = await asyncio.open_connection(self.host, self.port, ssl=self.ssl)
+
+  async def close(self):
+    if self.writer is not None:
+      self.writer.close()
+      try:
+        await self.writer.wait_closed()
+      except (ConnectionError, ssl.SSLError):
+        pass
+      self.reader = self.writer = None
+
+  async def get(self, headers: typing.Dict[str, str]) -> PfHttpResponse:
+    request: str = 'GET {} HTTP/1.1\r\nHost: {}\r\nUser-Agent: {}\r\nAccept-Encoding: identity\r\n'.format(
+      self.target, self.host if self.port in (80, 443) else '{}:{}'.format(self.host, self.port), USER_AGENT)
+    request += ''.join('{}: {}\r\n'.format(name, value) for name, value in headers.items()) + '\r\n'
+    # сервер мог закрыть простаивающее соединение, тогда запрос повторяется через новое
+    for attempt in range(2):
+      await self.connect()
+      try:
+        self.writer.write(request.encode('latin-1'))
+        await self.writer.drain()
+        status_line: bytes = await self.reader.readline()
+        if not status_line:
+          raise ConnectionResetError()
+        break
+      except ConnectionError:
+        await self.close()
+        if attempt:
+          raise
+    parts: typing.List[bytes] = status_line.split(None, 2)
+    if len(parts) < 2 or not parts[0].startswith(b'HTTP/'):
+      raise PfFetchError('Unexpected response: {!r}'.format(status_line))
+    response_headers: typing.Dict[str, str] = {}
+    while True:
+      line: bytes = await self.reader.readline()
+      if not line.strip():
+        break
+      name, _, value = line.decode('latin-1').partition(':')
+      response_headers[name.strip().lower()] = value.strip()
+    if parts[0] == b'HTTP/1.0' and response_headers.get('connection', '').lower() != 'keep-alive':
+      response_headers.setdefault('connection', 'close')
+    return PfHttpResponse(self, int(parts[1]), response_headers)
+
+
+def parse_content_range(value: typing.Optional[str]) -> typing.Tuple[typing.Optional[int], typing.Optional[int]]:
+  # 'bytes 100-199/1000' -> (100, 1000), 'bytes */1000' -> (None, 1000)
+  if not value or not value.startswith('bytes '):
+    return None, None
+  byte_range, _, total = value[6:].partition('/')
+  start: typing.Optional[int] = None if byte_range == '*' else int(byte_range.split('-', 1)[0])
+  return start, None if total in ('', '*') else int(total)
+
+
+class PfRemoteLog:
+  """ local copy of the log on the server """
+  def __init__(self, url: str, filename: str):
+    self.url: str = url
+    self.filename: str = filename
+    self.connection: PfHttpConnection = PfHttpConnection(url)
+    self.received: int = 0  # байт получено за всё время (без учёта сверяемого окна)
+
+  async def fetch(self, on_data: typing.Optional[typing.Callable[[bytes], None]] = None) -> int:
+    """ appends bytes of the log written after the end of the local copy to the local file and passes them to
+    on_data as they arrive, returns number of new bytes, raises PfFetchReset if log on the server was replaced
+    """
+    size: int = os.path.getsize(self.filename) if os.path.exists(self.filename) else 0
+    start: int = max(0, size - OVERLAP)
+    with open(self.filename, 'ab+') as f:
+      f.seek(start)
+      overlap: bytes = f.read(size - start)
+      response: PfHttpResponse = await self.connection.get({'Range': 'bytes={}-'.format(start)})
+      if response.status == 416:
+        # новых байт нет (или лог на сервере стал короче локальной копии)
+        await response.discard()
+        total: typing.Optional[int] = parse_content_range(response.headers.get('content-range'))[1]
+        if total is not None and total < size:
+          raise PfFetchReset('Log on the server is shorter than the local copy')
+        return 0
+      if response.status == 206:
+        skip: typing.Optional[int] = parse_content_range(response.headers.get('content-range'))[0]
+        if skip != start:
+          await self.connection.close()
+          raise PfFetchError('Unexpected range of the response: {}'.format(response.headers.get('content-range')))
+        skip = 0
+      elif response.status == 200:
+        skip = start  # сервер не поддерживает Range, начало лога пропускается
+      else:
+        await response.discard()
+        raise PfFetchError('Unable to fetch {}: HTTP {}'.format(self.url, response.status))
+      verified: int = 0
+      received: int = 0
+      async for chunk in response.iter_body():
+        if skip:
+          skipped: int = min(skip, len(chunk))
+          chunk = chunk[skipped:]
+          skip -= skipped
+        if verified < len(overlap) and chunk:
+          # начало ответа должно совпасть с концом локальной копии
+          part: bytes = chunk[:len(overlap) - verified]
+          if part != overlap[verified:verified + len(part)]:
+            await self.connection.close()
+            raise PfFetchReset('Log on the server differs from the local copy')
+          verified += len(part)
+          chunk = chunk[len(part):]
+        if chunk:
+          f.write(chunk)
+          f.flush()
+          received += len(chunk)
+          if on_data is not None:
+            on_data(chunk)
+      if verified < len(overlap):
+        raise PfFetchReset('Log on the server is shorter than the local copy')
+    self.received += received
+    return received
+
+  async def close(self):
+    await self.connection.close()
+
+
+def rotate_local_copy(filename: str) -> str:
+  """ renames local copy of the replaced log to <filename>.1 (copies rotated earlier are shifted to .2, .3 and so on),
+  returns new name of the copy
+  """
+  count: int = 1
+  while os.path.exists('{}.{}'.format(filename, count)):
+    count += 1
+  for n in range(count, 1, -1):
+    os.replace('{}.{}'.format(filename, n - 1), '{}.{}'.format(filename, n))
+  rotated: str = filename + '.1'
+  os.replace(filename, rotated)
+  open(filename, 'wb').close()
+  return rotated
+
+
+class PfLineBuffer:
+  """ splits received bytes into complete lines of the log """
+  def __init__(self, head: bytes = b''):
+    self.tail: bytes = head  # начало последней, ещё не полученной целиком строки
+    self.consumed: int = 0  # байт в строках, полученных целиком (с учётом head)
+
+  def feed(self, chunk: bytes) -> typing.List[bytes]:
+    data: bytes = self.tail + chunk
+    eol: int = data.rfind(b'\n')
+    if eol < 0:
+      self.tail = data
+      return []
+    self.tail = data[eol + 1:]
+    self.consumed += eol + 1
+    return data[:eol + 1].splitlines(keepends=True)
+
+
+async def follow(
+    remote: PfRemoteLog,
+    follower,
+    poll_interval: float = 1.0,
+    on_reset: typing.Optional[typing.Callable[[], None]] = None):
+  """ periodically fetches new bytes of the remote log and applies them with follower (pf_follow.PfFollower) """
+  try:
+    while True:
+      try:
+        await remote.fetch()
+      except PfFetchReset as e:
+        # лог на сервере заменён: прежняя локальная копия сохраняется, а новый лог скачивается и читается с начала
+        print('WARN: {}, the local copy is kept as {}'.format(e, rotate_local_copy(remote.filename)))
+        follower.open(0)
+        if on_reset is not None:
+          on_reset()
+        continue
+      except (PfFetchError, OSError) as e:
+        # сервер временно недоступен, попытка повторяется позже
+        print('WARN: unable to fetch {}: {}'.format(remote.url, e))
+        await remote.close()
+      if follower.poll() == 0:
+        await asyncio.sleep(poll_interval)
+  finally:
+    await remote.close()
@@ -0,0 +1,183 @@
+# -*- encoding: utf-8 -*-
+""" Follow (tail) mode for the live Pathfinder logs
+
+New lines of the growing log are applied to the map as soon as they are written by pathfinder. Position in the log
+and state of the maps (storage, activity of the characters and anomalies of the log) are saved to the checkpoint file,
+so restart continues from the saved position without replaying the history. Rotation (log replaced by the new file) and truncation of the log are detected.
+"""
+import os
+import json
+import time
+import typing
+import hashlib
+
+import pf_reader
+import pf_events
+
+CHECKPOINT_SUFFIX: str = '.pftmf'
+CHECKPOINT_VERSION: int = 5
+CHECKPOINT_INTERVAL: float = 10.0  # секунд между сохранениями checkpoint-а
+HEAD_WINDOW: int = 4096  # по хешу начала файла определяется, что лог не был заменён
+READ_CHUNK_SIZE: int = 4 * 1024 * 1024
+
+
+def get_checkpoint_filename(log_filename: str) -> str:
+  return log_filename + CHECKPOINT_SUFFIX
+
+
+def hash_head(f: typing.BinaryIO, offset: int) -> str:
+  f.seek(0)
+  return hashlib.blake2b(f.read(min(HEAD_WINDOW, offset)), digest_size=16).hexdigest()
+
+
+class PfFollower:
+  def __init__(self,
+               filename: str,
+               channel_filter: pf_reader.PfChannelFilter,
+               storage,
+               apply_event: typing.Callable[[pf_events.PfEvent], None],
+               poll_interval: float = 1.0,
+               on_error: typing.Optional[typing.Callable[[pf_events.PfLogError], None]] = None):
+    self.filename: str = filename
+    self.channel_filter: pf_reader.PfChannelFilter = channel_filter
+    self.channel_names: typing.Optional[typing.List[str]] = None if channel_filter is None else sorted(channel_filter)
+    self.storage = storage  # хранилище (или хранилища каналов), должно поддерживать dump_state/load_state
+    self.apply_event: typing.Callable[[pf_events.PfEvent], None] = apply_event
+    self.poll_interval: float = poll_interval
+    self.on_error: typing.Optional[typing.Callable[[pf_events.PfLogError], None]] = on_error
+    self.checkpoint_filename: str = get_checkpoint_filename(filename)
+    self.prefilter: pf_reader.PfPrefilter = pf_reader.make_prefilter(channel_filter)
+    self.f: typing.Optional[typing.BinaryIO] = None
+    self.inode: int = 0
+    self.offset: int = 0
+    self.head_hash: str = ''
+    self.saved_at: float = 0.0
+    self.dirty: bool = False
+
+  def open(self, offset: int):
+    if self.f is not None:
+      self.f.close()
+    self.f = open(self.filename, 'rb')
+    self.inode = os.fstat(self.f.fileno()).st_ino
+    self.offset = offset
+    self.head_hash = hash_head(self.f, offset)
+
+  def close(self):
+    if self.f is not None:
+      self.f.close()
+      self.f = None
+
+  def restore_checkpoint(self) -> bool:
+    """ loads storage state from checkpoint, returns False if there is no checkpoint for the current log file (or
+    checkpoint is damaged, then it is reported and the log is read again)
+    """
+    if not os.path.isfile(self.checkpoint_filename):
+      return False
+    try:
+      with open(self.checkpoint_filename, 'r', encoding='utf-8') as f:
+        checkpoint: dict = json.load(f)
+      if checkpoint.get('version') != CHECKPOINT_VERSION or checkpoint.get('channel') != self.channel_names:
+        return False
+      with open(self.filename, 'rb') as f:
+        st = os.fstat(f.fileno())
+        # лог заменён или урезан, значит прежний checkpoint к нему не относится
+        if st.st_ino != checkpoint['inode'] or st.st_size < checkpoint['offset']:
+          return False
+        if hash_head(f, checkpoint['offset']) != checkpoint['head_hash']:
+          return False
+      self.storage.load_state(checkpoint['storage'])
+    except (OSError, ValueError, KeyError, IndexError, TypeError, AttributeError) as e:
+      # checkpoint не дописан (например, при нехватке места) или повреждён
+      print('WARN: unable to restore checkpoint {} ({}: {}), the log is read again'.format(
+        self.checkpoint_filename, type(e).__name__, e))
+      return False
+    self.open(checkpoint['offset'])
+    return True
+
+  def save_checkpoint(self):
+    checkpoint: dict = {
+      'version': CHECKPOINT_VERSION,
+      'channel': self.channel_names,
+      'inode': self.inode,
+      'offset': self.offset,
+      'head_hash': self.head_hash,
+      'storage': self.storage.dump_state(),
+    }
+    tmp_filename: str = self.checkpoint_filename + '.tmp'
+    with open(tmp_filename, 'w', encoding='utf-8') as f:
+      json.dump(checkpoint, f, ensure_ascii=False)
+    os.replace(tmp_filename, self.checkpoint_filename)
+    self.saved_at = time.monotonic()
+    self.dirty = False
+
+  def read_available(self) -> int:
+    """ applies complete lines written after the current offset, returns number of applied events """
+    applied: int = 0
+    while True:
+      self.f.seek(self.offset)
+      data: bytes = self.f.read(READ_CHUNK_SIZE)
+      # последняя строка может быть записана не полностью, она будет прочитана позже
+      eol: int = data.rfind(b'\n')
+      if eol < 0:
+        if len(data) == READ_CHUNK_SIZE:
+          raise pf_events.PfLogError('Too long line at offset {}:'.format(self.offset), None)
+        return applied
+      head_incomplete: bool = self.offset < HEAD_WINDOW
+      start: int = 0
+      while start <= eol:
+        stop: int = data.find(b'\n', start) + 1
+        line: bytes = data[start:stop]
+        start = stop
+        if self.prefilter(line) and line.strip():
+          try:
+            event: typing.Optional[pf_events.PfEvent] = pf_events.normalize_record(
+              pf_reader.decode_line(line),
+              self.channel_filter)
+          except pf_events.PfLogError as e:
+            if self.on_error is None:
+              raise
+            self.on_error(e)
+            event = None
+          if event is not None:
+            self.apply_event(event)
+            applied += 1
+        # позиция сдвигается после каждой строки, чтобы checkpoint всегда соответствовал состоянию карты
+        self.offset += len(line)
+        self.dirty = True
+      if head_incomplete:
+        self.head_hash = hash_head(self.f, self.offset)
+
+  def check_rotation(self) -> bool:
+    """ returns True if log was rotated or truncated (reading is restarted from the beginning of the new log) """
+    try:
+      st = os.stat(self.filename)
+    except FileNotFoundError:
+      return False  # лог ещё не создан заново после ротации
+    if st.st_ino != self.inode:
+      # лог переименован, а на его месте создан новый: дочитываем старый и переходим на новый
+      self.read_available()
+      self.open(0)
+      return True
+    if st.st_size < self.offset:
+      # лог урезан (copytruncate)
+      self.open(0)
+      return True
+    return False
+
+  def poll(self) -> int:
+    self.check_rotation()
+    applied: int = self.read_available()
+    if self.dirty and time.monotonic() - self.saved_at >= CHECKPOINT_INTERVAL:
+      self.save_checkpoint()
+    return applied
+
+  def run(self):
+    try:
+      while True:
+        if self.poll() == 0:
+          time.sleep(self.poll_interval)
+    except KeyboardInterrupt:
+      # остановка по Ctrl+C - нормальное завершение режима слежения
+      self.save_checkpoint()
+    finally:
+      self.close()
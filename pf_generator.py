@@ -0,0 +1,273 @@
+#!/usr/bin/python3
+
+""" Q.Pathfinder Time Machine: synthetic log generator
+
+Generates Pathfinder map logs (monolog json lines) of the given size: systems, connections and signatures are
+created, updated and deleted on the maps of several channels with all variants of extra.path which are known to
+pftm, including cron deletions of connections and deletions of several systems by one request. Generated logs are
+used by benchmarks instead of the real logs, which can't be shared.
+
+$ python pf_generator.py --lines=1000000 --seed=1 --channel=SRG-C --channel=OTHER --output=synthetic.log
+"""
+import sys
+import json
+import random
+import typing
+import datetime
+
+import console_app
+
+DEFAULT_CHANNELS: typing.Tuple[str, ...] = ('SRG-C', 'OTHER', 'THIRD')
+CHARACTERS: typing.Tuple[str, ...] = ('Qunibbra Do', 'Qandra Si', 'Pilot A', 'Pilot B', 'Pilot C')
+MAX_SYSTEMS: int = 300  # примерный размер карты, после которого системы чаще удаляются, чем наносятся
+# доли событий разных типов
+WEIGHTS: typing.Tuple[typing.Tuple[str, int], ...] = (
+  ('map', 1),
+  ('created_system', 12),
+  ('updated_system', 10),
+  ('deleted_systems', 5),
+  ('created_connection', 12),
+  ('updated_connection', 8),
+  ('deleted_connection', 5),
+  ('cron_connections', 1),
+  ('created_signature', 20),
+  ('updated_signature', 12),
+  ('deleted_signatures', 6),
+)
+
+
+class PfChannelState:
+  def __init__(self, channel_id: int, channel_name: str):
+    self.channel_id: int = channel_id
+    self.channel_name: str = channel_name
+    self.systems: typing.Dict[int, str] = {}
+    self.archived: typing.Dict[int, str] = {}  # удалённые системы, которые могут быть снова активированы
+    self.connections: typing.Dict[int, typing.Tuple[int, int, str]] = {}  # id -> source, target, scope
+    self.signatures: typing.Dict[int, str] = {}
+
+
+class PfLogGenerator:
+  def __init__(self,
+               seed: int = 1,
+               channels: typing.Iterable[str] = DEFAULT_CHANNELS,
+               started: datetime.datetime = datetime.datetime(2023, 10, 27, 7, 0, 0)):
+    self.random: random.Random = random.Random(seed)
+    self.channels: typing.List[PfChannelState] = [PfChannelState(i + 1, name) for i, name in enumerate(channels)]
+    self.dt: datetime.datetime = started
+    self.next_id: int = 1000
+    self.kinds: typing.List[str] = [kind for kind, _ in WEIGHTS]
+    self.weights: typing.List[int] = [weight for _, weight in WEIGHTS]
+    self.pending: typing.List[str] = []
+
+  def new_id(self) -> int:
+    self.next_id += 1
+    return self.next_id
+
+  def record(self,
+             channel: PfChannelState,
+             message_type: str,
+             name: str,
+             verb: str,
+             main: typing.Union[dict, list],
+             obj_id: int,
+             path: str,
+             same_time: bool = False):
+    # записи одного запроса (например удаление нескольких систем) пишутся одновременно
+    if not same_time:
+      self.dt += datetime.timedelta(microseconds=self.random.randint(0, 3000000))
+    character: str = self.random.choice(CHARACTERS)
+    self.pending.append(json.dumps({
+      'message': "{} '{}'".format(message_type, name),
+      'context': {
+        'tag': 'default',
+        'data': {
+          'main': main,
+          'object': {'objId': obj_id, 'objName': name},
+          'character': {'id': 90000000 + CHARACTERS.index(character), 'name': character},
+          'channel': {'channelId': channel.channel_id, 'channelName': channel.channel_name},
+          'formatted': "{} {} '{}'".format(verb, message_type, name),
+        },
+      },
+      'level': 200,
+      'level_name': 'INFO',
+      'channel': 'map',
+      'datetime': self.dt.strftime('%Y-%m-%dT%H:%M:%S.%f+00:00'),
+      'extra': {'path': path, 'ip': '10.0.0.{}'.format(1 + CHARACTERS.index(character)), 'thumb': {'url': ''}},
+    }, separators=(',', ':')))
+
+  def map(self, c: PfChannelState):
+    # записи о карте pftm пропускает
+    self.record(c, 'map', c.channel_name, 'Updated', {'name': {'old': None, 'new': c.channel_name}},
+                c.channel_id, '/api/rest/Map/{}'.format(c.channel_id))
+
+  def created_system(self, c: PfChannelState):
+    r: random.Random = self.random
+    if c.archived and r.random() < 0.2:
+      # ранее удалённая система снова наносится на карту (переходит из неактивного состояния в активное)
+      obj_id: int = r.choice(list(c.archived))
+      name: str = c.archived.pop(obj_id)
+      c.systems[obj_id] = name
+      self.record(c, 'system', name, 'Updated', {'active': {'old': 0, 'new': 1}}, obj_id,
+                  r.choice(['/api/Map/updateUserData', '/api/rest/System/{}'.format(obj_id)]))
+      return
+    obj_id = self.new_id()
+    name = 'J{:06d}'.format(obj_id % 1000000)
+    c.systems[obj_id] = name
+    main: dict = {'active': {'old': None, 'new': 1}}
+    if r.random() < 0.3:
+      main['statusId'] = {'old': None, 'new': r.randint(1, 6)}
+    if r.random() < 0.1:
+      main['locked'] = {'old': None, 'new': 1}
+    self.record(c, 'system', name, 'Created', main, obj_id, r.choice(['/api/rest/System', '/api/Map/updateUserData']))
+
+  def updated_system(self, c: PfChannelState):
+    r: random.Random = self.random
+    obj_id: int = r.choice(list(c.systems))
+    main: dict = r.choice([
+      {'statusId': {'old': 1, 'new': r.randint(2, 6)}},
+      {'locked': {'old': 0, 'new': 1}},
+      {'description': {'old': None, 'new': 'wormhole {}'.format(obj_id)}},
+      {'alias': {'old': '', 'new': 'home'}},
+      {'rallyPoke': {'old': 0, 'new': 1}},
+    ])
+    path: str = r.choice([
+      '/api/Map/updateUserData', '/api/Map/updateData', '/api/rest/System', '/api/rest/System/{}'.format(obj_id)])
+    self.record(c, 'system', c.systems[obj_id], 'Updated', main, obj_id, path)
+
+  def deleted_systems(self, c: PfChannelState):
+    # одним запросом удаляется одна или несколько систем, вместе с ними удаляются их связи
+    r: random.Random = self.random
+    ids: typing.List[int] = r.sample(list(c.systems), min(len(c.systems), r.choice([1, 1, 1, 2, 3])))
+    path: str = '/api/rest/System/' + ','.join(str(i) for i in ids)
+    for connection_id, (source, target, _) in list(c.connections.items()):
+      if source in ids or target in ids:
+        del c.connections[connection_id]
+        self.record(c, 'connection', 'wh', 'Deleted', [], connection_id, path, same_time=True)
+    for obj_id in ids:
+      name: str = c.systems.pop(obj_id)
+      c.archived[obj_id] = name
+      main: typing.Union[dict, list] = {'active': {'old': 1, 'new': 0}} if r.random() < 0.8 else []
+      self.record(c, 'system', name, 'Deleted', main, obj_id, path, same_time=True)
+
+  def created_connection(self, c: PfChannelState):
+    r: random.Random = self.random
+    source, target = r.sample(list(c.systems), 2)
+    scope: str = 'wh' if r.random() < 0.8 else 'stargate'
+    obj_id: int = self.new_id()
+    c.connections[obj_id] = (source, target, scope)
+    main: dict = {'source': {'old': None, 'new': source}, 'target': {'old': None, 'new': target}}
+    if r.random() < 0.9:
+      main['scope'] = {'old': None, 'new': scope}
+      main['type'] = {'old': None, 'new': '["wh_fresh"]' if scope == 'wh' else '["stargate"]'}
+    self.record(c, 'connection', scope, 'Created', main, obj_id,
+                r.choice(['/api/rest/Connection', '/api/Map/updateUserData']))
+
+  def updated_connection(self, c: PfChannelState):
+    r: random.Random = self.random
+    obj_id: int = r.choice(list(c.connections))
+    source, target, scope = c.connections[obj_id]
+    main: dict = r.choice([
+      {'type': {'old': '["wh_fresh"]', 'new': r.choice(['["wh_fresh","wh_eol"]', '["wh_reduced"]', '["wh_critical"]'])}},
+      {'sourceEndpointType': {'old': None, 'new': '["bubble"]'}},
+      {'targetEndpointType': {'old': None, 'new': '["bubble"]'}},
+      {'source': {'old': source, 'new': source}, 'target': {'old': target, 'new': target}},
+      {'scope': {'old': scope, 'new': scope}},
+    ])
+    path: str = r.choice([
+      '/api/Map/updateUserData', '/api/rest/Connection', '/api/Map/updateData', '/api/Map/updateUnloadData'])
+    self.record(c, 'connection', scope, 'Updated', main, obj_id, path)
+
+  def deleted_connection(self, c: PfChannelState):
+    obj_id: int = self.random.choice(list(c.connections))
+    del c.connections[obj_id]
+    self.record(c, 'connection', 'wh', 'Deleted', [], obj_id, '/api/rest/Connection/{}'.format(obj_id))
+
+  def cron_connections(self, c: PfChannelState):
+    # cron удаляет устаревшие (EOL) и просроченные связи пачкой
+    r: random.Random = self.random
+    path: str = r.choice(['/cron/deleteEolConnections', '/cron/deleteExpiredConnections'])
+    ids: typing.List[int] = r.sample(list(c.connections), min(len(c.connections), r.randint(1, 4)))
+    for n, obj_id in enumerate(ids):
+      del c.connections[obj_id]
+      self.record(c, 'connection', 'wh', 'Deleted', [], obj_id, path, same_time=n > 0)
+
+  def created_signature(self, c: PfChannelState):
+    r: random.Random = self.random
+    obj_id: int = self.new_id()
+    name: str = '{}{}{}-{:03d}'.format(*r.sample('ABCDEFGHIJKLMNOPQRSTUVWXYZ', 3), obj_id % 1000)
+    c.signatures[obj_id] = name
+    main: dict = {
+      'groupId': {'old': None, 'new': r.randint(1, 6)},
+      'typeId': {'old': None, 'new': r.randint(0, 40)},
+      'name': {'old': None, 'new': name},
+      'description': {'old': None, 'new': ''},
+    }
+    self.record(c, 'signature', name, 'Created', main, obj_id, '/api/rest/Signature')
+
+  def updated_signature(self, c: PfChannelState):
+    r: random.Random = self.random
+    obj_id: int = r.choice(list(c.signatures))
+    main: dict = r.choice([
+      {'typeId': {'old': 0, 'new': r.randint(1, 40)}},
+      {'groupId': {'old': 1, 'new': 5}},
+      {'description': {'old': '', 'new': 'data site'}},
+      {'connectionId': {'old': None, 'new': r.choice(list(c.connections)) if c.connections else None}},
+    ])
+    path: str = r.choice(['/api/rest/Signature', '/api/rest/Signature/{}'.format(obj_id)])
+    self.record(c, 'signature', c.signatures[obj_id], 'Updated', main, obj_id, path)
+
+  def deleted_signatures(self, c: PfChannelState):
+    r: random.Random = self.random
+    ids: typing.List[int] = r.sample(list(c.signatures), min(len(c.signatures), r.randint(1, 5)))
+    path: str = '/api/rest/Signature/' + ','.join(str(i) for i in ids)
+    for n, obj_id in enumerate(ids):
+      self.record(c, 'signature', c.signatures.pop(obj_id), 'Deleted', [], obj_id, path, same_time=n > 0)
+
+  def choose(self, c: PfChannelState) -> str:
+    kind: str = self.random.choices(self.kinds, self.weights)[0]
+    # пустая или маленькая карта сначала заполняется, большая - чаще очищается
+    if len(c.systems) < 3:
+      return 'created_system'
+    if len(c.systems) > MAX_SYSTEMS and kind == 'created_system':
+      return 'deleted_systems'
+    if kind in ('updated_connection', 'deleted_connection', 'cron_connections') and not c.connections:
+      return 'created_connection'
+    if kind in ('updated_signature', 'deleted_signatures') and not c.signatures:
+      return 'created_signature'
+    return kind
+
+  def iter_lines(self, count: int) -> typing.Iterator[str]:
+    """ yields count lines of the log """
+    produced: int = 0
+    while produced < count:
+      c: PfChannelState = self.random.choice(self.channels)
+      getattr(self, self.choose(c))(c)
+      for line in self.pending[:count - produced]:
+        yield line
+      produced += min(len(self.pending), count - produced)
+      self.pending.clear()
+
+
+def generate(filename: typing.Optional[str], count: int, seed: int = 1, channels: typing.Iterable[str] = DEFAULT_CHANNELS):
+  """ writes synthetic log into the file (into stdout if filename is None) """
+  generator: PfLogGenerator = PfLogGenerator(seed, channels)
+  f = open(filename, 'w', encoding='utf-8') if filename else sys.stdout
+  try:
+    for line in generator.iter_lines(count):
+      f.write(line)
+      f.write('\n')
+  finally:
+    if filename:
+      f.close()
+
+
+def main():
+  argv_prms = console_app.get_argv_prms(['lines=', 'seed=', 'output='])
+  count: int = int(argv_prms['lines'][-1]) if argv_prms['lines'] else 10000
+  seed: int = int(argv_prms['seed'][-1]) if argv_prms['seed'] else 1
+  channels: typing.List[str] = argv_prms['channels'] if argv_prms['channels'] else list(DEFAULT_CHANNELS)
+  generate(argv_prms['output'][-1] if argv_prms['output'] else None, count, seed, channels)
+
+
+if __name__ == "__main__":
+  main()
@@ -0,0 +1,123 @@
+# -*- encoding: utf-8 -*-
+""" Interval index of the lifetimes of map objects
+
+Every object (system or connection) lives on the map in the interval [at, last), the object can be removed and then
+appear again (e.g. re-activated system), so there can be several lifetimes of one object. Intervals are opened and
+closed in the chronological order, so the starts and the ends of intervals are appended into sorted arrays, and the
+segment tree of maximum ends allows to find the intervals alive at the moment without scanning all of them.
+"""
+import array
+import bisect
+import typing
+
+OPEN_END: int = 2 ** 62  # конец интервала, который ещё не закрыт
+
+
+class PfIntervalIndex:
+  def __init__(self):
+    # интервалы в порядке открытия (по возрастанию начала)
+    self.kinds: array.array = array.array('b')
+    self.obj_ids: array.array = array.array('q')
+    self.starts: array.array = array.array('q')
+    self.ends: array.array = array.array('q')
+    # номера интервалов в порядке закрытия (по возрастанию конца)
+    self.closed: array.array = array.array('q')
+    self.closed_ends: array.array = array.array('q')
+    self.opened: typing.Dict[typing.Tuple[int, int], int] = {}
+    self.lifetimes: typing.Dict[typing.Tuple[int, int], typing.List[int]] = {}
+    # дерево отрезков: в узле максимальный конец интервалов поддерева, листья начинаются с индекса capacity
+    self.capacity: int = 1024
+    self.tree: array.array = array.array('q', [-1]) * (2 * self.capacity)
+
+  def __len__(self) -> int:
+    return len(self.starts)
+
+  def set_tree_end(self, idx: int, end: int):
+    i: int = idx + self.capacity
+    tree: array.array = self.tree
+    tree[i] = end
+    i >>= 1
+    while i:
+      m: int = max(tree[2*i], tree[2*i+1])
+      if tree[i] == m:
+        break
+      tree[i] = m
+      i >>= 1
+
+  def grow_tree(self):
+    self.capacity *= 2
+    tree: array.array = array.array('q', [-1]) * (2 * self.capacity)
+    tree[self.capacity:self.capacity + len(self.ends)] = self.ends
+    for i in range(self.capacity - 1, 0, -1):
+      tree[i] = max(tree[2*i], tree[2*i+1])
+    self.tree = tree
+
+  def open(self, kind: int, obj_id: int, ts: int) -> int:
+    key: typing.Tuple[int, int] = (kind, obj_id)
+    if key in self.opened:
+      self.close(kind, obj_id, ts)
+    idx: int = len(self.starts)
+    if idx >= self.capacity:
+      self.grow_tree()
+    self.kinds.append(kind)
+    self.obj_ids.append(obj_id)
+    self.starts.append(ts)
+    self.ends.append(OPEN_END)
+    self.set_tree_end(idx, OPEN_END)
+    self.opened[key] = idx
+    self.lifetimes.setdefault(key, []).append(idx)
+    return idx
+
+  def close(self, kind: int, obj_id: int, ts: int) -> typing.Optional[int]:
+    idx: typing.Optional[int] = self.opened.pop((kind, obj_id), None)
+    if idx is None:
+      return None
+    self.ends[idx] = ts
+    self.set_tree_end(idx, ts)
+    self.closed.append(idx)
+    self.closed_ends.append(ts)
+    return idx
+
+  def alive_at(self, ts: int) -> typing.List[int]:
+    """ returns numbers of intervals (in the order of their opening) alive at the moment ts """
+    # кандидаты - интервалы, начавшиеся не позже ts, среди них ищем те, что закончились позже ts
+    prefix: int = bisect.bisect_right(self.starts, ts)
+    found: typing.List[int] = []
+    if prefix == 0:
+      return found
+    tree: array.array = self.tree
+    capacity: int = self.capacity
+    stack: typing.List[typing.Tuple[int, int, int]] = [(1, 0, capacity)]
+    while stack:
+      node, lo, hi = stack.pop()
+      if lo >= prefix or tree[node] <= ts:
+        continue
+      if node >= capacity:
+        found.append(lo)
+        continue
+      mid: int = (lo + hi) >> 1
+      stack.append((2*node+1, mid, hi))
+      stack.append((2*node, lo, mid))
+    return found
+
+  def started_between(self, ts1: int, ts2: int) -> range:
+    """ intervals opened in [ts1, ts2] """
+    return range(bisect.bisect_left(self.starts, ts1), bisect.bisect_right(self.starts, ts2))
+
+  def ended_between(self, ts1: int, ts2: int) -> typing.List[int]:
+    """ intervals closed in [ts1, ts2] """
+    lo: int = bisect.bisect_left(self.closed_ends, ts1)
+    hi: int = bisect.bisect_right(self.closed_ends, ts2)
+    return list(self.closed[lo:hi])
+
+  def changed_between(self, ts1: int, ts2: int) -> typing.Tuple[typing.List[int], typing.List[int]]:
+    """ returns intervals opened and closed in [ts1, ts2] """
+    return list(self.started_between(ts1, ts2)), self.ended_between(ts1, ts2)
+
+  def interval(self, idx: int) -> typing.Tuple[int, int, int, typing.Optional[int]]:
+    """ returns kind, object id, start and end (None if object is still alive) of the interval """
+    end: int = self.ends[idx]
+    return self.kinds[idx], self.obj_ids[idx], self.starts[idx], None if end == OPEN_END else end
+
+  def lifetimes_of(self, kind: int, obj_id: int) -> typing.List[int]:
+    return self.lifetimes.get((kind, obj_id), [])
@@ -0,0 +1,132 @@
+# -*- encoding: utf-8 -*-
+""" Incremental force-directed layout of the map
+
+Systems of the map have no coordinates, so they are placed by the force-directed algorithm (Fruchterman-Reingold)
+computed with numpy. The layout is warm-started from the positions of the previous frame and only neighbourhood of
+the systems and connections changed since the previous frame is relaxed, so the picture stays stable and the time
+per frame doesn't grow quadratically with the map.
+"""
+import math
+import typing
+import datetime
+
+import numpy
+
+ITERATIONS: int = 30  # шагов релаксации на кадр
+TEMPERATURE: float = 0.05  # максимальное смещение системы за шаг (в долях от размера картинки)
+GRAVITY: float = 1.5  # притяжение к центру, чтобы несвязанные системы не разлетались по краям
+MIN_DISTANCE: float = 0.02  # минимальная длина связи
+
+
+class PfForceLayout:
+  def __init__(self, iterations: int = ITERATIONS, seed: int = 0):
+    self.iterations: int = iterations
+    self.random: numpy.random.Generator = numpy.random.default_rng(seed)
+    # строки массивов выделяются системам один раз, удалённая система при повторном появлении возвращается на своё
+    # прежнее место
+    self.rows: typing.Dict[int, int] = {}
+    self.ids: typing.List[int] = []
+    self.pos: numpy.ndarray = numpy.zeros((64, 2))
+    self.alive: numpy.ndarray = numpy.zeros(64, dtype=bool)
+    self.placed: numpy.ndarray = numpy.zeros(64, dtype=bool)
+    self.edges: typing.Set[typing.Tuple[int, int]] = set()  # пары строк (меньшая, большая)
+
+  def row_of(self, id: int) -> int:
+    row: typing.Optional[int] = self.rows.get(id)
+    if row is None:
+      row = self.rows[id] = len(self.ids)
+      self.ids.append(id)
+      if row >= len(self.alive):
+        capacity: int = 2 * len(self.alive)
+        self.pos = numpy.resize(self.pos, (capacity, 2))
+        self.alive = numpy.resize(self.alive, capacity)
+        self.alive[row:] = False
+        self.placed = numpy.resize(self.placed, capacity)
+        self.placed[row:] = False
+    return row
+
+  def positions(self, storage, dt: datetime.datetime) -> typing.Dict[int, typing.Tuple[float, float]]:
+    """ returns positions of the systems of storage (PfStorage) in the unit square """
+    changed: typing.Set[int] = set()
+    current: typing.Set[int] = set()
+    for id in storage.systems.keys():
+      row: int = self.row_of(id)
+      current.add(row)
+      if not self.alive[row]:
+        self.alive[row] = True
+        changed.add(row)
+    for row in numpy.flatnonzero(self.alive[:len(self.ids)]).tolist():
+      if row not in current:
+        self.alive[row] = False
+        changed.add(row)
+    edges: typing.Set[typing.Tuple[int, int]] = set()
+    systems = storage.systems
+    for c in storage.connections.values():
+      if c.source in systems and c.target in systems and c.source != c.target:
+        a, b = self.rows[c.source], self.rows[c.target]
+        edges.add((a, b) if a < b else (b, a))
+    for a, b in edges.symmetric_difference(self.edges):
+      changed.add(a)
+      changed.add(b)
+    self.edges = edges
+    if changed:
+      neighbours: typing.Dict[int, typing.List[int]] = {}
+      for a, b in edges:
+        neighbours.setdefault(a, []).append(b)
+        neighbours.setdefault(b, []).append(a)
+      for row in sorted(changed):
+        if self.alive[row] and not self.placed[row]:
+          self.place(row, neighbours.get(row, []))
+      # релаксируются изменившиеся системы и их соседи, остальные остаются на месте
+      active: typing.Set[int] = set()
+      for row in changed:
+        active.add(row)
+        active.update(neighbours.get(row, []))
+      active_rows: numpy.ndarray = numpy.array(sorted(r for r in active if self.alive[r]), dtype=numpy.int64)
+      if len(active_rows):
+        self.relax(active_rows)
+    pos: numpy.ndarray = self.pos
+    return {id: (float(pos[row, 0]), float(pos[row, 1])) for id, row in ((id, self.rows[id]) for id in systems.keys())}
+
+  def place(self, row: int, neighbours: typing.List[int]):
+    # новая система ставится рядом с уже размещёнными соседями, либо в случайное место
+    anchors: typing.List[int] = [r for r in neighbours if self.placed[r] and self.alive[r]]
+    if anchors:
+      centre: numpy.ndarray = self.pos[anchors].mean(axis=0)
+      self.pos[row] = numpy.clip(centre + self.random.normal(0.0, MIN_DISTANCE, 2), 0.0, 1.0)
+    else:
+      self.pos[row] = self.random.uniform(0.1, 0.9, 2)
+    self.placed[row] = True
+
+  def relax(self, active_rows: numpy.ndarray):
+    pos: numpy.ndarray = self.pos
+    alive_rows: numpy.ndarray = numpy.flatnonzero(self.alive[:len(self.ids)])
+    k: float = max(MIN_DISTANCE, 0.6 * math.sqrt(1.0 / len(alive_rows)))
+    # номер строки в active_rows для каждой системы (-1 для неактивных)
+    local: numpy.ndarray = numpy.full(len(self.ids), -1, dtype=numpy.int64)
+    local[active_rows] = numpy.arange(len(active_rows))
+    if self.edges:
+      edges: numpy.ndarray = numpy.array(list(self.edges), dtype=numpy.int64)
+      edges = edges[(local[edges[:, 0]] >= 0) | (local[edges[:, 1]] >= 0)]
+    else:
+      edges = numpy.zeros((0, 2), dtype=numpy.int64)
+    src_local: numpy.ndarray = local[edges[:, 0]]
+    tgt_local: numpy.ndarray = local[edges[:, 1]]
+    src_active: numpy.ndarray = src_local >= 0
+    tgt_active: numpy.ndarray = tgt_local >= 0
+    for i in range(self.iterations):
+      temperature: float = TEMPERATURE * (1.0 - i / self.iterations)
+      active_pos: numpy.ndarray = pos[active_rows]
+      # отталкивание от всех систем карты: k^2/d в направлении от соседа
+      delta: numpy.ndarray = active_pos[:, None, :] - pos[alive_rows][None, :, :]
+      d2: numpy.ndarray = numpy.maximum((delta * delta).sum(axis=2), 1e-6)
+      disp: numpy.ndarray = (delta * (k * k / d2)[:, :, None]).sum(axis=1)
+      # притяжение вдоль связей: d^2/k
+      vec: numpy.ndarray = pos[edges[:, 0]] - pos[edges[:, 1]]
+      force: numpy.ndarray = vec * (numpy.sqrt((vec * vec).sum(axis=1)) / k)[:, None]
+      numpy.add.at(disp, src_local[src_active], -force[src_active])
+      numpy.add.at(disp, tgt_local[tgt_active], force[tgt_active])
+      disp += (0.5 - active_pos) * GRAVITY
+      length: numpy.ndarray = numpy.maximum(numpy.sqrt((disp * disp).sum(axis=1)), 1e-9)
+      step: numpy.ndarray = disp * (numpy.minimum(length, temperature) / length)[:, None]
+      pos[active_rows] = numpy.clip(active_pos + step, 0.0, 1.0)
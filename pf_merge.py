@@ -0,0 +1,90 @@
+# -*- encoding: utf-8 -*-
+""" Streaming merge of several Pathfinder logs
+
+Logs of the maps (and rotated pieces of them) are merged lazily by datetime of the records: only one record of every
+log is held in the heap, so the memory doesn't depend on the size of logs. Rotated logs can overlap, the same record
+found in several logs is passed only once.
+"""
+import glob
+import heapq
+import typing
+import datetime
+import operator
+
+import pf_reader
+import pf_events
+import pf_cache
+import pf_follow
+
+# файлы, которые pftm сам создаёт рядом с логом (кеш, позиция слежения и их временные копии), шаблоны имён логов
+# (например 'map_2.log*') их не выбирают
+SERVICE_SUFFIXES: typing.Tuple[str, ...] = tuple(
+  suffix + tmp for suffix in (pf_cache.CACHE_SUFFIX, pf_follow.CHECKPOINT_SUFFIX) for tmp in ('', '.tmp'))
+
+
+def expand_filenames(patterns: typing.Iterable[str]) -> typing.List[str]:
+  """ returns names of the log files matching patterns (in the order of patterns, each file once), files of the cache
+  and of the checkpoint are skipped
+  """
+  filenames: typing.List[str] = []
+  for pattern in patterns:
+    matched: typing.List[str] = \
+      sorted(f for f in glob.glob(pattern) if not f.endswith(SERVICE_SUFFIXES)) if glob.has_magic(pattern) else [pattern]
+    for filename in matched:
+      if filename not in filenames:
+        filenames.append(filename)
+  return filenames
+
+
+def iter_file_records(
+    filename: str,
+    prefilter: typing.Optional[pf_reader.PfPrefilter],
+    on_error: typing.Optional[typing.Callable[[pf_events.PfLogError], None]] = None) -> typing.Iterator[typing.Tuple[datetime.datetime, bytes, pf_reader.PfRecord]]:
+  for line in pf_reader.iter_lines(filename, prefilter):
+    try:
+      rec: pf_reader.PfRecord = pf_reader.decode_line(line)
+    except pf_events.PfLogError as e:
+      # время неразобранной записи неизвестно, поэтому она передаётся в on_error в момент чтения
+      if on_error is None:
+        raise
+      on_error(e)
+      continue
+    yield rec.dt, line.rstrip(b'\r\n'), rec
+
+
+def iter_records(
+    filenames: typing.List[str],
+    prefilter: typing.Optional[pf_reader.PfPrefilter] = None,
+    on_error: typing.Optional[typing.Callable[[pf_events.PfLogError], None]] = None) -> typing.Iterator[pf_reader.PfRecord]:
+  """ yields records of all logs in the chronological order, exact duplicates of records are dropped, lines which
+  can't be decoded are passed to on_error (if it is set)
+  """
+  streams = [iter_file_records(filename, prefilter, on_error) for filename in filenames]
+  # одинаковые записи имеют одинаковое время, поэтому достаточно помнить строки только текущей секунды
+  current_dt: typing.Optional[datetime.datetime] = None
+  seen: typing.Set[bytes] = set()
+  for dt, line, rec in heapq.merge(*streams, key=operator.itemgetter(0)):
+    if dt != current_dt:
+      current_dt = dt
+      seen.clear()
+    if line in seen:
+      continue
+    seen.add(line)
+    yield rec
+
+
+def iter_events(
+    filenames: typing.List[str],
+    channel_filter: pf_reader.PfChannelFilter,
+    on_error: typing.Optional[typing.Callable[[pf_events.PfLogError], None]] = None) -> typing.Iterator[pf_events.PfEvent]:
+  prefilter: pf_reader.PfPrefilter = pf_reader.make_prefilter(channel_filter)
+  for rec in iter_records(filenames, prefilter, on_error):
+    try:
+      event: typing.Optional[pf_events.PfEvent] = pf_events.normalize_record(rec, channel_filter)
+    except pf_events.PfLogError as e:
+      if on_error is None:
+        raise
+      on_error(e)
+      continue
+    if event is not None:
+      yield event
@@ -0,0 +1,129 @@
+# -*- encoding: utf-8 -*-
+""" Parallel decoding of large Pathfinder logs
+
+The log file is split into line-aligned byte ranges (compressed logs into blocks of lines) which are decoded and
+normalized in the worker processes, the events are returned to the caller in the original order.
+"""
+import os
+import typing
+import collections
+import concurrent.futures
+
+import pf_reader
+import pf_events
+from pf_events import PfEvent, PfLogError
+
+DEFAULT_CHUNK_SIZE: int = 4 * 1024 * 1024
+
+
+def split_ranges(
+    filename: str,
+    chunk_size: int = DEFAULT_CHUNK_SIZE,
+    start: int = 0,
+    end: typing.Optional[int] = None) -> typing.List[typing.Tuple[int, int]]:
+  size: int = os.path.getsize(filename) if end is None else end
+  ranges: typing.List[typing.Tuple[int, int]] = []
+  with open(filename, 'rb') as f:
+    while start < size:
+      # граница диапазона сдвигается на начало следующей строки
+      f.seek(start + chunk_size)
+      f.readline()
+      stop: int = min(f.tell(), size)
+      if stop <= start:
+        stop = size
+      ranges.append((start, stop))
+      start = stop
+  return ranges
+
+
+def decode_lines(
+    lines: typing.Iterable[bytes],
+    channel_filter: pf_reader.PfChannelFilter,
+    message_types: typing.FrozenSet[str]) -> typing.List[typing.Union[PfEvent, PfLogError]]:
+  # выполняется в рабочем процессе: исходные записи назад не передаются (слишком дорого), а ошибки разбора
+  # возвращаются в общем списке, чтобы быть обработанными строго в своём месте лога
+  events: typing.List[typing.Union[PfEvent, PfLogError]] = []
+  prefilter: pf_reader.PfPrefilter = pf_reader.make_prefilter(channel_filter)
+  for line in lines:
+    if not prefilter(line) or not line.strip():
+      continue
+    try:
+      event: typing.Optional[PfEvent] = pf_events.normalize_record(
+        pf_reader.decode_line(line), channel_filter, keep_obj=False, message_types=message_types)
+    except PfLogError as e:
+      events.append(e)
+      continue
+    if event is not None:
+      events.append(event)
+  return events
+
+
+def decode_range(
+    filename: str,
+    start: int,
+    end: int,
+    channel_filter: pf_reader.PfChannelFilter,
+    message_types: typing.FrozenSet[str]) -> typing.List[typing.Union[PfEvent, PfLogError]]:
+  with open(filename, 'rb') as f:
+    f.seek(start)
+    data: bytes = f.read(end - start)
+  return decode_lines(data.split(b'\n'), channel_filter, message_types)
+
+
+def iter_tasks(
+    filename: str,
+    channel_filter: pf_reader.PfChannelFilter,
+    chunk_size: int,
+    start: int = 0,
+    end: typing.Optional[int] = None) -> typing.Iterator[typing.Tuple[typing.Callable, tuple]]:
+  # типы сообщений с обработчиками известны только здесь (рабочие процессы могут быть запущены без карт)
+  message_types: typing.FrozenSet[str] = frozenset(pf_events.g_message_types)
+  if pf_reader.detect_compression(filename) is None:
+    for range_start, range_end in split_ranges(filename, chunk_size, start, end):
+      yield decode_range, (filename, range_start, range_end, channel_filter, message_types)
+    return
+  # сжатый лог не делится на диапазоны, поэтому он распаковывается здесь, а в рабочие процессы уходят блоки строк
+  # (строки других каналов отбрасываются ещё до передачи)
+  block: typing.List[bytes] = []
+  block_size: int = 0
+  for line in pf_reader.iter_lines(filename, pf_reader.make_prefilter(channel_filter)):
+    block.append(line)
+    block_size += len(line)
+    if block_size >= chunk_size:
+      yield decode_lines, (block, channel_filter, message_types)
+      block, block_size = [], 0
+  if block:
+    yield decode_lines, (block, channel_filter, message_types)
+
+
+def iter_events(
+    filename: str,
+    channel_filter: pf_reader.PfChannelFilter,
+    jobs: int,
+    start: int = 0,
+    end: typing.Optional[int] = None,
+    chunk_size: int = DEFAULT_CHUNK_SIZE,
+    on_error: typing.Optional[typing.Callable[[PfLogError], None]] = None) -> typing.Iterator[PfEvent]:
+  tasks = iter_tasks(filename, channel_filter, chunk_size, start, end)
+  with concurrent.futures.ProcessPoolExecutor(max_workers=jobs) as executor:
+    # в работе одновременно находится ограниченное количество блоков, чтобы не держать в памяти весь лог
+    pending: typing.Deque[concurrent.futures.Future] = collections.deque()
+    tasks_done: bool = False
+    while pending or not tasks_done:
+      while not tasks_done and len(pending) < 2 * jobs:
+        task = next(tasks, None)
+        if task is None:
+          tasks_done = True
+        else:
+          pending.append(executor.submit(task[0], *task[1]))
+      if not pending:
+        break
+      for event in pending.popleft().result():
+        if isinstance(event, PfLogError):
+          if on_error is not None:
+            on_error(event)
+            continue
+          for f in pending:
+            f.cancel()
+          raise event
+        yield event
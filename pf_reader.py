@@ -0,0 +1,233 @@
+# -*- encoding: utf-8 -*-
+""" Pathfinder log reader: fast decoding of the map log lines
+"""
+import io
+import os
+import re
+import bz2
+import gzip
+import json
+import lzma
+import mmap
+import typing
+import datetime
+
+# быстрый json-парсер используется при наличии, иначе работаем через стандартный модуль json
+try:
+  import orjson
+  json_loads = orjson.loads
+  json_backend: str = 'orjson'
+except ImportError:
+  try:
+    import ujson
+    json_loads = ujson.loads
+    json_backend: str = 'ujson'
+  except ImportError:
+    json_loads = json.loads
+    json_backend: str = 'json'
+
+
+class PfLogError(Exception):
+  def __init__(self, reason: str, obj: typing.Union[dict, str, None]):
+    super().__init__(reason)
+    self.reason: str = reason
+    self.obj: typing.Union[dict, str, None] = obj  # запись лога (или строка, если она не разбирается)
+
+  def __reduce__(self):
+    # исключение передаётся из рабочих процессов, поэтому должно восстанавливаться вместе с записью
+    return PfLogError, (self.reason, self.obj)
+
+
+class PfRecord(typing.NamedTuple):
+  message_type: str  # system, connection, signature, map
+  message_id: str  # 'J123456', 'wh', 'ABC-123'
+  dt: datetime.datetime  # усечено до секунд
+  channel_name: typing.Optional[str]
+  character: dict
+  objct: dict
+  main: typing.Union[dict, list, None]
+  formatted: str
+  path: str
+  obj: dict  # исходная запись целиком (для диагностики)
+
+
+# время в логе всегда в одном формате "2023-10-27T07:38:33.856015+00:00", а dt всё равно обрезается до секунд,
+# поэтому разбираем только первые 19 символов и кешируем результат (в логе подряд идут записи одной и той же секунды)
+DATETIME_FORMAT: str = "%Y-%m-%dT%H:%M:%S.%f+00:00"
+DATETIME_CACHE_SIZE: int = 4096
+g_datetime_cache: typing.Dict[str, datetime.datetime] = {}
+
+
+def parse_datetime(value: str) -> datetime.datetime:
+  key: str = value[:19]
+  dt: typing.Optional[datetime.datetime] = g_datetime_cache.get(key)
+  if dt is not None:
+    return dt
+  if len(value) == 32 and value[19] == '.' and value[26:] == '+00:00' and value[10] == 'T':
+    dt = datetime.datetime.fromisoformat(key)
+  else:
+    # медленный, но строгий путь для строк нестандартного формата
+    dt = datetime.datetime.strptime(value, DATETIME_FORMAT).replace(microsecond=0)
+  if len(g_datetime_cache) >= DATETIME_CACHE_SIZE:
+    g_datetime_cache.clear()
+  g_datetime_cache[key] = dt
+  return dt
+
+
+def decode_line(line: typing.Union[bytes, str]) -> PfRecord:
+  """ decodes line of the log, raises PfLogError if the line is not a record of the map log """
+  try:
+    obj = json_loads(line)
+  except ValueError:
+    raise PfLogError('Malformed json:', line.decode('utf-8', 'replace') if isinstance(line, bytes) else line)
+  try:
+    message_type, message_id = obj['message'].split(' ', 1)
+    data = obj['context']['data']
+    channel = data.get('channel')
+    return PfRecord(
+      message_type,
+      message_id,
+      parse_datetime(obj['datetime']),
+      channel.get('channelName') if channel else None,
+      data.get('character'),
+      data.get('object'),
+      data.get('main'),
+      data.get('formatted'),
+      obj['extra']['path'],
+      obj)
+  except (KeyError, IndexError, TypeError, ValueError, AttributeError) as e:
+    # в записи нет обязательных полей (или они неожиданного типа)
+    raise PfLogError('Malformed record ({}):'.format(type(e).__name__), obj)
+
+
+# записи типа map (создание/изменение карты) не обрабатываются, они всегда первые в строке лога (формат monolog)
+MAP_MESSAGE_PREFIXES: typing.Tuple[bytes, ...] = (b'{"message":"map ', b'{"message": "map ')
+MAP_MESSAGE_PREFIX_MAXLEN: int = max(len(p) for p in MAP_MESSAGE_PREFIXES)
+re_unicode_escape = re.compile(r'\\u[0-9a-fA-F]{4}')
+
+
+def json_string_variants(value: str) -> typing.Set[bytes]:
+  # канал в логе может быть записан как в utf-8, так и в виде \uXXXX последовательностей, а php ещё и экранирует
+  # символ '/', поэтому ищем все возможные варианты записи строки (вместе с кавычками)
+  variants: typing.Set[bytes] = set()
+  for ensure_ascii in (False, True):
+    encoded: str = json.dumps(value, ensure_ascii=ensure_ascii)
+    for v in (encoded, encoded.replace('/', '\\/')):
+      variants.add(v.encode('utf-8'))
+      if ensure_ascii:
+        variants.add(re_unicode_escape.sub(lambda m: m.group(0).upper().replace('\\U', '\\u'), v).encode('utf-8'))
+  return variants
+
+
+# названия каналов, события которых обрабатываются (None - все каналы)
+PfChannelFilter = typing.Optional[typing.FrozenSet[str]]
+
+
+def make_channel_filter(channel_names: typing.Optional[typing.Iterable[str]]) -> PfChannelFilter:
+  return None if channel_names is None else frozenset(channel_names)
+
+
+class PfPrefilter:
+  """ rejects raw log lines without json decoding: lines with map messages and lines of other channels (filter is
+  conservative, accepted lines still have to be checked after decoding)
+  """
+  def __init__(self, channel_filter: PfChannelFilter):
+    self.channel_filter: PfChannelFilter = channel_filter
+    self.variants: typing.Tuple[bytes, ...] = \
+      tuple(v for name in sorted(channel_filter) for v in json_string_variants(name)) if channel_filter else ()
+
+  def __call__(self, line: bytes) -> bool:
+    if line.startswith(MAP_MESSAGE_PREFIXES):
+      return False
+    if not self.variants:
+      return True
+    for v in self.variants:
+      if v in line:
+        return True
+    return False
+
+  def match(self, buffer, start: int, end: int) -> bool:
+    # то же самое, но для строки [start, end) в буфере (mmap), без копирования строки
+    if self.variants:
+      for v in self.variants:
+        if buffer.find(v, start, end) >= 0:
+          break
+      else:
+        return False
+    return not buffer[start:start+MAP_MESSAGE_PREFIX_MAXLEN].startswith(MAP_MESSAGE_PREFIXES)
+
+
+def make_prefilter(channel_filter: PfChannelFilter) -> PfPrefilter:
+  return PfPrefilter(channel_filter)
+
+
+# сжатые логи распознаются по сигнатуре в начале файла
+COMPRESSION_MAGIC: typing.Tuple[typing.Tuple[bytes, str], ...] = (
+  (b'\x1f\x8b', 'gzip'),
+  (b'\x28\xb5\x2f\xfd', 'zstd'),
+  (b'BZh', 'bz2'),
+  (b'\xfd7zXZ\x00', 'xz'),
+)
+
+
+def detect_compression(filename: str) -> typing.Optional[str]:
+  with open(filename, 'rb') as f:
+    head: bytes = f.read(8)
+  for magic, compression in COMPRESSION_MAGIC:
+    if head.startswith(magic):
+      return compression
+  return None
+
+
+def open_compressed(filename: str, compression: str) -> typing.BinaryIO:
+  if compression == 'gzip':
+    return gzip.open(filename, 'rb')
+  elif compression == 'bz2':
+    return bz2.open(filename, 'rb')
+  elif compression == 'xz':
+    return lzma.open(filename, 'rb')
+  elif compression == 'zstd':
+    try:
+      import zstandard
+    except ImportError:
+      raise RuntimeError('zstandard package is required to read {}'.format(filename))
+    f = open(filename, 'rb')
+    return io.BufferedReader(zstandard.ZstdDecompressor().stream_reader(f, closefd=True))
+  assert False
+
+
+def iter_lines(
+    filename: str,
+    prefilter: typing.Optional[PfPrefilter] = None,
+    start: int = 0,
+    end: typing.Optional[int] = None) -> typing.Iterator[bytes]:
+  """ yields lines of the log file which are accepted by prefilter, [start, end) is the byte range of the
+  uncompressed log to be read (compressed logs are always read entirely)
+  """
+  compression: typing.Optional[str] = detect_compression(filename)
+  if compression:
+    # сжатые логи распаковываются потоком, без сохранения на диск
+    with open_compressed(filename, compression) as f:
+      for line in f:
+        if prefilter is not None and not prefilter(line):
+          continue
+        if not line.strip():
+          continue
+        yield line
+    return
+  if os.path.getsize(filename) == 0:
+    return
+  # несжатые логи отображаются в память, строки ищутся прямо в mmap, а копируются только прошедшие фильтр
+  with open(filename, 'rb') as f:
+    with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+      size: int = len(mm) if end is None else min(end, len(mm))
+      while start < size:
+        eol: int = mm.find(b'\n', start, size)
+        if eol < 0:
+          eol = size
+        if eol > start and (prefilter is None or prefilter.match(mm, start, eol)):
+          line: bytes = mm[start:eol]
+          if line.strip():
+            yield line
+        start = eol + 1
+
@@ -0,0 +1,244 @@
+# -*- encoding: utf-8 -*-
+""" Rendering of the time-lapse video frames
+
+The state of the map is sampled with the configured tick of the simulated time (using time machine cursor, see
+pf_timeline), each sample is converted into the immutable frame description which is rasterized in the worker
+processes. Layout of the systems is recomputed only for the ticks in which systems or connections appeared or were
+removed (according to the interval index of their lifetimes, see pf_intervals). Frames are written as numbered PNG files or piped to stdout as raw RGB24 video (e.g. into ffmpeg):
+
+$ python pftm.py --map=map_2.log --frames=- --size=1280x720 | \
+  ffmpeg -f rawvideo -pix_fmt rgb24 -s 1280x720 -r 30 -i - wormholes.mp4
+"""
+import os
+import sys
+import zlib
+import struct
+import typing
+import hashlib
+import datetime
+import collections
+import concurrent.futures
+
+import pf_cache
+import pf_timeline
+
+BACKGROUND_COLOR: typing.Tuple[int, int, int] = (16, 16, 24)
+CONNECTION_COLOR: typing.Tuple[int, int, int] = (90, 90, 130)
+LOCKED_COLOR: typing.Tuple[int, int, int] = (240, 240, 240)
+PROGRESS_COLOR: typing.Tuple[int, int, int] = (60, 110, 160)
+# цвета систем по statusId (как в pathfinder: unknown, friendly, occupied, hostile, empty, unscanned)
+STATUS_COLORS: typing.Dict[typing.Optional[int], typing.Tuple[int, int, int]] = {
+  None: (150, 150, 150),
+  1: (150, 150, 150),
+  2: (70, 130, 230),
+  3: (230, 150, 40),
+  4: (220, 50, 50),
+  5: (80, 180, 90),
+  6: (220, 100, 200),
+}
+SYSTEM_SIZE: int = 6  # размер квадрата системы в пикселях
+
+
+class PfFrame(typing.NamedTuple):
+  # неизменяемое описание кадра, передаётся в рабочие процессы (координаты в пикселях)
+  number: int
+  dt: datetime.datetime
+  width: int
+  height: int
+  progress: float  # доля прошедшего времени (0..1)
+  systems: typing.Tuple[typing.Tuple[int, int, typing.Optional[int], bool], ...]  # x, y, statusId, locked
+  connections: typing.Tuple[typing.Tuple[int, int, int, int], ...]  # x1, y1, x2, y2
+
+
+class PfHashLayout:
+  """ places systems at fixed pseudo-random positions derived from their ids (unit square coordinates) """
+  def positions(self, storage, dt: datetime.datetime) -> typing.Dict[int, typing.Tuple[float, float]]:
+    res: typing.Dict[int, typing.Tuple[float, float]] = {}
+    for id in storage.systems.keys():
+      digest: bytes = hashlib.blake2b(id.to_bytes(8, 'little', signed=True), digest_size=4).digest()
+      res[id] = (digest[0] * 256 + digest[1]) / 65535.0, (digest[2] * 256 + digest[3]) / 65535.0
+    return res
+
+
+def make_layout():
+  # раскладка карты силовым алгоритмом требует numpy, без него системы расставляются по хешам их id
+  try:
+    import pf_layout
+  except ImportError:
+    return PfHashLayout()
+  return pf_layout.PfForceLayout()
+
+
+def make_frame(
+    number: int,
+    dt: datetime.datetime,
+    progress: float,
+    storage,
+    positions: typing.Dict[int, typing.Tuple[float, float]],
+    width: int,
+    height: int) -> PfFrame:
+  margin: int = 2 * SYSTEM_SIZE
+  top: int = margin + 4  # сверху полоса прогресса
+
+  def px(pos: typing.Tuple[float, float]) -> typing.Tuple[int, int]:
+    return margin + int(pos[0] * (width - 2 * margin - 1)), top + int(pos[1] * (height - top - margin - 1))
+
+  points: typing.Dict[int, typing.Tuple[int, int]] = {id: px(pos) for id, pos in positions.items()}
+  systems = tuple((*points[s.id], s.statusId, bool(s.locked)) for s in storage.systems.values() if s.id in points)
+  connections = tuple(
+    (*points[c.source], *points[c.target])
+    for c in storage.connections.values() if c.source in points and c.target in points)
+  return PfFrame(number, dt, width, height, progress, systems, connections)
+
+
+class PfCanvas:
+  def __init__(self, width: int, height: int, color: typing.Tuple[int, int, int]):
+    self.width: int = width
+    self.height: int = height
+    self.pixels: bytearray = bytearray(bytes(color) * (width * height))
+
+  def fill_rect(self, x: int, y: int, w: int, h: int, color: typing.Tuple[int, int, int]):
+    x0, y0 = max(0, x), max(0, y)
+    x1, y1 = min(self.width, x + w), min(self.height, y + h)
+    if x0 >= x1 or y0 >= y1:
+      return
+    row: bytes = bytes(color) * (x1 - x0)
+    for yy in range(y0, y1):
+      offset: int = (yy * self.width + x0) * 3
+      self.pixels[offset:offset + len(row)] = row
+
+  def line(self, x0: int, y0: int, x1: int, y1: int, color: typing.Tuple[int, int, int]):
+    # алгоритм Брезенхэма
+    pixels: bytearray = self.pixels
+    width, height = self.width, self.height
+    r, g, b = color
+    dx, dy = abs(x1 - x0), -abs(y1 - y0)
+    sx, sy = (1 if x0 < x1 else -1), (1 if y0 < y1 else -1)
+    err: int = dx + dy
+    while True:
+      if 0 <= x0 < width and 0 <= y0 < height:
+        offset: int = (y0 * width + x0) * 3
+        pixels[offset] = r
+        pixels[offset + 1] = g
+        pixels[offset + 2] = b
+      if x0 == x1 and y0 == y1:
+        break
+      e2: int = 2 * err
+      if e2 >= dy:
+        err += dy
+        x0 += sx
+      if e2 <= dx:
+        err += dx
+        y0 += sy
+
+
+def rasterize(frame: PfFrame) -> bytes:
+  """ returns RGB24 pixels of the frame """
+  canvas: PfCanvas = PfCanvas(frame.width, frame.height, BACKGROUND_COLOR)
+  canvas.fill_rect(0, 0, int(frame.width * frame.progress), 3, PROGRESS_COLOR)
+  for x1, y1, x2, y2 in frame.connections:
+    canvas.line(x1, y1, x2, y2, CONNECTION_COLOR)
+  half: int = SYSTEM_SIZE // 2
+  for x, y, status_id, locked in frame.systems:
+    if locked:
+      canvas.fill_rect(x - half - 1, y - half - 1, SYSTEM_SIZE + 2, SYSTEM_SIZE + 2, LOCKED_COLOR)
+    canvas.fill_rect(x - half, y - half, SYSTEM_SIZE, SYSTEM_SIZE, STATUS_COLORS.get(status_id, STATUS_COLORS[None]))
+  return bytes(canvas.pixels)
+
+
+def encode_png(width: int, height: int, rgb: bytes) -> bytes:
+  def chunk(tag: bytes, data: bytes) -> bytes:
+    return struct.pack('>I', len(data)) + tag + data + struct.pack('>I', zlib.crc32(tag + data) & 0xffffffff)
+
+  stride: int = width * 3
+  raw: bytes = b''.join(b'\x00' + rgb[y * stride:(y + 1) * stride] for y in range(height))
+  return b'\x89PNG\r\n\x1a\n' + \
+    chunk(b'IHDR', struct.pack('>IIBBBBB', width, height, 8, 2, 0, 0, 0)) + \
+    chunk(b'IDAT', zlib.compress(raw, 6)) + \
+    chunk(b'IEND', b'')
+
+
+def render_raw(frame: PfFrame) -> bytes:
+  return rasterize(frame)
+
+
+def render_png(frame: PfFrame, directory: str) -> str:
+  filename: str = os.path.join(directory, 'frame_{:06d}.png'.format(frame.number))
+  with open(filename, 'wb') as f:
+    f.write(encode_png(frame.width, frame.height, rasterize(frame)))
+  return filename
+
+
+def layout_changed(timeline: pf_timeline.PfTimeline, dt1: datetime.datetime, dt2: datetime.datetime) -> bool:
+  """ returns True if systems or connections appeared on the map or were removed from it in (dt1, dt2] """
+  opened, closed = timeline.changed_between(dt1 + datetime.timedelta(seconds=1), dt2)
+  return any(kind != pf_cache.KIND_SIGNATURE for kind, _ in opened) or \
+    any(kind != pf_cache.KIND_SIGNATURE for kind, _ in closed)
+
+
+def iter_frames(
+    timeline: pf_timeline.PfTimeline,
+    tick: datetime.timedelta,
+    width: int,
+    height: int,
+    layout=None) -> typing.Iterator[PfFrame]:
+  """ samples the map state every tick of the simulated time from the first till the last event of the journal """
+  journal: pf_cache.PfEventColumns = timeline.journal
+  if len(journal) == 0:
+    return
+  layout = layout if layout is not None else make_layout()
+  first: datetime.datetime = pf_cache.from_timestamp(journal.ts[0])
+  last: datetime.datetime = pf_cache.from_timestamp(journal.ts[len(journal) - 1])
+  duration: float = max(1.0, (last - first).total_seconds())
+  cursor: pf_timeline.PfTimelineCursor = pf_timeline.PfTimelineCursor(timeline)
+  number: int = 0
+  dt: datetime.datetime = first
+  positions: typing.Optional[typing.Dict[int, typing.Tuple[float, float]]] = None
+  while dt <= last:
+    storage = cursor.seek(dt)
+    # раскладка зависит только от набора систем и соединений, поэтому пересчитывается, лишь если по индексу интервалов
+    # жизни объектов за прошедший тик какие-то из них появились или были удалены
+    if positions is None or layout_changed(timeline, dt - tick, dt):
+      positions = layout.positions(storage, dt)
+    progress: float = min(1.0, (dt - first).total_seconds() / duration)
+    yield make_frame(number, dt, progress, storage, positions, width, height)
+    number += 1
+    dt += tick
+
+
+def render_frames(
+    frames: typing.Iterable[PfFrame],
+    output: str,
+    jobs: int,
+    stdout: typing.Optional[typing.BinaryIO] = None) -> int:
+  """ rasterizes frames in worker processes, output is the directory for PNG files or '-' for raw RGB24 frames
+  written to stdout (or to the passed binary stream), returns number of rendered frames
+  """
+  to_stdout: bool = output == '-'
+  if not to_stdout:
+    os.makedirs(output, exist_ok=True)
+  if stdout is None:
+    stdout = sys.stdout.buffer
+  rendered: int = 0
+  with concurrent.futures.ProcessPoolExecutor(max_workers=jobs) as executor:
+    # в работе ограниченное количество кадров, готовые кадры выводятся строго по порядку и сразу забываются
+    pending: typing.Deque[concurrent.futures.Future] = collections.deque()
+
+    def flush_one():
+      result = pending.popleft().result()
+      if to_stdout:
+        stdout.write(result)
+
+    for frame in frames:
+      if to_stdout:
+        pending.append(executor.submit(render_raw, frame))
+      else:
+        pending.append(executor.submit(render_png, frame, output))
+      rendered += 1
+      if len(pending) >= 2 * jobs:
+        flush_one()
+    while pending:
+      flush_one()
+  if to_stdout:
+    stdout.flush()
+  return rendered
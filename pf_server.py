@@ -0,0 +1,94 @@
+#!/usr/bin/python3
+
+""" Q.Pathfinder Time Machine: local stand-in of the Pathfinder server
+
+Serves log files of the directory over HTTP/1.1 with keep-alive connections and Range requests (as nginx serves
+/history/map/ of the Pathfinder server), so fetching of the logs can be tested without the real server. Logs can be
+appended (e.g. by pf_generator.py) while the server is running.
+
+$ python pf_server.py --directory=/tmp/logs --port=8000
+$ python pftm.py --url=http://127.0.0.1:8000/map_2.log --map=map_2.log
+"""
+import os
+import re
+import shutil
+import typing
+import http.server
+
+import console_app
+
+RANGE_RE = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+
+class PfRangeRequestHandler(http.server.SimpleHTTPRequestHandler):
+  protocol_version = 'HTTP/1.1'  # соединения не закрываются после ответа
+
+  def send_head(self):
+    path: str = self.translate_path(self.path)
+    range_header: typing.Optional[str] = self.headers.get('Range')
+    if not range_header or not os.path.isfile(path):
+      return super().send_head()
+    match = RANGE_RE.match(range_header.strip())
+    f = open(path, 'rb')
+    size: int = os.fstat(f.fileno()).st_size
+    if match is None or match.group(1) == '' and match.group(2) == '':
+      f.close()
+      self.send_error(400, 'Unsupported range')
+      return None
+    if match.group(1) == '':
+      # последние N байт
+      start: int = max(0, size - int(match.group(2)))
+      end: int = size - 1
+    else:
+      start = int(match.group(1))
+      end = min(size - 1, int(match.group(2))) if match.group(2) else size - 1
+    if start >= size or start > end:
+      f.close()
+      self.send_response(416)
+      self.send_header('Content-Range', 'bytes */{}'.format(size))
+      self.send_header('Content-Length', '0')
+      self.end_headers()
+      return None
+    self.send_response(206)
+    self.send_header('Content-Type', self.guess_type(path))
+    self.send_header('Content-Range', 'bytes {}-{}/{}'.format(start, end, size))
+    self.send_header('Content-Length', str(end - start + 1))
+    self.send_header('Accept-Ranges', 'bytes')
+    self.end_headers()
+    f.seek(start)
+    self.range_left = end - start + 1
+    return f
+
+  def copyfile(self, source, outputfile):
+    left: typing.Optional[int] = getattr(self, 'range_left', None)
+    if left is None:
+      shutil.copyfileobj(source, outputfile)
+      return
+    self.range_left = None
+    while left > 0:
+      data: bytes = source.read(min(left, 64 * 1024))
+      if not data:
+        break
+      outputfile.write(data)
+      left -= len(data)
+
+
+def main():
+  argv_prms = console_app.get_argv_prms(['directory=', 'port=', 'bind='])
+  directory: str = argv_prms['directory'][-1] if argv_prms['directory'] else '.'
+  port: int = int(argv_prms['port'][-1]) if argv_prms['port'] else 8000
+  bind: str = argv_prms['bind'][-1] if argv_prms['bind'] else '127.0.0.1'
+
+  def handler(*args, **kwargs):
+    return PfRangeRequestHandler(*args, directory=directory, **kwargs)
+
+  with http.server.ThreadingHTTPServer((bind, port), handler) as httpd:
+    print('Serving {} at http://{}:{}/'.format(os.path.abspath(directory), bind, port))
+    try:
+      httpd.serve_forever()
+    except KeyboardInterrupt:
+      pass
+
+
+if __name__ == "__main__":
+  main()
@@ -0,0 +1,138 @@
+# -*- encoding: utf-8 -*-
+""" Profiling of the log processing stages
+
+Functions of the stages (json decoding, parsing of timestamps, normalization of records, dispatching of events,
+handlers of the map and mutations of the storage) are wrapped with timers only when statistics is requested, so
+ordinary runs are not slowed down. Time of the stages is inclusive (e.g. time of the handler includes time of the
+storage mutations made by it), time of reading the log excludes decoding done in this process.
+"""
+import sys
+import json
+import time
+import typing
+
+import pf_events
+import pf_reader
+
+try:
+  import resource
+except ImportError:  # windows
+  resource = None
+
+STORAGE_MUTATIONS: typing.Tuple[str, ...] = (
+  'add_system', 'upd_system', 'del_system', 'add_connection', 'del_connection',
+  'add_signature', 'upd_signature', 'del_signature',
+)
+# стадии, выполняемые внутри чтения событий (их время вычитается из времени чтения лога)
+READ_SUBSTAGES: typing.Tuple[str, ...] = ('decode.json', 'decode.datetime', 'normalize')
+
+
+def get_peak_rss(who: int = 0) -> typing.Optional[int]:
+  """ returns peak resident set size (bytes) of this process (who=0) or of its finished child processes (who=1), the
+  peak includes pages of the log file mapped into memory (see pf_reader.iter_lines), so for uncompressed logs it
+  exceeds memory of the maps up to the size of the log
+  """
+  if resource is None:
+    return None
+  rss: int = resource.getrusage(resource.RUSAGE_CHILDREN if who else resource.RUSAGE_SELF).ru_maxrss
+  return rss if sys.platform == 'darwin' else rss * 1024
+
+
+class PfStats:
+  def __init__(self, progress_interval: typing.Optional[float] = None):
+    self.started: float = time.perf_counter()
+    self.times: typing.Dict[str, float] = {}
+    self.calls: typing.Dict[str, int] = {}
+    self.events: int = 0
+    self.event_counts: typing.Dict[str, int] = {}
+    self.progress_interval: typing.Optional[float] = progress_interval
+    self.progress_at: float = self.started
+
+  def timed(self, stage: str, func: typing.Callable) -> typing.Callable:
+    times: typing.Dict[str, float] = self.times
+    calls: typing.Dict[str, int] = self.calls
+    times.setdefault(stage, 0.0)
+    calls.setdefault(stage, 0)
+    perf_counter = time.perf_counter
+
+    def wrapper(*args, **kwargs):
+      started: float = perf_counter()
+      try:
+        return func(*args, **kwargs)
+      finally:
+        times[stage] += perf_counter() - started
+        calls[stage] += 1
+    return wrapper
+
+  def timed_iter(self, stage: str, iterable: typing.Iterable) -> typing.Iterator:
+    """ measures time of getting items of the iterable (e.g. reading and decoding of the log) """
+    self.times.setdefault(stage, 0.0)
+    self.calls.setdefault(stage, 0)
+    perf_counter = time.perf_counter
+    iterator = iter(iterable)
+    while True:
+      started: float = perf_counter()
+      try:
+        item = next(iterator)
+      except StopIteration:
+        self.times[stage] += perf_counter() - started
+        return
+      self.times[stage] += perf_counter() - started
+      self.calls[stage] += 1
+      yield item
+
+  def instrument_reader(self):
+    # функции ищутся в модулях во время вызова, поэтому подменяются на время работы программы
+    pf_reader.json_loads = self.timed('decode.json', pf_reader.json_loads)
+    pf_reader.parse_datetime = self.timed('decode.datetime', pf_reader.parse_datetime)
+    pf_events.normalize_record = self.timed('normalize', pf_events.normalize_record)
+
+  def instrument_map(self, map):
+    """ wraps dispatcher, handlers registered in it and storage of the map (PfMap) """
+    dispatcher = map.dispatcher
+    dispatcher.dispatch = self.timed('dispatch', dispatcher.dispatch)
+    # обработчики вызываются из таблицы диспетчера, поэтому подменяются в ней
+    for key, handlers in dispatcher.handlers.items():
+      dispatcher.handlers[key] = [self.timed('handler.' + getattr(handler, '__name__', type(handler).__name__), handler) for handler in handlers]
+    dispatcher.resolved.clear()
+    for name in STORAGE_MUTATIONS:
+      setattr(map.storage, name, self.timed('storage.' + name, getattr(map.storage, name)))
+
+  def count_event(self, event: pf_events.PfEvent):
+    key: str = event.action + ' ' + event.message_type
+    self.event_counts[key] = self.event_counts.get(key, 0) + 1
+    self.events += 1
+    if self.progress_interval is not None and (self.events & 0xff) == 0:
+      now: float = time.perf_counter()
+      if now - self.progress_at >= self.progress_interval:
+        self.progress_at = now
+        self.print_progress()
+
+  def summary(self) -> dict:
+    elapsed: float = time.perf_counter() - self.started
+    stages: typing.Dict[str, dict] = {
+      stage: {'seconds': round(seconds, 6), 'calls': self.calls[stage]} for stage, seconds in self.times.items()}
+    if 'read' in stages:
+      # время чтения лога без декодирования записей
+      exclusive: float = self.times['read'] - sum(self.times.get(s, 0.0) for s in READ_SUBSTAGES)
+      stages['read']['seconds'] = round(max(0.0, exclusive), 6)
+    return {
+      'elapsed': round(elapsed, 6),
+      'events': self.events,
+      'events_per_sec': round(self.events / elapsed, 1) if elapsed > 0 else None,
+      'event_counts': dict(sorted(self.event_counts.items())),
+      'stages': stages,
+      'peak_rss': get_peak_rss(),
+      'peak_rss_workers': get_peak_rss(1),
+    }
+
+  def print_progress(self, file: typing.TextIO = sys.stderr):
+    elapsed: float = time.perf_counter() - self.started
+    rss: typing.Optional[int] = get_peak_rss()
+    print('progress: {} events, {:.0f} events/sec, peak rss {}'.format(
+      self.events,
+      self.events / elapsed if elapsed > 0 else 0.0,
+      '{:.1f} MiB'.format(rss / (1024 * 1024)) if rss is not None else 'n/a'), file=file, flush=True)
+
+  def print_summary(self, file: typing.TextIO = sys.stderr):
+    print(json.dumps(self.summary(), indent=2), file=file)
@@ -0,0 +1,387 @@
+# -*- encoding: utf-8 -*-
+""" Storage of the map state: systems, connections and signatures alive on the map
+"""
+import sys
+import typing
+import collections
+import datetime
+
+import pf_cache
+
+g_debug_printf: typing.Optional[bool] = None
+
+
+class PfSystem:
+  # объектов на карте много, поэтому атрибуты хранятся в слотах, а не в словаре каждого объекта
+  __slots__ = ('id', 'nm', 'at', 'last', 'locked', 'statusId')
+
+  def __init__(self, id: int, nm: str, at: datetime.datetime):
+    self.id: int = id
+    # названия систем повторяются (системы удаляются и снова наносятся на карту), храним одну копию строки
+    self.nm: str = sys.intern(nm)
+    self.at: datetime.datetime = at
+    self.last: datetime.datetime = at
+    self.locked: typing.Optional[bool] = None
+    self.statusId: typing.Optional[bool] = None
+
+class PfConnection:
+  __slots__ = ('id', 'source', 'target', 'at', 'last')
+
+  def __init__(self, id: int, source: int, target: int, at: datetime.datetime):
+    self.id: int = id
+    self.source: int = source
+    self.target: int = target
+    self.at: datetime.datetime = at
+    self.last: datetime.datetime = at
+
+class PfSignature:
+  __slots__ = ('id', 'nm', 'at', 'last', 'systemId', 'connectionId', 'groupId', 'typeId')
+
+  def __init__(self, id: int, nm: str, at: datetime.datetime):
+    self.id: int = id
+    self.nm: str = nm
+    self.at: datetime.datetime = at
+    self.last: datetime.datetime = at
+    self.systemId: typing.Optional[int] = None
+    self.connectionId: typing.Optional[int] = None
+    self.groupId: typing.Optional[int] = None
+    self.typeId: typing.Optional[int] = None
+
+  @property
+  def scanned(self) -> bool:
+    # сигнатура отсканирована, когда известен её тип (например конкретная дыра или конкретный сайт)
+    return bool(self.typeId)
+
+class PfStorage:
+  def __init__(self):
+    self.systems: typing.Dict[int, PfSystem] = {}
+    self.connections: typing.Dict[int, PfConnection] = {}
+    # индекс смежности: id системы -> id её связей (в т.ч. связи с системами, которых нет на карте)
+    self.links: typing.Dict[int, typing.Set[int]] = {}
+    self.signatures: typing.Dict[int, PfSignature] = {}
+    # индексы сигнатур: id системы -> id её сигнатур (None - система неизвестна), id соединения -> id сигнатур
+    self.system_signatures: typing.Dict[typing.Optional[int], typing.Set[int]] = {}
+    self.connection_signatures: typing.Dict[int, typing.Set[int]] = {}
+    # журнал изменений (см. pf_cache.PfEventColumns.append), по нему состояние восстанавливается без разбора лога
+    self.journal: typing.Optional[typing.Callable] = None
+
+  def get_system(self, id: int) -> typing.Optional[PfSystem]:
+    s: typing.Optional[PfSystem] = self.systems.get(int(id), None)
+    return s
+
+  def add_system(self,
+                 id: int,
+                 nm: str,
+                 at: datetime.datetime,
+                 locked: typing.Optional[bool] = None,
+                 statusId: typing.Optional[int] = None) -> PfSystem:
+    _id: int = int(id)
+    assert self.systems.get(_id) is None
+    # название системы должно быть указано
+    assert nm is not None
+    # на самом деле на карте может существовать несколько систем с одинаковым названием и разными id
+    # судя по всему это происходит тогда, на карту наносится вручную? уже существующая там система
+    # у таких систем будут разные id, но одинаковое название (например лоусек)
+    s: PfSystem = PfSystem(_id, nm, at)
+    if locked is not None:
+      s.locked = locked
+    if statusId is not None:
+      s.statusId = statusId
+    self.systems[_id] = s
+    if self.journal:
+      self.journal(pf_cache.ACTION_CREATE, pf_cache.KIND_SYSTEM, _id, nm, at, None, None, locked, statusId)
+    return s
+
+  def del_system(self, id: int, dt: datetime.datetime):
+    _id: int = int(id)
+    # связи системы удаляются вместе с ней (перебираются только связи этой системы), в журнал удаление связей
+    # попадает раньше удаления системы
+    links: typing.Optional[typing.Set[int]] = self.links.get(_id)
+    if links:
+      for connection_id in sorted(links):
+        self.del_connection(connection_id, dt)
+    # если лог пишется не с самого начала (это нормально), то тут может быть выполнена попытка удалить то, чего нет
+    s: typing.Optional[PfSystem] = self.get_system(_id)
+    if s is None:
+      if g_debug_printf:
+        print('FAIL: unable to delete system {} at {} (ignored)'.format(_id, dt))
+      return
+    else:
+      s.last = dt
+    del self.systems[_id]
+    if self.journal:
+      self.journal(pf_cache.ACTION_DELETE, pf_cache.KIND_SYSTEM, _id, None, dt)
+
+  def upd_system(self,
+                 id: int,
+                 nm: str,
+                 dt: datetime.datetime,
+                 locked: typing.Optional[bool] = None,
+                 statusId: typing.Optional[int] = None) -> PfSystem:
+    _id: int = int(id)
+    # если лог пишется не с самого начала (это нормально), то тут системы может не быть (создаём?)
+    s: typing.Optional[PfSystem] = self.get_system(_id)
+    if s is None:
+      if g_debug_printf:
+        print('FAIL: system {} not exists on update at {} (recreated)'.format(_id, dt))
+      s = self.add_system(_id, nm, dt)
+    s.last = dt
+    if locked is not None:
+      s.locked = locked
+    if statusId is not None:
+      s.statusId = statusId
+    if self.journal:
+      self.journal(pf_cache.ACTION_UPDATE, pf_cache.KIND_SYSTEM, _id, nm, dt, None, None, locked, statusId)
+    return s
+
+  def get_connection(self, id: int) -> typing.Optional[PfConnection]:
+    c: typing.Optional[PfConnection] = self.connections.get(int(id), None)
+    return c
+
+  def add_connection(self, id: int, src: int, tgt: int, at: datetime.datetime) -> PfConnection:
+    _id: int = int(id)
+    _src: int = int(src)
+    _tgt: int = int(tgt)
+    assert self.connections.get(_id) is None
+    c: PfConnection = PfConnection(_id, _src, _tgt, at)
+    self.connections[_id] = c
+    self.link(c)
+    if self.journal:
+      self.journal(pf_cache.ACTION_CREATE, pf_cache.KIND_CONNECTION, _id, None, at, _src, _tgt)
+    return c
+
+  def del_connection(self, id: int, dt: datetime.datetime):
+    _id: int = int(id)
+    # если лог пишется не с самого начала (это нормально), то тут может быть выполнена попытка удалить то, чего нет
+    c: typing.Optional[PfConnection] = self.get_connection(_id)
+    # в том числе браузер отправляет несколько запросов на удаление одних и тех же систем (удаляется одна, которая
+    # тянет за собой группу других, и тут приходит запрос на удаление той системы, что была в группе, и снова удаляется
+    # вся группа)
+    if c is None:
+      if g_debug_printf:
+        print('FAIL: unable to delete connection {} at {} (ignored)'.format(_id, dt))
+      return
+    else:
+      c.last = dt
+    del self.connections[_id]
+    self.unlink(c)
+    # вместе с соединением pathfinder отвязывает от него сигнатуры (в лог это не попадает)
+    for signature_id in self.connection_signatures.pop(_id, ()):
+      self.signatures[signature_id].connectionId = None
+    if self.journal:
+      self.journal(pf_cache.ACTION_DELETE, pf_cache.KIND_CONNECTION, _id, None, dt)
+
+  def link(self, c: PfConnection):
+    self.links.setdefault(c.source, set()).add(c.id)
+    self.links.setdefault(c.target, set()).add(c.id)
+
+  def unlink(self, c: PfConnection):
+    for system_id in (c.source, c.target):
+      links: typing.Optional[typing.Set[int]] = self.links.get(system_id)
+      if links is not None:
+        links.discard(c.id)
+        if not links:
+          del self.links[system_id]
+
+  def get_signature(self, id: int) -> typing.Optional[PfSignature]:
+    g: typing.Optional[PfSignature] = self.signatures.get(int(id), None)
+    return g
+
+  def add_signature(self,
+                    id: int,
+                    nm: str,
+                    at: datetime.datetime,
+                    systemId: typing.Optional[int] = None,
+                    connectionId: typing.Optional[int] = None,
+                    groupId: typing.Optional[int] = None,
+                    typeId: typing.Optional[int] = None) -> PfSignature:
+    _id: int = int(id)
+    assert self.signatures.get(_id) is None
+    assert nm is not None
+    g: PfSignature = PfSignature(_id, sys.intern(nm), at)
+    g.groupId = groupId
+    g.typeId = typeId
+    self.signatures[_id] = g
+    self.system_signatures.setdefault(None, set()).add(_id)
+    self.index_signature(g, systemId, connectionId)
+    if self.journal:
+      self.journal(pf_cache.ACTION_CREATE, pf_cache.KIND_SIGNATURE, _id, nm, at, systemId, connectionId, None, None, groupId, typeId)
+    return g
+
+  def del_signature(self, id: int, dt: datetime.datetime):
+    _id: int = int(id)
+    g: typing.Optional[PfSignature] = self.get_signature(_id)
+    if g is None:
+      if g_debug_printf:
+        print('FAIL: unable to delete signature {} at {} (ignored)'.format(_id, dt))
+      return
+    g.last = dt
+    self.index_signature(g, None, pf_cache.UNLINKED)
+    self.unindex_system(g)
+    del self.signatures[_id]
+    if self.journal:
+      self.journal(pf_cache.ACTION_DELETE, pf_cache.KIND_SIGNATURE, _id, None, dt)
+
+  def upd_signature(self,
+                    id: int,
+                    nm: typing.Optional[str],
+                    dt: datetime.datetime,
+                    systemId: typing.Optional[int] = None,
+                    connectionId: typing.Optional[int] = None,
+                    groupId: typing.Optional[int] = None,
+                    typeId: typing.Optional[int] = None) -> PfSignature:
+    """ changes specified fields of the signature, connectionId=0 unlinks signature from the connection """
+    _id: int = int(id)
+    g: typing.Optional[PfSignature] = self.get_signature(_id)
+    if g is None:
+      # лог пишется не с самого начала, сигнатура была добавлена раньше (создаём)
+      if g_debug_printf:
+        print('FAIL: signature {} not exists on update at {} (recreated)'.format(_id, dt))
+      g = PfSignature(_id, sys.intern(nm) if nm is not None else '', dt)
+      self.signatures[_id] = g
+      self.system_signatures.setdefault(None, set()).add(_id)
+      if self.journal:
+        self.journal(pf_cache.ACTION_CREATE, pf_cache.KIND_SIGNATURE, _id, g.nm, dt)
+    g.last = dt
+    if nm is not None:
+      g.nm = sys.intern(nm)
+    if groupId is not None:
+      g.groupId = groupId
+    if typeId is not None:
+      g.typeId = typeId
+    self.index_signature(g, systemId, connectionId)
+    if self.journal:
+      self.journal(pf_cache.ACTION_UPDATE, pf_cache.KIND_SIGNATURE, _id, nm, dt, systemId, connectionId, None, None, groupId, typeId)
+    return g
+
+  def index_signature(self, g: PfSignature, systemId: typing.Optional[int], connectionId: typing.Optional[int]):
+    if connectionId is not None:
+      if g.connectionId is not None:
+        signatures: typing.Set[int] = self.connection_signatures[g.connectionId]
+        signatures.discard(g.id)
+        if not signatures:
+          del self.connection_signatures[g.connectionId]
+      g.connectionId = int(connectionId) or None
+      if g.connectionId is not None:
+        self.connection_signatures.setdefault(g.connectionId, set()).add(g.id)
+        # в записях лога нет системы, в которой находится сигнатура: считаем, что сигнатура дыры находится в системе,
+        # из которой проложено соединение (pathfinder прокладывает его из системы, где находился пилот)
+        c: typing.Optional[PfConnection] = self.connections.get(g.connectionId)
+        if systemId is None and g.systemId is None and c is not None:
+          systemId = c.source
+    if systemId is not None and int(systemId) != g.systemId:
+      self.unindex_system(g)
+      g.systemId = int(systemId)
+      self.system_signatures.setdefault(g.systemId, set()).add(g.id)
+
+  def unindex_system(self, g: PfSignature):
+    signatures: typing.Set[int] = self.system_signatures[g.systemId]
+    signatures.discard(g.id)
+    if not signatures:
+      del self.system_signatures[g.systemId]
+
+  def signatures_of(self, system_id: typing.Optional[int]) -> typing.List[PfSignature]:
+    """ returns signatures of the system (signatures with unknown system if system_id is None) """
+    key: typing.Optional[int] = None if system_id is None else int(system_id)
+    return [self.signatures[i] for i in self.system_signatures.get(key, ())]
+
+  def signature_of(self, connection_id: int) -> typing.Optional[PfSignature]:
+    """ returns signature which leads to the wormhole (connection), the last linked one if there are several """
+    ids: typing.Set[int] = self.connection_signatures.get(int(connection_id), set())
+    return max((self.signatures[i] for i in ids), key=lambda g: (g.last, g.id), default=None)
+
+  def scan_counts(self) -> typing.Dict[typing.Optional[int], typing.Tuple[int, int]]:
+    """ returns numbers of scanned and unscanned signatures by systems """
+    counts: typing.Dict[typing.Optional[int], typing.Tuple[int, int]] = {}
+    for system_id, ids in self.system_signatures.items():
+      scanned: int = sum(1 for i in ids if self.signatures[i].scanned)
+      counts[system_id] = (scanned, len(ids) - scanned)
+    return counts
+
+  def neighbours(self, id: int) -> typing.Iterator[typing.Tuple[int, int]]:
+    """ yields ids of the connections of the system and ids of the systems on the other side of them """
+    _id: int = int(id)
+    for connection_id in self.links.get(_id, ()):
+      c: PfConnection = self.connections[connection_id]
+      yield connection_id, c.target if c.source == _id else c.source
+
+  def chain_depths(self, home: int, max_depth: typing.Optional[int] = None) -> typing.Dict[int, int]:
+    """ returns number of jumps from the home system to every system reachable from it (breadth-first search) """
+    _home: int = int(home)
+    depths: typing.Dict[int, int] = {_home: 0}
+    queue: typing.Deque[int] = collections.deque([_home])
+    while queue:
+      id: int = queue.popleft()
+      depth: int = depths[id] + 1
+      if max_depth is not None and depth > max_depth:
+        continue
+      for _, other in self.neighbours(id):
+        if other not in depths:
+          depths[other] = depth
+          queue.append(other)
+    return depths
+
+  def chain_depth(self, home: int) -> int:
+    """ returns length of the longest chain of jumps from the home system """
+    return max(self.chain_depths(home).values())
+
+  def route(self, src: int, tgt: int) -> typing.Optional[typing.List[int]]:
+    """ returns ids of the systems of the shortest route from src to tgt (including both), None if unreachable """
+    _src: int = int(src)
+    _tgt: int = int(tgt)
+    previous: typing.Dict[int, typing.Optional[int]] = {_src: None}
+    queue: typing.Deque[int] = collections.deque([_src])
+    while queue and _tgt not in previous:
+      id: int = queue.popleft()
+      for _, other in self.neighbours(id):
+        if other not in previous:
+          previous[other] = id
+          queue.append(other)
+    if _tgt not in previous:
+      return None
+    route: typing.List[int] = []
+    step: typing.Optional[int] = _tgt
+    while step is not None:
+      route.append(step)
+      step = previous[step]
+    route.reverse()
+    return route
+
+  def dump_state(self) -> dict:
+    # текущее состояние хранилища в виде, пригодном для сохранения в json (см. pf_follow)
+    return {
+      'systems': [[s.id, s.nm, pf_cache.to_timestamp(s.at), pf_cache.to_timestamp(s.last), s.locked, s.statusId]
+                  for s in self.systems.values()],
+      'connections': [[c.id, c.source, c.target, pf_cache.to_timestamp(c.at)] for c in self.connections.values()],
+      'signatures': [[g.id, g.nm, pf_cache.to_timestamp(g.at), pf_cache.to_timestamp(g.last), g.systemId, g.connectionId,
+                      g.groupId, g.typeId] for g in self.signatures.values()],
+    }
+
+  def load_state(self, state: dict):
+    self.systems.clear()
+    self.connections.clear()
+    self.links.clear()
+    self.signatures.clear()
+    self.system_signatures.clear()
+    self.connection_signatures.clear()
+    for id, nm, at, last, locked, statusId in state['systems']:
+      s: PfSystem = PfSystem(id, nm, pf_cache.from_timestamp(at))
+      s.last = pf_cache.from_timestamp(last)
+      s.locked = locked
+      s.statusId = statusId
+      self.systems[id] = s
+    for id, source, target, at in state['connections']:
+      c: PfConnection = PfConnection(id, source, target, pf_cache.from_timestamp(at))
+      self.connections[id] = c
+      self.link(c)
+    for id, nm, at, last, systemId, connectionId, groupId, typeId in state['signatures']:
+      g: PfSignature = PfSignature(id, nm, pf_cache.from_timestamp(at))
+      g.last = pf_cache.from_timestamp(last)
+      g.groupId = groupId
+      g.typeId = typeId
+      self.signatures[id] = g
+      g.systemId = systemId
+      self.system_signatures.setdefault(systemId, set()).add(id)
+      if connectionId is not None:
+        g.connectionId = connectionId
+        self.connection_signatures.setdefault(connectionId, set()).add(id)
@@ -0,0 +1,151 @@
+# -*- encoding: utf-8 -*-
+""" Time machine of the map storage
+
+Mutations of the storage are journaled (see pf_cache.PfEventColumns) and compact snapshots of the storage are taken
+periodically, so the state of the map at any moment is restored by binary search of the nearest snapshot and short
+replay of the journal after it (the last state of the storage is saved to the cache along with the journal and the
+snapshots, see pf_cache). The distance between snapshots grows with the size of the map (a snapshot is taken
+after at least as many journal records as there are objects on the map), so the snapshots take no more memory than
+the journal itself. Lifetimes of the objects are indexed only when they are queried for the first time.
+"""
+import array
+import bisect
+import typing
+import marshal
+import datetime
+
+import pf_cache
+import pf_intervals
+
+DEFAULT_SNAPSHOT_INTERVAL: int = 4096  # минимальное количество записей журнала между снимками
+
+
+class PfTimeline:
+  def __init__(self, storage, storage_factory: typing.Callable, interval: int = DEFAULT_SNAPSHOT_INTERVAL):
+    self.storage = storage  # PfStorage, изменения которого журналируются
+    self.storage_factory: typing.Callable = storage_factory
+    self.interval: int = interval
+    self.journal: pf_cache.PfEventColumns = pf_cache.PfEventColumns()
+    # snapshot_rows[k] - номер записи журнала, перед которой сделан снимок snapshot_states[k] (снимки хранятся
+    # сериализованными: байты marshal занимают в несколько раз меньше памяти, чем списки python-объектов)
+    self.snapshot_rows: array.array = array.array('q')
+    self.snapshot_states: typing.List[bytes] = []
+    # интервалы жизни объектов карты (в т.ч. уже удалённых), строятся при первом запросе, см. index_lifetimes
+    self.lifetimes: typing.Optional[pf_intervals.PfIntervalIndex] = None
+    self.indexed_rows: int = 0
+    self.snapshot()
+
+  def attach(self):
+    self.storage.journal = self.append
+
+  def detach(self):
+    self.storage.journal = None
+
+  def snapshot(self):
+    self.snapshot_rows.append(len(self.journal))
+    self.snapshot_states.append(marshal.dumps(self.storage.dump_state()))
+
+  def snapshot_distance(self) -> int:
+    # снимок не меньше карты, поэтому и записей журнала между снимками не меньше, чем объектов на карте
+    storage = self.storage
+    return max(self.interval, len(storage.systems) + len(storage.connections) + len(storage.signatures))
+
+  def append(self, *args):
+    self.journal.append(*args)
+    rows: int = len(self.journal) - self.snapshot_rows[-1]
+    if rows >= self.interval and rows >= self.snapshot_distance():
+      self.snapshot()
+
+  def reset(self):
+    """ starts the new journal from the current state of the storage (e.g. restored from checkpoint) """
+    self.journal = pf_cache.PfEventColumns()
+    self.snapshot_rows = array.array('q')
+    self.snapshot_states = []
+    self.lifetimes = None
+    self.indexed_rows = 0
+    self.snapshot()
+
+  def load(self, journal: pf_cache.PfEventColumns, snapshot_rows: array.array, snapshot_states: typing.List[bytes], state: dict):
+    """ restores journal and snapshots (e.g. loaded from cache), the storage is brought into the final state (state
+    is the PfStorage.dump_state) without replay of the journal
+    """
+    self.journal = journal
+    self.snapshot_rows = snapshot_rows
+    self.snapshot_states = snapshot_states
+    self.lifetimes = None
+    self.indexed_rows = 0
+    self.storage.load_state(state)
+
+  def index_lifetimes(self) -> pf_intervals.PfIntervalIndex:
+    """ returns lifetimes of the objects, journal records added since the previous call are indexed on the way """
+    journal: pf_cache.PfEventColumns = self.journal
+    if self.lifetimes is None:
+      # объекты, существовавшие до начала журнала (например восстановленные из checkpoint-а), живут с момента их
+      # появления на карте
+      self.lifetimes = pf_intervals.PfIntervalIndex()
+      state: dict = marshal.loads(self.snapshot_states[0])
+      alive: typing.List[typing.Tuple[int, int, int]] = \
+        [(s[2], pf_cache.KIND_SYSTEM, s[0]) for s in state['systems']] + \
+        [(c[3], pf_cache.KIND_CONNECTION, c[0]) for c in state['connections']] + \
+        [(g[2], pf_cache.KIND_SIGNATURE, g[0]) for g in state['signatures']]
+      for at, kind, obj_id in sorted(alive):
+        self.lifetimes.open(kind, obj_id, at)
+      self.indexed_rows = 0
+    lifetimes: pf_intervals.PfIntervalIndex = self.lifetimes
+    for i in range(self.indexed_rows, len(journal)):
+      action: int = journal.action[i]
+      if action == pf_cache.ACTION_CREATE:
+        lifetimes.open(journal.kind[i], journal.obj_id[i], journal.ts[i])
+      elif action == pf_cache.ACTION_DELETE:
+        lifetimes.close(journal.kind[i], journal.obj_id[i], journal.ts[i])
+    self.indexed_rows = len(journal)
+    return lifetimes
+
+  def alive_at(self, dt: datetime.datetime) -> typing.List[typing.Tuple[int, int]]:
+    """ returns kinds and ids of the objects alive at the moment dt """
+    lifetimes: pf_intervals.PfIntervalIndex = self.index_lifetimes()
+    return [(lifetimes.kinds[i], lifetimes.obj_ids[i]) for i in lifetimes.alive_at(pf_cache.to_timestamp(dt))]
+
+  def changed_between(
+      self,
+      dt1: datetime.datetime,
+      dt2: datetime.datetime) -> typing.Tuple[typing.List[typing.Tuple[int, int]], typing.List[typing.Tuple[int, int]]]:
+    """ returns kinds and ids of the objects appeared and removed in [dt1, dt2] """
+    lifetimes: pf_intervals.PfIntervalIndex = self.index_lifetimes()
+    opened, closed = lifetimes.changed_between(pf_cache.to_timestamp(dt1), pf_cache.to_timestamp(dt2))
+    return [(lifetimes.kinds[i], lifetimes.obj_ids[i]) for i in opened], \
+           [(lifetimes.kinds[i], lifetimes.obj_ids[i]) for i in closed]
+
+  def row_at(self, dt: datetime.datetime) -> int:
+    # количество записей журнала с моментом времени не позже dt (записи журнала идут в хронологическом порядке)
+    return bisect.bisect_right(self.journal.ts, pf_cache.to_timestamp(dt))
+
+  def restore_row(self, storage, row: int, current_row: typing.Optional[int] = None) -> int:
+    """ brings storage into the state after the first 'row' records of the journal, if storage is already in the
+    state of the current_row, then it is replayed forward without loading of snapshot (when it is shorter)
+    """
+    k: int = bisect.bisect_right(self.snapshot_rows, row) - 1
+    snapshot_row: int = self.snapshot_rows[k]
+    if current_row is None or current_row > row or current_row < snapshot_row:
+      storage.load_state(marshal.loads(self.snapshot_states[k]))
+      current_row = snapshot_row
+    self.journal.replay(storage, current_row, row)
+    return row
+
+  def state_at(self, dt: datetime.datetime):
+    """ returns new storage with the state of the map at the moment dt """
+    storage = self.storage_factory()
+    self.restore_row(storage, self.row_at(dt))
+    return storage
+
+
+class PfTimelineCursor:
+  """ storage which can be moved over timeline back and forth (to scrub the time machine interactively) """
+  def __init__(self, timeline: PfTimeline):
+    self.timeline: PfTimeline = timeline
+    self.storage = timeline.storage_factory()
+    self.row: typing.Optional[int] = None
+
+  def seek(self, dt: datetime.datetime):
+    self.row = self.timeline.restore_row(self.storage, self.timeline.row_at(dt), self.row)
+    return self.storage
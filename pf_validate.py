@@ -0,0 +1,77 @@
+# -*- encoding: utf-8 -*-
+""" Validation of the Pathfinder log records
+
+Records are checked on one of the levels: 'strict' stops processing on the first anomaly (as it was done by asserts),
+'report' skips the anomalous records and aggregates anomalies into the summary, 'off' doesn't check records at all
+(records which can't be processed are still counted in the summary). Set of fields of the record is checked once for
+every schema variant (handler and field names).
+"""
+import sys
+import typing
+
+import pf_events
+
+LEVELS: typing.Tuple[str, ...] = ('strict', 'report', 'off')
+DEFAULT_LEVEL: str = 'report'
+
+
+class PfValidator:
+  def __init__(self, level: str = DEFAULT_LEVEL):
+    assert level in LEVELS
+    self.level: str = level
+    self.enabled: bool = level != 'off'
+    # количество аномалий и первая встреченная запись с такой аномалией (по причине)
+    self.anomalies: typing.Dict[str, int] = {}
+    self.examples: typing.Dict[str, typing.Any] = {}
+    # результаты проверки набора полей: (обработчик, поля записи) -> допустимость
+    self.shapes: typing.Dict[typing.Tuple[str, typing.Tuple[str, ...]], bool] = {}
+
+  def anomaly(self, reason: str, obj: typing.Any = None):
+    if self.level == 'strict':
+      raise pf_events.PfLogError(reason, obj)
+    count: int = self.anomalies.get(reason, 0)
+    if count == 0:
+      self.examples[reason] = obj
+    self.anomalies[reason] = count + 1
+
+  def check(self, condition: bool, reason: str, obj: typing.Any = None) -> bool:
+    if not condition:
+      self.anomaly(reason, obj)
+    return condition
+
+  def check_keys(self, handler: str, main: dict, allowed: typing.FrozenSet[str], obj: typing.Any = None) -> bool:
+    """ checks that record has no fields except allowed """
+    variant: typing.Tuple[str, typing.Tuple[str, ...]] = (handler, tuple(main))
+    valid: typing.Optional[bool] = self.shapes.get(variant)
+    if valid is None:
+      valid = self.shapes[variant] = allowed.issuperset(main)
+    if not valid:
+      self.anomaly('{}: unexpected fields {}'.format(handler, sorted(set(main) - allowed)), obj)
+    return valid
+
+  def error(self, e: pf_events.PfLogError):
+    """ handles error of the record normalization (unknown type, path or action of the record) """
+    if self.level == 'strict':
+      raise e
+    self.anomaly(e.reason, e.obj)
+
+  def malformed(self, event: pf_events.PfEvent, e: Exception):
+    """ handles failure of the event processing (record has unexpected structure) """
+    reason: str = '{} {}: malformed record ({})'.format(event.action, event.message_type, type(e).__name__)
+    self.anomaly(reason, event.obj if event.obj is not None else event.objct)
+
+  def dump_state(self) -> dict:
+    return {'level': self.level, 'anomalies': self.anomalies, 'examples': self.examples}
+
+  def load_state(self, state: dict):
+    """ restores anomalies found earlier (in the part of the log which is restored from the cache) """
+    assert state['level'] == self.level
+    self.anomalies = dict(state['anomalies'])
+    self.examples = dict(state['examples'])
+
+  def print_summary(self, file: typing.TextIO = sys.stderr):
+    if not self.anomalies:
+      return
+    print('Anomalies found in the log: {}'.format(sum(self.anomalies.values())), file=file)
+    for reason, count in sorted(self.anomalies.items(), key=lambda x: -x[1]):
+      print('{:>8} {} {}'.format(count, reason, self.examples[reason]), file=file)
@@ -12,109 +12,79 @@ run the following command from this directory:
 
 $ chcp 65001 & @rem on Windows only!
 $ python pftm.py --map=filename.log
+
+The module can be imported to process logs in-process (events are read lazily, the map is built without subprocess):
+
+  import pftm
+  for event in pftm.iter_events('map_2.log', channel='SRG-C'): ...
+  map = pftm.replay(pftm.iter_events('map_2.log', channel='SRG-C'))
+  channels = pftm.replay(pftm.iter_events('map_2.log', channel='*'), pftm.PfChannels(None))  # maps of all channels
 """
 import os
+import re
 import sys
 import json
 import typing
+import asyncio
 import datetime
+import urllib.parse
 
 import console_app
+import pf_cache
+import pf_coalesce
+import pf_dispatch
+import pf_events
+import pf_fetch
+import pf_follow
+import pf_merge
+import pf_reader
+import pf_render
+import pf_stats
+import pf_storage
+import pf_timeline
+import pf_validate
+import pf_parallel
+try:
+  import pf_activity
+except ImportError:  # numpy не установлен, активность персонажей не считается
+  pf_activity = None
+from pf_storage import PfStorage
 from __init__ import __version__
 
-objects = {}
 g_debug_printf: typing.Optional[bool] = None
-g_channel_filter: typing.Optional[str] = None
-
-class PfSystem:
-  def __init__(self, id: int, nm: str, at: datetime.datetime):
-    self.id: int = id
-    self.nm: str = nm
-    self.at: datetime.datetime = at
-    self.last: datetime.datetime = at
-    self.locked: typing.Optional[bool] = None
-    self.statusId: typing.Optional[bool] = None
-
-class PfConnection:
-  def __init__(self, id: int, source: int, target: int, at: datetime.datetime):
-    self.id: int = id
-    self.source: int = source
-    self.target: int = target
-
-class PfStorage:
-  def __init__(self):
-    self.systems: typing.Dict[int, PfSystem] = {}
-    self.connections: typing.Dict[int, PfConnection] = {}
-
-  def get_system(self, id: int) -> typing.Optional[PfSystem]:
-    s: typing.Optional[PfSystem] = self.systems.get(int(id), None)
-    return s
-
-  def add_system(self, id: int, nm: str, at: datetime.datetime) -> PfSystem:
-    _id: int = int(id)
-    assert self.systems.get(_id) is None
-    # название системы должно быть указано
-    assert nm is not None
-    # на самом деле на карте может существовать несколько систем с одинаковым названием и разными id
-    # судя по всему это происходит тогда, на карту наносится вручную? уже существующая там система
-    # у таких систем будут разные id, но одинаковое название (например лоусек)
-    self.systems[_id] = PfSystem(_id, nm, at)
-    return self.systems.get(_id)
-
-  def del_system(self, id: int, dt: datetime.datetime):
-    _id: int = int(id)
-    # если лог пишется не с самого начала (это нормально), то тут может быть выполнена попытка удалить то, чего нет
-    s: typing.Optional[PfSystem] = self.get_system(_id)
-    if s is None:
-      if g_debug_printf:
-        print('FAIL: unable to delete system {} at {} (ignored)'.format(_id, dt))
-      return
-    else:
-      s.last = dt
-    del self.systems[_id]
-
-  def upd_system(self, id: int, nm: str, dt: datetime.datetime) -> PfSystem:
-    _id: int = int(id)
-    # если лог пишется не с самого начала (это нормально), то тут системы может не быть (создаём?)
-    s: typing.Optional[PfSystem] = self.get_system(_id)
-    if s is None:
-      if g_debug_printf:
-        print('FAIL: system {} not exists on update at {} (recreated)'.format(_id, dt))
-      s = self.add_system(_id, nm, dt)
-    s.last = dt
-    return s
-
-  def get_connection(self, id: int) -> typing.Optional[PfConnection]:
-    c: typing.Optional[PfConnection] = self.connections.get(int(id), None)
-    return c
-
-  def add_connection(self, id: int, src: int, tgt: int, at: datetime.datetime) -> PfConnection:
-    _id: int = int(id)
-    _src: int = int(src)
-    _tgt: int = int(tgt)
-    assert self.connections.get(_id) is None
-    self.connections[_id] = PfConnection(_id, _src, _tgt, at)
-    return self.connections.get(_id)
-
-  def del_connection(self, id: int, dt: datetime.datetime):
-    _id: int = int(id)
-    # если лог пишется не с самого начала (это нормально), то тут может быть выполнена попытка удалить то, чего нет
-    c: typing.Optional[PfConnection] = self.get_connection(_id)
-    # в том числе браузер отправляет несколько запросов на удаление одних и тех же систем (удаляется одна, которая
-    # тянет за собой группу других, и тут приходит запрос на удаление той системы, что была в группе, и снова удаляется
-    # вся группа)
-    if c is None:
-      if g_debug_printf:
-        print('FAIL: unable to delete connection {} at {} (ignored)'.format(_id, dt))
-      return
-    else:
-      c.last = dt
-    del self.connections[_id]
-
+g_channel_filter: pf_reader.PfChannelFilter = None
+g_stats: typing.Optional[pf_stats.PfStats] = None
+g_frames_stdout: typing.Optional[typing.BinaryIO] = None
 
 class PfMap:
-  def __init__(self):
+  def __init__(self, validator: typing.Optional[pf_validate.PfValidator] = None):
     self.storage: PfStorage = PfStorage()
+    # проверка записей лога, в режиме report аномальные записи пропускаются и попадают в сводку
+    self.validator: pf_validate.PfValidator = validator if validator is not None else pf_validate.PfValidator()
+    # журнал изменений и периодические снимки хранилища, по которым восстанавливается состояние на любой момент
+    self.timeline: pf_timeline.PfTimeline = pf_timeline.PfTimeline(self.storage, PfStorage)
+    # обработчики событий по ключу (message_type, path_base, action), сюда же регистрируются дополнительные
+    self.dispatcher: pf_dispatch.PfDispatcher = pf_dispatch.PfDispatcher()
+    # количество событий по персонажам и интервалам времени (кто и когда наносил карту и сканировал)
+    self.activity = pf_activity.PfActivity() if pf_activity is not None else None
+    self.register_handlers()
+
+  def register_handlers(self):
+    # обработчики вызываются диспетчером напрямую (связанные методы), без промежуточных функций
+    d: pf_dispatch.PfDispatcher = self.dispatcher
+    d.register('connection', 'deleted', self.deleted_connection)
+    d.register('system', 'deleted', self.deleted_system)
+    d.register('signature', 'deleted', self.deleted_signature)
+    d.register('connection', 'updated', self.updated_connection)
+    d.register('system', 'updated', self.updated_system)
+    d.register('signature', 'updated', self.updated_signature)
+    d.register('connection', 'created', self.created_connection)
+    d.register('system', 'created', self.created_system)
+    d.register('signature', 'created', self.created_signature)
+
+  def apply(self, event: pf_events.PfEvent):
+    """ applies event of the map channel to the map """
+    process_event(self, event)
 
   def convert_items(self, data: typing.Optional[str]):
     if not data:
@@ -124,19 +94,35 @@ class PfMap:
     else:
       return [data]  # stargate
 
-  def deleted_connection(self, connection_id, dt, character, objct, path_base, path_ids):
+  # допустимые поля записей (context.data.main) по обработчикам
+  UPDATED_CONNECTION_KEYS: typing.FrozenSet[str] = frozenset(['source','target','type','scope','sourceEndpointType','targetEndpointType'])
+  UPDATED_SYSTEM_KEYS: typing.FrozenSet[str] = frozenset(['active','locked','statusId','description','alias','rallyPoke'])
+  UPDATED_SIGNATURE_KEYS: typing.FrozenSet[str] = frozenset(['groupId','typeId','name','description','connectionId'])
+  CREATED_CONNECTION_KEYS: typing.FrozenSet[str] = frozenset(['source','target','scope','type'])
+  CREATED_SYSTEM_KEYS: typing.FrozenSet[str] = frozenset(['active','locked','statusId'])
+  CREATED_SIGNATURE_KEYS: typing.FrozenSet[str] = frozenset(['groupId','typeId','name','description'])
+  CONNECTION_NAMES: typing.FrozenSet[str] = frozenset(['wh','stargate'])
+  CONNECTION_IDS: typing.FrozenSet[str] = frozenset(["'wh'","'stargate'"])
+  CONNECTION_TYPES: typing.FrozenSet[str] = frozenset(['["wh_fresh"]','["stargate"]'])
+
+  def deleted_connection(self, event: pf_events.PfEvent):
+    connection_id, dt, character, objct, path_base, path_ids = \
+      event.message_id, event.dt, event.character, event.objct, event.path_base, event.path_ids
     #print(path_base, '' if not path_ids else ",".join(path_ids))
-    assert connection_id == "'wh'"
-    assert objct['objName'] == 'wh'
-    if path_base == '/api/rest/Connection':
-      assert len(path_ids) == 1
-      assert int(path_ids[0]) == int(objct['objId'])
-    elif path_base == '/cron/deleteEolConnections': pass
-    elif path_base == '/cron/deleteExpiredConnections': pass
-    elif path_base == '/api/rest/System':
-      assert len(path_ids) >= 1
-    else:
-      assert path_base == ''
+    v: pf_validate.PfValidator = self.validator
+    if v.enabled:
+      if not v.check(connection_id == "'wh'" and objct['objName'] == 'wh', 'deleted connection: unexpected name', objct):
+        return
+      if path_base == '/api/rest/Connection':
+        if not v.check(len(path_ids) == 1 and int(path_ids[0]) == int(objct['objId']), 'deleted connection: unexpected ids in path', objct):
+          return
+      elif path_base == '/cron/deleteEolConnections': pass
+      elif path_base == '/cron/deleteExpiredConnections': pass
+      elif path_base == '/api/rest/System':
+        if not v.check(len(path_ids) >= 1, 'deleted connection: unexpected ids in path', objct):
+          return
+      elif not v.check(path_base == '', 'deleted connection: unexpected path', objct):
+        return
     if g_debug_printf:
       print('<<<<< >>>>> del connection:', dt, character['name'], objct['objId'])
     self.storage.del_connection(objct['objId'], dt)
@@ -144,58 +130,73 @@ class PfMap:
       if g_debug_printf:
         print('<<<<< >>>>> del connections:', dt, ",".join(path_ids))
 
-  def deleted_system(self, system_id, dt, character, objct, path_base, path_ids):
+  def deleted_system(self, event: pf_events.PfEvent):
+    system_id, dt, character, objct, path_base, path_ids = \
+      event.message_id, event.dt, event.character, event.objct, event.path_base, event.path_ids
     #print(path_base, '' if not path_ids else ",".join(path_ids))
-    if path_base == '/api/rest/System':
-      assert len(path_ids) >= 1
-      assert str(objct['objId']) in path_ids
-      assert system_id == "'"+objct['objName']+"'"
-    else:
-      assert path_base == ''
+    v: pf_validate.PfValidator = self.validator
+    if v.enabled:
+      if path_base == '/api/rest/System':
+        if not v.check(len(path_ids) >= 1 and str(objct['objId']) in path_ids, 'deleted system: unexpected ids in path', objct):
+          return
+        if not v.check(system_id == "'"+objct['objName']+"'", 'deleted system: unexpected name', objct):
+          return
+      elif not v.check(path_base == '', 'deleted system: unexpected path', objct):
+        return
     if g_debug_printf:
       print('<<<<< >>>>> del system:', dt, character['name'], objct['objId'], objct['objName'])
     self.storage.del_system(objct['objId'], dt)
-    if len(path_ids) > 1:
+    if path_ids and len(path_ids) > 1:
       if g_debug_printf:
         print('<<<<< >>>>> del systems:', dt, ",".join(path_ids))
       for id in path_ids:
         if int(id) != int(objct['objId']):
           self.storage.del_system(id, dt)
 
-  def deleted_signature(self, signature_id, dt, character, objct, path_base, path_ids):
+  def deleted_signature(self, event: pf_events.PfEvent):
+    dt, character, objct, path_base, path_ids = \
+      event.dt, event.character, event.objct, event.path_base, event.path_ids
     #print(path_base, '' if not path_ids else ",".join(path_ids))
-    if path_base == '/api/rest/Signature':
-      if path_ids:
-        assert str(objct['objId']) in path_ids
-    else:
-      assert path_base == ''
+    v: pf_validate.PfValidator = self.validator
+    if v.enabled:
+      if path_base == '/api/rest/Signature':
+        if path_ids:
+          if not v.check(str(objct['objId']) in path_ids, 'deleted signature: unexpected ids in path', objct):
+            return
+      elif not v.check(path_base == '', 'deleted signature: unexpected path', objct):
+        return
     if g_debug_printf:
       print('<<<<< >>>>> del signature:', dt, character['name'], objct['objId'], objct['objName'])
-    if len(path_ids) > 1:
+    self.storage.del_signature(objct['objId'], dt)
+    if path_ids and len(path_ids) > 1:
       if g_debug_printf:
         print('<<<<< >>>>> del signatures:', dt, ",".join(path_ids))
 
-  def updated_connection(self, connection_id, dt, character, objct, main, path_base, path_ids):
+  def updated_connection(self, event: pf_events.PfEvent):
+    connection_id, dt, character, objct, main, path_base, path_ids = \
+      event.message_id, event.dt, event.character, event.objct, event.main, event.path_base, event.path_ids
     #print(path_base, '' if not path_ids else ",".join(path_ids), main)
-    assert connection_id in ["'wh'","'stargate'"]
-    assert objct['objName'] in ['wh','stargate']
-    if path_base == '/api/Map/updateUserData':
-      assert not path_ids
-    elif path_base == '/api/rest/Connection':
-      assert not path_ids
-    elif path_base == '/api/Map/updateData':
-      assert not path_ids
-    elif path_base == '/api/Map/updateUnloadData':
-      assert not path_ids
-    else:
-      assert path_base == ''
-    if main.get('source'):
-      assert main['source'].get('new') is not None
-    if main.get('target'):
-      assert main['target'].get('new') is not None
-    if 'scope' in main:
-      assert main['scope']['new'] in ['wh','stargate']
-    assert len(set(main.keys()) - set(['source','target','type','scope','sourceEndpointType','targetEndpointType'])) == 0
+    v: pf_validate.PfValidator = self.validator
+    if v.enabled:
+      if not v.check(connection_id in self.CONNECTION_IDS and objct['objName'] in self.CONNECTION_NAMES, 'updated connection: unexpected name', objct):
+        return
+      if path_base == '/api/Map/updateUserData' or path_base == '/api/rest/Connection' or \
+         path_base == '/api/Map/updateData' or path_base == '/api/Map/updateUnloadData':
+        if not v.check(not path_ids, 'updated connection: unexpected ids in path', objct):
+          return
+      elif not v.check(path_base == '', 'updated connection: unexpected path', objct):
+        return
+      if not v.check_keys('updated connection', main, self.UPDATED_CONNECTION_KEYS, objct):
+        return
+      if main.get('source'):
+        if not v.check(main['source'].get('new') is not None, 'updated connection: no new source', objct):
+          return
+      if main.get('target'):
+        if not v.check(main['target'].get('new') is not None, 'updated connection: no new target', objct):
+          return
+      if 'scope' in main:
+        if not v.check(main['scope']['new'] in self.CONNECTION_NAMES, 'updated connection: unexpected scope', objct):
+          return
     source: int = main['source'].get('new') if 'source' in main else None
     target: int = main['target'].get('new') if 'target' in main else None
     typ = self.convert_items(main['type'].get('new')) if 'type' in main else None  # '["wh_fresh","wh_jump_mass_l"]'
@@ -205,19 +206,26 @@ class PfMap:
     if g_debug_printf:
       print('<<<<< >>>>> upd connection:', dt, character['name'], objct['objId'], source, target, typ, scope, sourceEndpointType)
 
-  def updated_system(self, system_id, dt, character, objct, main, path_base, path_ids):
+  def updated_system(self, event: pf_events.PfEvent):
+    dt, character, objct, main, path_base, path_ids = \
+      event.dt, event.character, event.objct, event.main, event.path_base, event.path_ids
     #print(path_base, '' if not path_ids else ",".join(path_ids), main)
-    if path_base == '/api/Map/updateUserData':
-      assert not path_ids
-    elif path_base == '/api/Map/updateData':
-      assert not path_ids
-    elif path_base == '/api/rest/System':
-      if path_ids:
-        assert len(path_ids) == 1
-        assert str(objct['objId']) in path_ids
-    else:
-      assert path_base == ''
-    assert len(set(main.keys()) - set(['active','locked','statusId','description','alias','rallyPoke'])) == 0
+    v: pf_validate.PfValidator = self.validator
+    if v.enabled:
+      if path_base == '/api/Map/updateUserData' or path_base == '/api/Map/updateData':
+        if not v.check(not path_ids, 'updated system: unexpected ids in path', objct):
+          return
+      elif path_base == '/api/rest/System':
+        if path_ids:
+          if not v.check(len(path_ids) == 1 and str(objct['objId']) in path_ids, 'updated system: unexpected ids in path', objct):
+            return
+      elif not v.check(path_base == '', 'updated system: unexpected path', objct):
+        return
+      if not v.check_keys('updated system', main, self.UPDATED_SYSTEM_KEYS, objct):
+        return
+    # без названия система не может быть создана (в т.ч. при изменении неизвестной системы)
+    if not v.check(objct['objName'] is not None, 'updated system: no name', objct):
+      return
     active = main.get('active')
     locked: bool = True if 'locked' in main and main['locked']['new'] == 1 else None
     statusId: bool = main['statusId'].get('new') if 'statusId' in main else None
@@ -231,21 +239,22 @@ class PfMap:
       # это признак того, что они "существуют", поэтому мы должны создать такую систему и держать до её удаления
       if self.storage.get_system(objct['objId']) is None:
         self.storage.add_system(objct['objId'], objct['objName'], dt)
-    s: PfSystem = self.storage.upd_system(objct['objId'], objct['objName'], dt)
-    if locked is not None:
-      s.locked = locked
-    if statusId is not None:
-      s.statusId = statusId
+    self.storage.upd_system(objct['objId'], objct['objName'], dt, locked, statusId)
 
-  def updated_signature(self, signature_id, dt, character, objct, main, path_base, path_ids):
+  def updated_signature(self, event: pf_events.PfEvent):
+    dt, character, objct, main, path_base, path_ids = \
+      event.dt, event.character, event.objct, event.main, event.path_base, event.path_ids
     #print(path_base, '' if not path_ids else ",".join(path_ids), main)
-    if path_base == '/api/rest/Signature':
-      if path_ids:
-        assert len(path_ids) == 1
-        assert str(objct['objId']) in path_ids
-    else:
-      assert path_base == ''
-    assert len(set(main.keys()) - set(['groupId','typeId','name','description','connectionId'])) == 0
+    v: pf_validate.PfValidator = self.validator
+    if v.enabled:
+      if path_base == '/api/rest/Signature':
+        if path_ids:
+          if not v.check(len(path_ids) == 1 and str(objct['objId']) in path_ids, 'updated signature: unexpected ids in path', objct):
+            return
+      elif not v.check(path_base == '', 'updated signature: unexpected path', objct):
+        return
+      if not v.check_keys('updated signature', main, self.UPDATED_SIGNATURE_KEYS, objct):
+        return
     groupId: int = main['groupId'].get('new') if 'groupId' in main else None
     typeId: int = main['typeId'].get('new') if 'typeId' in main else None
     name: int = main['name'].get('new') if 'name' in main else None
@@ -253,71 +262,101 @@ class PfMap:
     connectionId: int = main['connectionId'].get('new') if 'connectionId' in main else None
     if g_debug_printf:
       print('<<<<< >>>>> upd signature:', dt, character['name'], objct['objId'], objct['objName'], groupId, typeId, name, description, connectionId)
-
-  def created_connection(self, connection_id, dt, character, objct, main, path_base, path_ids):
+    if 'connectionId' in main and connectionId is None:
+      connectionId = pf_cache.UNLINKED  # сигнатура отвязана от соединения
+    if self.storage.get_signature(objct['objId']) is None:
+      if not v.check(name is not None or objct['objName'] is not None, 'updated signature: no name', objct):
+        return
+      self.storage.add_signature(objct['objId'], name if name is not None else objct['objName'], dt)
+    self.storage.upd_signature(objct['objId'], name, dt, None, connectionId, groupId, typeId)
+
+  def created_connection(self, event: pf_events.PfEvent):
+    connection_id, dt, character, objct, main, path_base, path_ids = \
+      event.message_id, event.dt, event.character, event.objct, event.main, event.path_base, event.path_ids
     #print(path_base, '' if not path_ids else ",".join(path_ids), main)
-    assert connection_id in ["'wh'","'stargate'"]
-    assert objct['objName'] in ['wh','stargate']
-    if path_base == '/api/Map/updateUserData': pass
-    elif path_base == '/api/rest/Connection':
-      assert len(path_ids) == 0
-    else:
-      assert path_base == ''
-    assert main.get('source')
-    assert main['source'].get('old') is None
-    assert main.get('target')
-    assert main['target'].get('old') is None
-    assert len(set(main.keys()) - set(['source','target','scope','type'])) == 0
+    v: pf_validate.PfValidator = self.validator
+    if v.enabled:
+      if not v.check(connection_id in self.CONNECTION_IDS and objct['objName'] in self.CONNECTION_NAMES, 'created connection: unexpected name', objct):
+        return
+      if path_base == '/api/Map/updateUserData': pass
+      elif path_base == '/api/rest/Connection':
+        if not v.check(len(path_ids) == 0, 'created connection: unexpected ids in path', objct):
+          return
+      elif not v.check(path_base == '', 'created connection: unexpected path', objct):
+        return
+      if not v.check_keys('created connection', main, self.CREATED_CONNECTION_KEYS, objct):
+        return
+      if not v.check(main.get('source') and main['source'].get('old') is None and
+                     main.get('target') and main['target'].get('old') is None, 'created connection: no source or target', objct):
+        return
+      if 'scope' in main:
+        if not v.check(main['scope']['new'] in self.CONNECTION_NAMES, 'created connection: unexpected scope', objct):
+          return
+      if 'type' in main:
+        if not v.check(main['type']['new'] in self.CONNECTION_TYPES, 'created connection: unexpected type', objct):
+          return
     source = main['source']['new']
     target = main['target']['new']
-    if 'scope' in main:
-      assert main['scope']['new'] in ['wh','stargate']
-    if 'type' in main:
-      assert main['type']['new'] in ['["wh_fresh"]','["stargate"]']
     typ = self.convert_items(main['type'].get('new')) if 'type' in main else None  # '["wh_fresh","stargate"]'
     scope: str = main['scope'].get('new') if 'scope' in main else None  # 'stargate'
     if g_debug_printf:
       print('<<<<< >>>>> add connection:', dt, character['name'], objct['objId'], source, target, typ, scope)
-    c: PfConnection = self.storage.add_connection(objct['objId'], source, target, dt)
+    if self.storage.get_connection(objct['objId']) is not None:
+      # повторная запись о создании того же соединения, соединение остаётся прежним
+      v.anomaly('created connection: already exists', objct)
+      return
+    self.storage.add_connection(objct['objId'], source, target, dt)
 
-  def created_system(self, system_id, dt, character, objct, main, path_base, path_ids):
+  def created_system(self, event: pf_events.PfEvent):
+    dt, character, objct, main, path_base, path_ids = \
+      event.dt, event.character, event.objct, event.main, event.path_base, event.path_ids
     #print(path_base, '' if not path_ids else ",".join(path_ids), main)
-    if path_base == '/api/Map/updateUserData':
-      assert not path_ids
-    elif path_base == '/api/rest/System':
-      assert not path_ids
-    else:
-      assert path_base == ''
-    assert main.get('active')
-    assert main['active'].get('old') is None
-    assert main['active'].get('new') == 1
-    assert len(set(main.keys()) - set(['active','locked','statusId'])) == 0
+    v: pf_validate.PfValidator = self.validator
+    if v.enabled:
+      if path_base == '/api/Map/updateUserData' or path_base == '/api/rest/System':
+        if not v.check(not path_ids, 'created system: unexpected ids in path', objct):
+          return
+      elif not v.check(path_base == '', 'created system: unexpected path', objct):
+        return
+      if not v.check_keys('created system', main, self.CREATED_SYSTEM_KEYS, objct):
+        return
+      if not v.check(main.get('active') and main['active'].get('old') is None and main['active'].get('new') == 1,
+                     'created system: not activated', objct):
+        return
+    if not v.check(objct['objName'] is not None, 'created system: no name', objct):
+      return
     locked: bool = True if 'locked' in main and main['locked']['new'] == 1 else None
     statusId: bool = main['statusId'].get('new') if 'statusId' in main else None
     if g_debug_printf:
       print('<<<<< >>>>> add system:', dt, character['name'], objct['objId'], objct['objName'], locked, statusId)
-    s: PfSystem = self.storage.add_system(objct['objId'], objct['objName'], dt)
-    if locked is not None:
-      s.locked = locked
-    if statusId is not None:
-      s.statusId = statusId
+    if self.storage.get_system(objct['objId']) is not None:
+      # повторная запись о создании той же системы, она применяется как изменение
+      v.anomaly('created system: already exists', objct)
+      self.storage.upd_system(objct['objId'], objct['objName'], dt, locked, statusId)
+      return
+    self.storage.add_system(objct['objId'], objct['objName'], dt, locked, statusId)
 
-  def created_signature(self, signature_id, dt, character, objct, main, path_base, path_ids):
+  def created_signature(self, event: pf_events.PfEvent):
+    dt, character, objct, main, path_base, path_ids = \
+      event.dt, event.character, event.objct, event.main, event.path_base, event.path_ids
     #print(path_base, '' if not path_ids else ",".join(path_ids), main)
-    if path_base == '/api/rest/Signature':
-      assert not path_ids
-    else:
-      assert path_base == ''
-    assert len(set(main.keys()) - set(['groupId','typeId','name','description'])) == 0
-    assert main.get('groupId')
-    assert main['groupId'].get('old') is None
-    assert main.get('typeId')
-    assert main['typeId'].get('old') is None
-    assert main.get('name')
-    assert main['name'].get('old') is None
-    assert main['name'].get('new') == objct['objName']
-    assert main.get('description')
-    assert main['description'].get('old') is None
+    v: pf_validate.PfValidator = self.validator
+    if v.enabled:
+      if path_base == '/api/rest/Signature':
+        if not v.check(not path_ids, 'created signature: unexpected ids in path', objct):
+          return
+      elif not v.check(path_base == '', 'created signature: unexpected path', objct):
+        return
+      if not v.check_keys('created signature', main, self.CREATED_SIGNATURE_KEYS, objct):
+        return
+      if not v.check(main.get('groupId') and main['groupId'].get('old') is None and
+                     main.get('typeId') and main['typeId'].get('old') is None and
+                     main.get('name') and main['name'].get('old') is None and
+                     main.get('description') and main['description'].get('old') is None,
+                     'created signature: missing fields', objct):
+        return
+      if not v.check(main['name'].get('new') == objct['objName'], 'created signature: unexpected name', objct):
+        return
     groupId: int = main['groupId'].get('new') if 'groupId' in main else None
     typeId: int = main['typeId'].get('new') if 'typeId' in main else None
     name: int = main['name'].get('new') if 'name' in main else None
@@ -325,174 +364,500 @@ class PfMap:
     #assert main['description'].get('new') == 'Разрушенный научный аванпост Gurista (Ruined Guristas Science Outpost)'
     if g_debug_printf:
       print('<<<<< >>>>> add signature:', dt, character['name'], objct['objId'], objct['objName'], groupId, typeId, name, description)
+    if self.storage.get_signature(objct['objId']) is not None:
+      # повторная запись о той же сигнатуре (например в пересекающихся логах)
+      self.storage.upd_signature(objct['objId'], name, dt, None, None, groupId, typeId)
+    elif v.check(name is not None or objct['objName'] is not None, 'created signature: no name', objct):
+      self.storage.add_signature(objct['objId'], name if name is not None else objct['objName'], dt, None, None, groupId, typeId)
+
+
+class PfChannels:
+  """ maps of the channels: every event of the log is routed into the map of its channel, so the log is read once
+  regardless of the number of channels
+  """
+  def __init__(self, channel_filter: pf_reader.PfChannelFilter, validator: typing.Optional[pf_validate.PfValidator] = None):
+    self.channel_filter: pf_reader.PfChannelFilter = channel_filter
+    self.validator: pf_validate.PfValidator = validator if validator is not None else pf_validate.PfValidator()
+    self.maps: typing.Dict[str, PfMap] = {}
+    self.attached: bool = False
+    # часть журналов, уже сохранённая в файл кеша (новые записи дописываются после неё)
+    self.cache_layout: typing.Optional[pf_cache.PfCacheLayout] = None
+    if channel_filter is not None:
+      for channel_name in sorted(channel_filter):
+        self.get_map(channel_name)
+
+  def get_map(self, channel_name: typing.Optional[str]) -> PfMap:
+    name: str = channel_name if channel_name is not None else ''
+    map: typing.Optional[PfMap] = self.maps.get(name)
+    if map is None:
+      # если обрабатываются все каналы, то карты создаются по мере появления каналов в логе
+      map = self.maps[name] = self.new_map()
+    return map
+
+  def new_map(self) -> PfMap:
+    map: PfMap = PfMap(self.validator)
+    if g_stats is not None:
+      g_stats.instrument_map(map)
+    if self.attached:
+      map.timeline.attach()
+    return map
+
+  def attach(self):
+    for map in self.maps.values():
+      map.timeline.attach()
+    self.attached = True
+
+  def detach(self):
+    for map in self.maps.values():
+      map.timeline.detach()
+    self.attached = False
+
+  def route(self, event: pf_events.PfEvent):
+    process_event(self.get_map(event.channel_name), event)
+
+  apply = route
+
+  def timelines(self) -> typing.Dict[str, pf_timeline.PfTimeline]:
+    return {name: map.timeline for name, map in self.maps.items()}
+
+  def save_cache(self, filename: str, identity: pf_cache.PfLogIdentity):
+    try:
+      self.cache_layout = pf_cache.save_cache(
+        filename, self.timelines(), identity, self.channel_filter, self.activities(), self.cache_layout,
+        self.validator.dump_state())
+    except OSError as e:
+      print('WARN: unable to save cache {}: {}'.format(filename, e))
+      self.cache_layout = None
+
+  def activities(self) -> typing.Optional[typing.Dict[str, typing.Any]]:
+    if pf_activity is None:
+      return None
+    return {name: map.activity for name, map in self.maps.items()}
+
+  def dump_state(self) -> dict:
+    """ returns state of the maps, activity of the characters and anomalies found in the log """
+    return {
+      'storage': {name: map.storage.dump_state() for name, map in self.maps.items()},
+      'activity': None if pf_activity is None else {name: map.activity.dump_state() for name, map in self.maps.items()},
+      'validation': self.validator.dump_state()}
+
+  def load_state(self, state: dict):
+    """ restores state saved by dump_state, ValueError is raised if the state doesn't match the current settings
+    (channels remain unchanged in this case)
+    """
+    # состояние без активности персонажей (сохранённое без numpy) не подходит, если активность считается, а аномалии,
+    # найденные с другим уровнем проверки, не совпадут с найденными при повторном разборе лога
+    if pf_activity is not None and state['activity'] is None:
+      raise ValueError('activity of the characters is not saved')
+    if state['validation']['level'] != self.validator.level:
+      raise ValueError('validation level is {}'.format(state['validation']['level']))
+    maps: typing.Dict[str, PfMap] = {}
+    for name, storage_state in state['storage'].items():
+      map: PfMap = self.new_map()
+      maps[name] = map
+      map.storage.load_state(storage_state)
+      if pf_activity is not None:
+        map.activity.load_state(state['activity'][name])
+    self.maps.update(maps)
+    self.validator.load_state(state['validation'])
+
+
+def iter_events(
+    path: typing.Union[str, typing.Iterable[str]],
+    channel: typing.Union[str, typing.Iterable[str], None] = None,
+    on_error: typing.Optional[typing.Callable[[pf_events.PfLogError], None]] = None) -> typing.Iterator[pf_events.PfEvent]:
+  """ yields normalized events of the log (or of several logs merged by datetime, names may contain wildcards) of the
+  channel or channels (all channels if channel is None or '*'), the log is read lazily, so memory doesn't depend on
+  its size
+  """
+  channel_names: typing.List[str] = ['*'] if channel is None else [channel] if isinstance(channel, str) else list(channel)
+  channel_filter: pf_reader.PfChannelFilter = None if '*' in channel_names else pf_reader.make_channel_filter(channel_names)
+  filenames: typing.List[str] = pf_merge.expand_filenames([path] if isinstance(path, str) else path)
+  if len(filenames) == 1:
+    return pf_events.iter_events(filenames[0], channel_filter, on_error=on_error)
+  return pf_merge.iter_events(filenames, channel_filter, on_error=on_error)
+
+
+def replay(
+    events: typing.Iterable[pf_events.PfEvent],
+    map: typing.Union[PfMap, PfChannels, None] = None) -> typing.Union[PfMap, PfChannels]:
+  """ applies events to the map (to the new one if it isn't passed) and returns it, events of several channels are
+  applied to PfChannels (the new map accepts events of one channel only, ValueError is raised otherwise), journal of
+  the time machine is kept only if it is attached (map.timeline.attach()), otherwise memory is bounded by the size of
+  the map
+  """
+  if map is not None:
+    for event in events:
+      map.apply(event)
+    return map
+  map = PfMap()
+  channel_names: typing.Set[typing.Optional[str]] = set()
+  for event in events:
+    if event.channel_name not in channel_names:
+      channel_names.add(event.channel_name)
+      # карта одного канала не должна смешивать системы и соединения разных карт
+      if len(channel_names) > 1:
+        raise ValueError('Events of several channels are replayed into one map, pass PfChannels to replay them')
+    map.apply(event)
+  return map
+
 
 def main():
   global g_debug_printf
   global g_channel_filter
-
-  g_channel_filter = 'SRG-C'  #TODO
+  global g_stats
+  global g_frames_stdout
 
   # работа с параметрами командной строки, получение настроек запуска программы
   argv_prms = console_app.get_argv_prms()
+  if argv_prms['frames'] == '-':
+    # stdout занят кадрами, поэтому весь текстовый вывод (--verbose, --activity, предупреждения) уходит в stderr
+    g_frames_stdout = sys.stdout.buffer
+    sys.stdout = sys.stderr
   g_debug_printf = argv_prms['verbose_mode']
-
-  if not os.path.isfile(argv_prms['map']):
+  pf_storage.g_debug_printf = g_debug_printf
+  if argv_prms['stats'] or argv_prms['progress'] is not None:
+    # замеры времени стадий обработки включаются только по запросу
+    g_stats = pf_stats.PfStats(argv_prms['progress'])
+    g_stats.instrument_reader()
+
+  # каналы, карты которых строятся за один проход по логу ('*' - все каналы)
+  channel_names: typing.List[str] = argv_prms['channels'] if argv_prms['channels'] else ['SRG-C']  #TODO
+  g_channel_filter = None if '*' in channel_names else pf_reader.make_channel_filter(channel_names)
+
+  # логи нескольких карт (и их ротированные части) объединяются в хронологическом порядке
+  remote: typing.Optional[pf_fetch.PfRemoteLog] = None
+  if argv_prms['url']:
+    # лог скачивается с сервера в локальную копию (по умолчанию с тем же именем файла)
+    if len(argv_prms['maps']) > 1:
+      print('Unable to fetch several log files')
+      exit(1)
+    local: str = argv_prms['maps'][0] if argv_prms['maps'] else \
+      os.path.basename(urllib.parse.urlsplit(argv_prms['url']).path) or argv_prms['map']
+    try:
+      remote = pf_fetch.PfRemoteLog(argv_prms['url'], local)
+    except pf_fetch.PfFetchError as e:
+      print(e)
+      exit(1)
+    if not os.path.exists(local):
+      open(local, 'wb').close()
+    filenames: typing.List[str] = [local]
+  else:
+    filenames = pf_merge.expand_filenames(argv_prms['maps'] if argv_prms['maps'] else [argv_prms['map']])
+  if not filenames or not all(os.path.isfile(f) for f in filenames):
+    exit(1)
+  if argv_prms['frames'] == '-' and (g_channel_filter is None or len(g_channel_filter) > 1):
+    print('Unable to write frames of several channels to stdout')
     exit(1)
 
-  map = PfMap()
-  with open(argv_prms['map']) as f:
-    for line in f:
-      obj = json.loads(line)
-      message = obj.get('message')
-      message_parts = message.split(' ', 1)
-      message_type = message_parts[0]
-      message_id = message_parts[1]
-      context = obj.get('context')
-      data = context.get('data')
-      main = data.get('main')
-      objct = data.get('object')
-      character = data.get('character')
-      character_name = character.get('name')
-      channel = data.get('channel')
-      formatted = data.get('formatted')
-      dt = datetime.datetime.strptime(obj.get('datetime'),"%Y-%m-%dT%H:%M:%S.%f+00:00")  # "2023-10-27T07:38:33.856015+00:00"
-      dt = dt.replace(microsecond=0)
-      extra = obj.get('extra')
-      path = extra.get('path')
-      thumb = extra.get('thumb')
-      url = thumb.get('url')
-      object_id, object_name = objct.get('objId'), objct.get('objName')
-      if g_channel_filter:
-        if channel.get('channelName') != g_channel_filter: continue
-      #debug:if character_name != 'Qunibbra Do': continue
-
-      if message_type == 'map':
-        continue
-      elif message_type == 'system' or message_type == 'signature' or message_type == 'connection':
-        pass
+  channels: PfChannels = PfChannels(g_channel_filter, pf_validate.PfValidator(argv_prms['validate']))
+  filename: str = filenames[0]
+  follower: typing.Optional[pf_follow.PfFollower] = None
+  if argv_prms['follow']:
+    if len(filenames) > 1:
+      print('Unable to follow several log files')
+      exit(1)
+    if pf_reader.detect_compression(filename) is not None:
+      print('Unable to follow compressed log file:', filename)
+      exit(1)
+    follower = pf_follow.PfFollower(
+      filename,
+      g_channel_filter,
+      channels,
+      channels.route,
+      on_error=channels.validator.error)
+  # в режиме слежения за логом работа продолжается с сохранённой позиции, без разбора истории
+  if follower is None or not follower.restore_checkpoint():
+    if remote is not None:
+      try:
+        offset: int = process_remote_log(channels, remote, argv_prms)
+      except pf_fetch.PfFetchReset as e:
+        # лог на сервере заменён (ротация): прежняя локальная копия сохраняется как <name>.1, новый лог скачивается
+        # заново, а карты строятся по обеим копиям
+        rotated: str = pf_fetch.rotate_local_copy(remote.filename)
+        print('WARN: {}, the local copy is kept as {}'.format(e, rotated))
+        cache_filename: str = pf_cache.get_cache_filename(remote.filename, g_channel_filter)
+        if os.path.exists(cache_filename):
+          os.remove(cache_filename)
+        channels = PfChannels(g_channel_filter, pf_validate.PfValidator(argv_prms['validate']))
+        offset = process_reset_remote_log(channels, remote, rotated, argv_prms)
+      if follower is not None:
+        follower.storage = channels
+        follower.apply_event = channels.route
+        follower.on_error = channels.validator.error
+        follower.open(offset)
+    elif len(filenames) > 1:
+      process_logs(channels, filenames, argv_prms)
+    else:
+      offset: int = process_log(channels, filename, argv_prms)
+      if follower is not None:
+        follower.open(offset)
+    if argv_prms['frames'] is not None:
+      render_frames(channels, argv_prms)
+  elif argv_prms['frames'] is not None:
+    # журнал машины времени в режиме слежения не ведётся, поэтому кадры строятся только при разборе истории лога
+    print('WARN: frames are not rendered, following is continued from the checkpoint', follower.checkpoint_filename)
+  if follower is not None:
+    # в режиме слежения журнал машины времени не нужен (иначе он бы рос всё время работы)
+    channels.detach()
+    try:
+      if remote is not None:
+        try:
+          asyncio.run(pf_fetch.follow(remote, follower))
+        except KeyboardInterrupt:
+          follower.save_checkpoint()
+          follower.close()
       else:
-        print('Unknown message_type:', obj)
-        exit(1)
-
-      path_base = None
-      path_ids = None
-      if path == '/cron/deleteEolConnections' or \
-         path == '/cron/deleteExpiredConnections' or \
-         path == '/api/Map/updateData' or \
-         path == '/api/Map/updateUserData' or \
-         path == '/api/Map/updateUnloadData':
-        path_base = path
-      elif path.startswith('/api/rest/Connection'):  # номер соединения, м.б. пустой строкой
-        path_base = '/api/rest/Connection'
-        path_ids = path[len(path_base)+1:]
-        path_ids = [] if not path_ids else path_ids.split(',')
-      elif path.startswith('/api/rest/System'):  # номера систем, м.б. пустым списком
-        path_base = '/api/rest/System'
-        path_ids = path[len(path_base)+1:]
-        path_ids = [] if not path_ids else path_ids.split(',')
-      elif path.startswith('/api/rest/Signature'):  # номера сигнатур, м.б. пустым списком
-        path_base = '/api/rest/Signature'
-        path_ids = path[len(path_base)+1:]
-        path_ids = [] if not path_ids else path_ids.split(',')
-      elif path.startswith('/api/rest/Map/'):  # создание карты
-        continue
+        follower.run()
+    except pf_events.PfLogError as e:
+      print(e.reason, e.obj)
+      exit(1)
+  channels.validator.print_summary()
+  if argv_prms['activity']:
+    print_activity(channels)
+  if g_stats is not None and argv_prms['stats']:
+    g_stats.print_summary()
+
+
+def print_activity(channels: PfChannels):
+  if pf_activity is None:
+    print('Unable to count activity of the characters: numpy is not installed')
+    return
+  print(json.dumps({name: map.activity.summary() for name, map in channels.maps.items()}, indent=2, ensure_ascii=False))
+
+
+def render_frames(channels: PfChannels, argv_prms: dict):
+  for name, map in channels.maps.items():
+    # кадры каждого канала сохраняются в свой подкаталог, если каналов несколько
+    output: str = argv_prms['frames']
+    if output != '-' and len(channels.maps) > 1:
+      output = os.path.join(output, re.sub(r'[^\w.-]', '_', name) or '_')
+    # кадры строятся по журналу машины времени, все кадры одновременно в памяти не хранятся
+    frames = pf_render.iter_frames(
+      map.timeline,
+      datetime.timedelta(seconds=argv_prms['tick']),
+      argv_prms['size'][0],
+      argv_prms['size'][1])
+    pf_render.render_frames(frames, output, argv_prms['jobs'], g_frames_stdout)
+
+
+def process_log(channels: PfChannels, filename: str, argv_prms: dict) -> int:
+  """ builds maps of the channels from the log file, returns offset of the log up to which it was processed """
+  cache_filename: str = pf_cache.get_cache_filename(filename, g_channel_filter)
+  start: int = 0
+  cache_state: typing.Optional[str] = None
+  # журнал свёрнутых событий отличается от полного, поэтому в режиме свёртки кеш не используется
+  use_cache: bool = argv_prms['cache'] and argv_prms['coalesce'] is None
+  if use_cache:
+    # если лог не менялся, то состояние карт восстанавливается из кеша, а если лог только дописывался, то
+    # разбирается лишь его новая часть
+    start, cache_state = restore_from_cache(channels, filename, cache_filename)
+  # журнал изменений ведётся только для кеша и для кадров машины времени
+  if use_cache or argv_prms['frames'] is not None:
+    channels.attach()
+  if cache_state == 'same':
+    return start
+  identity: pf_cache.PfLogIdentity = pf_cache.get_log_identity(filename)
+  on_error = channels.validator.error
+  if argv_prms['jobs'] > 1:
+    # разбор json и нормализация записей выполняются в нескольких процессах, а состояние карт строится здесь
+    events = pf_parallel.iter_events(
+      filename, g_channel_filter, argv_prms['jobs'], start, identity.offset, on_error=on_error)
+  else:
+    events = pf_events.iter_events(filename, g_channel_filter, start, identity.offset, on_error=on_error)
+  if g_stats is not None:
+    events = g_stats.timed_iter('read', events)
+  if argv_prms['coalesce'] is not None:
+    events = pf_coalesce.iter_coalesced(events, argv_prms['coalesce'])
+  try:
+    for event in events:
+      channels.route(event)
+  except pf_events.PfLogError as e:
+    print(e.reason, e.obj)
+    exit(1)
+  if use_cache:
+    channels.save_cache(cache_filename, identity)
+  return identity.offset
+
+
+def process_remote_log(channels: PfChannels, remote: pf_fetch.PfRemoteLog, argv_prms: dict) -> int:
+  """ builds maps of the channels from the local copy of the log, then fetches new part of the log from the server,
+  the received lines are applied while the rest of them is being downloaded, returns offset of the local copy up to
+  which it was processed
+  """
+  filename: str = remote.filename
+  # локальная копия разбирается как обычный лог (из кеша, если он актуален)
+  offset: int = process_log(channels, filename, argv_prms)
+  with open(filename, 'rb') as f:
+    f.seek(offset)
+    buffer: pf_fetch.PfLineBuffer = pf_fetch.PfLineBuffer(f.read())
+  coalescer: typing.Optional[pf_coalesce.PfCoalescer] = \
+    pf_coalesce.PfCoalescer(argv_prms['coalesce']) if argv_prms['coalesce'] is not None else None
+
+  def on_data(chunk: bytes):
+    for event in pf_events.iter_line_events(buffer.feed(chunk), g_channel_filter, on_error=channels.validator.error):
+      if coalescer is None:
+        channels.route(event)
       else:
-        print('Unknown extra.path:', obj)
-        assert False
+        for e in coalescer.push(event):
+          channels.route(e)
+
+  async def fetch() -> int:
+    try:
+      return await remote.fetch(on_data)
+    finally:
+      await remote.close()
+
+  try:
+    try:
+      asyncio.run(fetch())
+    except pf_fetch.PfFetchReset:
+      raise
+    except (pf_fetch.PfFetchError, OSError) as e:
+      # соединение прервалось (возможно, посреди ответа): строки, полученные целиком, уже применены к картам и
+      # остаются в локальной копии, остальное будет скачано позже
+      print('WARN: unable to fetch {}: {}'.format(remote.url, e))
+    if coalescer is not None:
+      for event in coalescer.flush():
+        channels.route(event)
+  except pf_events.PfLogError as e:
+    print(e.reason, e.obj)
+    exit(1)
+  if not buffer.consumed:
+    return offset
+  identity: pf_cache.PfLogIdentity = pf_cache.get_log_identity(filename, offset + buffer.consumed)
+  if argv_prms['cache'] and argv_prms['coalesce'] is None:
+    channels.save_cache(pf_cache.get_cache_filename(filename, g_channel_filter), identity)
+  return identity.offset
+
+
+def process_reset_remote_log(
+    channels: PfChannels,
+    remote: pf_fetch.PfRemoteLog,
+    rotated: str,
+    argv_prms: dict) -> int:
+  """ fetches the replaced log from the server into the empty local copy, then builds maps of the channels from the
+  previous local copy (rotated) and the new one merged by datetime of the records, returns offset of the new local copy
+  up to which it was processed
+  """
+  async def fetch() -> int:
+    try:
+      return await remote.fetch()
+    finally:
+      await remote.close()
+
+  try:
+    asyncio.run(fetch())
+  except (pf_fetch.PfFetchError, OSError) as e:
+    print('WARN: unable to fetch {}: {}'.format(remote.url, e))
+  process_logs(channels, [rotated, remote.filename], argv_prms)
+  return pf_cache.get_log_identity(remote.filename).offset
+
+
+def process_logs(channels: PfChannels, filenames: typing.List[str], argv_prms: dict):
+  """ builds maps of the channels from several logs merged by datetime of the records (cache isn't used) """
+  # записи объединяются по строкам лога в этом процессе, поэтому ни рабочие процессы, ни кеши логов не применяются
+  if argv_prms['jobs'] > 1:
+    print('WARN: --jobs is ignored when several logs are merged')
+  if argv_prms['cache']:
+    for filename in filenames:
+      if os.path.isfile(pf_cache.get_cache_filename(filename, g_channel_filter)):
+        print('WARN: cache of {} is ignored when several logs are merged'.format(filename))
+  if argv_prms['frames'] is not None:
+    channels.attach()
+  events = pf_merge.iter_events(filenames, g_channel_filter, on_error=channels.validator.error)
+  if g_stats is not None:
+    events = g_stats.timed_iter('read', events)
+  if argv_prms['coalesce'] is not None:
+    events = pf_coalesce.iter_coalesced(events, argv_prms['coalesce'])
+  try:
+    for event in events:
+      channels.route(event)
+  except pf_events.PfLogError as e:
+    print(e.reason, e.obj)
+    exit(1)
 
-      if objects.get(str(object_id)):
-        if object_name != objects.get(str(object_id)):
-          pass # print("!!!!!!!!!!!!!", objct, objects.get(str(object_id)), line)
-      else:
-        objects.update({str(object_id): object_name})
-
-      # установка этой переменной приведёт к выводу информации
-      # по разбору данных в текущей строке
-      debug_this_line = False
-
-      if not main or main.get('active') and main['active']['old'] and not main['active']['new']:
-        if not formatted.startswith("Deleted "+message_type):
-          print('Unknown deletion:', obj)
-          assert False
-        if message_type == 'connection':
-          map.deleted_connection(message_id, dt, character, objct, path_base, path_ids)
-        elif message_type == 'system':
-          map.deleted_system(message_id, dt, character, objct, path_base, path_ids)
-        elif message_type == 'signature':
-          map.deleted_signature(message_id, dt, character, objct, path_base, path_ids)
-      else:
-        # определяем тип воздействия update-or-create
-        updation: bool = False
-        for key in main.keys():
-          # перехватываем те события, которые прямо свидетельствуют, что объект уже есть
-          if message_type == 'signature':
-            if key in ['connectionId']:
-              updation = True
-              break
-          elif message_type == 'system':
-            if key in ['description']:
-              updation = True
-              break
-          elif message_type == 'connection':
-            if key in ['sourceEndpointType','targetEndpointType']:
-              updation = True
-              break
-          if main[key]['old'] is not None:
-            updation = True
-            break;
-        if updation:
-          if not formatted.startswith("Updated "+message_type):
-            print('Unknown updation:', obj)
-            assert False
-          if message_type == 'connection':
-            map.updated_connection(message_id, dt, character, objct, main, path_base, path_ids)
-          elif message_type == 'system':
-            map.updated_system(message_id, dt, character, objct, main, path_base, path_ids)
-          elif message_type == 'signature':
-            map.updated_signature(message_id, dt, character, objct, main, path_base, path_ids)
-        else:
-          if not formatted.startswith("Created "+message_type):
-            print('Unknown creation:', obj)
-            assert False
-          if message_type == 'connection':
-            map.created_connection(message_id, dt, character, objct, main, path_base, path_ids)
-          elif message_type == 'system':
-            map.created_system(message_id, dt, character, objct, main, path_base, path_ids)
-          elif message_type == 'signature':
-            map.created_signature(message_id, dt, character, objct, main, path_base, path_ids)
-
-      if debug_this_line:
-        # удаляем обработанные тэги, чтобы было видно что именно ещё осталось необработанным?
-        del obj['message']
-        del obj['context']['data']['character']
-        del obj['context']['data']['channel']
-        del obj['context']['data']['object']
-        del obj['context']['data']['formatted']
-        del obj['context']['tag']
-        del obj['datetime']
-        del obj['level']
-        del obj['level_name']
-        del obj['channel']
-        del obj['extra']['path']
-        del obj['extra']['ip']
-        del obj['extra']['thumb']
-        if not obj['extra']: del obj['extra']
-        if not obj['context']['data']['main']: del obj['context']['data']['main']
-        if not obj['context']['data']: del obj['context']['data']
-        if not obj['context']: del obj['context']
-        if obj:
-          print(obj, "\n")
-        print(
-            dt,
-            '|', message_type, message_parts[1],
-            '|', character_name,
-            '|', object_id, object_name,
-            '|', path_base, path_ids,
-            "\n", formatted)
-        print("---------------------")
+
+def restore_from_cache(
+    channels: PfChannels,
+    filename: str,
+    cache_filename: str) -> typing.Tuple[int, typing.Optional[str]]:
+  cached: typing.Optional[pf_cache.PfCache] = pf_cache.load_cache(cache_filename)
+  if cached is not None:
+    # кеш без активности персонажей (построенный без numpy) не подходит, если активность считается, а кеш,
+    # построенный с другим уровнем проверки, содержит другой набор аномалий (и поэтому строится заново)
+    if cached.channel == (None if g_channel_filter is None else sorted(g_channel_filter)) and \
+       (cached.activities is not None or pf_activity is None) and \
+       cached.validation['level'] == channels.validator.level:
+      cache_state: typing.Optional[str] = pf_cache.check_log_identity(filename, cached.identity)
+      if cache_state is not None:
+        # состояние карт восстанавливается из сохранённого итогового состояния, журнал не переигрывается (карты
+        # заменяются, только если кеш загружен целиком, иначе он строится заново)
+        maps: typing.Dict[str, PfMap] = {}
+        try:
+          for name, journal in cached.journals.items():
+            map: PfMap = channels.new_map()
+            maps[name] = map
+            map.timeline.load(journal, cached.snapshot_rows[name], cached.snapshot_states[name], cached.states[name])
+            if cached.activities is not None and name in cached.activities:
+              map.activity = cached.activities[name]
+        except (KeyError, IndexError, TypeError, ValueError):
+          return 0, None
+        channels.maps.update(maps)
+        channels.validator.load_state(cached.validation)
+        channels.cache_layout = cached.layout
+        return cached.identity.offset, cache_state
+  return 0, None
+
+
+def process_event(map: PfMap, event: pf_events.PfEvent):
+  if g_stats is not None:
+    g_stats.count_event(event)
+  #debug:if event.character.get('name') != 'Qunibbra Do': return
+
+  # установка этой переменной приведёт к выводу информации
+  # по разбору данных в текущей строке
+  debug_this_line = False
+
+  try:
+    if map.activity is not None:
+      map.activity.count(event)
+    map.dispatcher.dispatch(event)
+  except (KeyError, IndexError, TypeError, ValueError, AttributeError) as e:
+    # запись неожиданной структуры (например, из новой версии pathfinder) не прерывает обработку лога
+    map.validator.malformed(event, e)
+
+  obj = event.obj
+  if debug_this_line and obj is not None:
+    # удаляем обработанные тэги, чтобы было видно что именно ещё осталось необработанным?
+    del obj['message']
+    del obj['context']['data']['character']
+    del obj['context']['data']['channel']
+    del obj['context']['data']['object']
+    del obj['context']['data']['formatted']
+    del obj['context']['tag']
+    del obj['datetime']
+    del obj['level']
+    del obj['level_name']
+    del obj['channel']
+    del obj['extra']['path']
+    del obj['extra']['ip']
+    del obj['extra']['thumb']
+    if not obj['extra']: del obj['extra']
+    if not obj['context']['data']['main']: del obj['context']['data']['main']
+    if not obj['context']['data']: del obj['context']['data']
+    if not obj['context']: del obj['context']
+    if obj:
+      print(obj, "\n")
+    print(
+        event.dt,
+        '|', event.message_type, event.message_id,
+        '|', event.character.get('name'),
+        '|', event.objct.get('objId'), event.objct.get('objName'),
+        '|', event.path_base, event.path_ids,
+        "\n", event.formatted)
+    print("---------------------")
 
 if __name__ == "__main__":
   main()
   exit(0)
-else:
-  exit(1)
@@ -0,0 +1,77 @@
+# -*- encoding: utf-8 -*-
+""" Tests of the compiled event cache of the log (damaged cache is rebuilt, caches of the channel sets are kept apart)
+
+$ python -m unittest test_pf_cache
+"""
+import os
+import typing
+import marshal
+import tempfile
+import unittest
+
+import pftm
+import pf_cache
+import pf_merge
+import pf_reader
+import pf_generator
+
+ARGV_PRMS: dict = {'cache': True, 'coalesce': None, 'frames': None, 'jobs': 1}
+
+
+class TestPfCache(unittest.TestCase):
+  def setUp(self):
+    self.tmp = tempfile.TemporaryDirectory()
+    self.log: str = os.path.join(self.tmp.name, 'map.log')
+    pf_generator.generate(self.log, 3000)
+    self.channel_filter: pf_reader.PfChannelFilter = pftm.g_channel_filter
+
+  def tearDown(self):
+    pftm.g_channel_filter = self.channel_filter
+    self.tmp.cleanup()
+
+  def build(self, cache: bool = True) -> pftm.PfChannels:
+    channels: pftm.PfChannels = pftm.PfChannels(pftm.g_channel_filter)
+    pftm.process_log(channels, self.log, dict(ARGV_PRMS, cache=cache))
+    return channels
+
+  def read(self, filename: str) -> bytes:
+    with open(filename, 'rb') as f:
+      return f.read()
+
+  def write(self, filename: str, data: bytes):
+    with open(filename, 'wb') as f:
+      f.write(data)
+
+  def test_damaged_state(self):
+    expected: pftm.PfChannels = self.build()
+    cache_filename: str = pf_cache.get_cache_filename(self.log)
+    data: bytes = self.read(cache_filename)
+    map: pftm.PfMap = expected.maps['SRG-C']
+    at: int = data.rindex(marshal.dumps(map.storage.dump_state()))
+    self.write(cache_filename, data[:at] + b'\xff' + data[at + 1:])
+    self.assertIsNone(pf_cache.load_cache(cache_filename))
+    # итоговое состояние декодируется, но его структура не совпадает с ожидаемой
+    self.write(cache_filename, data)
+    map.storage.dump_state = lambda: {'systems': [[1]], 'connections': [], 'signatures': []}
+    expected.save_cache(cache_filename, pf_cache.get_log_identity(self.log))
+    self.assertIsNotNone(pf_cache.load_cache(cache_filename))
+    # карты строятся по логу заново
+    self.assertEqual(self.build().dump_state(), self.build(cache=False).dump_state())
+
+  def test_channel_sets(self):
+    # каждый набор каналов получает свой кеш, поэтому переключение --channel не перезаписывает кеш другого набора
+    channel_sets: typing.List[typing.List[str]] = [['SRG-C'], ['OTHER', 'THIRD']]
+    for names in channel_sets:
+      pftm.g_channel_filter = pf_reader.make_channel_filter(names)
+      self.build()
+    filenames: typing.List[str] = [
+      pf_cache.get_cache_filename(self.log, pf_reader.make_channel_filter(names)) for names in channel_sets]
+    self.assertNotEqual(filenames[0], filenames[1])
+    for names, filename in zip(channel_sets, filenames):
+      self.assertTrue(filename.endswith(pf_cache.CACHE_SUFFIX))
+      self.assertEqual(pf_cache.load_cache(filename).channel, sorted(names))
+    self.assertEqual(pf_merge.expand_filenames([self.log + '*']), [self.log])
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,80 @@
+# -*- encoding: utf-8 -*-
+""" Tests of coalescing of the map events (coalesced events change the map the same way as the original ones)
+
+$ python -m unittest test_pf_coalesce
+"""
+import typing
+import datetime
+import unittest
+
+import pftm
+import pf_cache
+import pf_events
+import pf_validate
+import pf_coalesce
+
+T0: datetime.datetime = datetime.datetime(2024, 1, 1, 12, 0, 0)
+
+
+def event(seconds: int, action: str, message_type: str, obj_id: int, name: str, main: typing.Optional[dict] = None) -> pf_events.PfEvent:
+  return pf_events.PfEvent(
+    action, message_type, '', 'C', T0 + datetime.timedelta(seconds=seconds), {'name': 'Pilot'},
+    {'objId': obj_id, 'objName': name}, main if main is not None else {}, '', None, '', None)
+
+
+def signature_fields(name: str, group: int) -> dict:
+  return {'groupId': {'old': None, 'new': group}, 'typeId': {'old': None, 'new': 0},
+          'name': {'old': None, 'new': name}, 'description': {'old': None, 'new': ''}}
+
+
+def change(field: str, old, new) -> dict:
+  return {field: {'old': old, 'new': new}}
+
+
+def iter_log() -> typing.Iterator[pf_events.PfEvent]:
+  yield event(0, 'created', 'signature', 1, 'ABC-001', signature_fields('ABC-001', 1))
+  yield event(0, 'created', 'signature', 2, 'ABC-002', signature_fields('ABC-002', 1))
+  # изменение возвращено обратно
+  yield event(100, 'updated', 'signature', 1, 'ABC-001', change('groupId', 1, 2))
+  yield event(101, 'updated', 'signature', 1, 'ABC-001', change('groupId', 2, 1))
+  # одно из полей возвращено обратно, другое изменено
+  yield event(100, 'updated', 'signature', 2, 'ABC-002', {**change('groupId', 1, 2), **change('name', 'ABC-002', 'XYZ-002')})
+  yield event(102, 'updated', 'signature', 2, 'XYZ-002', change('groupId', 2, 1))
+  # сигнатура создана, изменена и удалена
+  yield event(200, 'created', 'signature', 3, 'ABC-003', signature_fields('ABC-003', 1))
+  yield event(201, 'updated', 'signature', 3, 'ABC-003', change('groupId', 1, 5))
+  yield event(202, 'updated', 'signature', 3, 'ABC-003', {'connectionId': {'old': None, 'new': None}})
+  yield event(203, 'deleted', 'signature', 3, 'ABC-003')
+  # повторное создание не отменяется удалением
+  yield event(300, 'created', 'signature', 4, 'ABC-004', signature_fields('ABC-004', 1))
+  yield event(301, 'created', 'signature', 4, 'ABC-004', signature_fields('ABC-004', 1))
+  yield event(302, 'deleted', 'signature', 4, 'ABC-004')
+
+
+def replay(events: typing.Iterable[pf_events.PfEvent]) -> dict:
+  map: pftm.PfMap = pftm.PfMap(pf_validate.PfValidator('strict'))
+  for e in events:
+    map.apply(e)
+  return map.storage.dump_state()
+
+
+class TestPfCoalesce(unittest.TestCase):
+  def test_net_changes(self):
+    coalescer: pf_coalesce.PfCoalescer = pf_coalesce.PfCoalescer(60)
+    events: typing.List[pf_events.PfEvent] = list(pf_coalesce.iter_coalesced(iter_log(), coalescer=coalescer))
+    self.assertEqual([(e.action, e.objct['objId'], e.main) for e in events[2:]], [
+      ('updated', 2, change('name', 'ABC-002', 'XYZ-002')),
+      ('created', 4, signature_fields('ABC-004', 1)),
+      ('created', 4, signature_fields('ABC-004', 1)),
+      ('deleted', 4, {})])
+    self.assertEqual((coalescer.received, coalescer.passed), (len(list(iter_log())), len(events)))
+    # карта в итоге та же (время последнего изменения сигнатуры, изменения которой возвращены обратно, не меняется)
+    expected: dict = replay(iter_log())
+    for signature in expected['signatures']:
+      if signature[0] == 1:
+        signature[3] = pf_cache.to_timestamp(T0)
+    self.assertEqual(replay(events), expected)
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,83 @@
+# -*- encoding: utf-8 -*-
+""" Tests of normalization of the log records (malformed records are reported as PfLogError)
+
+$ python -m unittest test_pf_events
+"""
+import json
+import copy
+import unittest
+
+import pf_events
+import pf_reader
+import pf_dispatch
+import pf_generator
+
+
+def created_system() -> dict:
+  for line in pf_generator.PfLogGenerator(1).iter_lines(100):
+    obj: dict = json.loads(line)
+    if obj['context']['data']['formatted'].startswith('Created system'):
+      return obj
+  raise AssertionError('no created system in the synthetic log')
+
+
+def malformed_records() -> dict:
+  valid: dict = created_system()
+  records: dict = {}
+  key: str = next(iter(valid['context']['data']['main']))
+  records['no old'] = copy.deepcopy(valid)
+  del records['no old']['context']['data']['main'][key]['old']
+  records['main value'] = copy.deepcopy(valid)
+  records['main value']['context']['data']['main'][key] = 5
+  records['main list'] = copy.deepcopy(valid)
+  records['main list']['context']['data']['main'] = [1]
+  records['formatted'] = copy.deepcopy(valid)
+  records['formatted']['context']['data']['formatted'] = None
+  records['path'] = copy.deepcopy(valid)
+  records['path']['extra']['path'] = None
+  return records
+
+
+class TestPfEvents(unittest.TestCase):
+  def test_valid(self):
+    line: bytes = json.dumps(created_system()).encode('utf-8')
+    event = pf_events.normalize_record(pf_reader.decode_line(line), None)
+    self.assertEqual((event.action, event.message_type), ('created', 'system'))
+
+  def test_malformed(self):
+    for name, obj in malformed_records().items():
+      with self.subTest(name):
+        line: bytes = json.dumps(obj).encode('utf-8')
+        with self.assertRaises(pf_events.PfLogError):
+          pf_events.normalize_record(pf_reader.decode_line(line), None)
+
+  def test_malformed_skipped(self):
+    # записи неожиданной структуры передаются в on_error, а обработка лога продолжается
+    lines = [json.dumps(obj).encode('utf-8') + b'\n' for obj in malformed_records().values()]
+    lines.append(json.dumps(created_system()).encode('utf-8') + b'\n')
+    errors = []
+    events = list(pf_events.iter_line_events(lines, None, on_error=errors.append))
+    self.assertEqual(len(events), 1)
+    self.assertEqual(len(errors), len(lines) - 1)
+
+  def test_registered_message_type(self):
+    # записи нового типа принимаются, как только для него зарегистрирован обработчик
+    obj: dict = created_system()
+    obj['message'] = obj['message'].replace('system', 'structure', 1)
+    obj['context']['data']['formatted'] = obj['context']['data']['formatted'].replace('system', 'structure', 1)
+    line: bytes = json.dumps(obj).encode('utf-8')
+    with self.assertRaises(pf_events.PfLogError):
+      pf_events.normalize_record(pf_reader.decode_line(line), None)
+    events = []
+    dispatcher: pf_dispatch.PfDispatcher = pf_dispatch.PfDispatcher()
+    dispatcher.register('structure', 'created', events.append)
+    try:
+      event = pf_events.normalize_record(pf_reader.decode_line(line), None)
+      self.assertEqual(dispatcher.dispatch(event), 1)
+      self.assertEqual(events, [event])
+    finally:
+      pf_events.g_message_types.discard('structure')
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,181 @@
+# -*- encoding: utf-8 -*-
+""" Tests of fetching the logs from the server (pf_server.py is started in the thread)
+
+$ python -m unittest test_pf_fetch
+"""
+import io
+import os
+import sys
+import json
+import asyncio
+import contextlib
+import typing
+import tempfile
+import unittest
+import threading
+import subprocess
+import http.server
+
+import pftm
+import pf_fetch
+import pf_events
+import pf_server
+import pf_generator
+
+
+class PfQuietRequestHandler(pf_server.PfRangeRequestHandler):
+  def log_message(self, format, *args):
+    pass
+
+
+class PfDroppingRequestHandler(PfQuietRequestHandler):
+  """ sends only the half of the requested range, then closes the connection """
+  def copyfile(self, source, outputfile):
+    left: typing.Optional[int] = getattr(self, 'range_left', None)
+    if left is None:
+      return super().copyfile(source, outputfile)
+    self.range_left = None
+    outputfile.write(source.read(left // 2))
+    self.close_connection = True
+
+
+class PfQuietServer(http.server.ThreadingHTTPServer):
+  def handle_error(self, request, client_address):
+    # клиент закрывает соединение, не дочитав ответ, если лог на сервере не совпал с локальной копией
+    pass
+
+
+def generate_lines(count: int, seed: int = 1) -> bytes:
+  return ''.join(line + '\n' for line in pf_generator.PfLogGenerator(seed).iter_lines(count)).encode('utf-8')
+
+
+class TestPfFetch(unittest.TestCase):
+  def setUp(self):
+    self.tmp = tempfile.TemporaryDirectory()
+    self.server_dir: str = os.path.join(self.tmp.name, 'server')
+    self.local_dir: str = os.path.join(self.tmp.name, 'local')
+    os.mkdir(self.server_dir)
+    os.mkdir(self.local_dir)
+
+    self.handler_class = PfQuietRequestHandler
+
+    def handler(*args, **kwargs):
+      return self.handler_class(*args, directory=self.server_dir, **kwargs)
+
+    self.httpd = PfQuietServer(('127.0.0.1', 0), handler)
+    self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+    self.thread.start()
+    self.url: str = 'http://127.0.0.1:{}/map.log'.format(self.httpd.server_address[1])
+    self.local: str = os.path.join(self.local_dir, 'map.log')
+    # лог на сервере, первые 3000 строк которого уже были скачаны ранее
+    self.log: bytes = generate_lines(4000)
+    self.head: bytes = self.log[:self.log.index(b'\n', len(self.log) * 3 // 4) + 1]
+
+  def tearDown(self):
+    self.httpd.shutdown()
+    self.httpd.server_close()
+    self.thread.join()
+    self.tmp.cleanup()
+
+  def write(self, filename: str, data: bytes):
+    with open(filename, 'wb') as f:
+      f.write(data)
+
+  def read(self, filename: str) -> bytes:
+    with open(filename, 'rb') as f:
+      return f.read()
+
+  def fetch(self, remote: pf_fetch.PfRemoteLog, on_data=None) -> int:
+    async def fetch() -> int:
+      try:
+        return await remote.fetch(on_data)
+      finally:
+        await remote.close()
+    return asyncio.run(fetch())
+
+  def test_resume(self):
+    self.write(os.path.join(self.server_dir, 'map.log'), self.log)
+    self.write(self.local, self.head)
+    remote: pf_fetch.PfRemoteLog = pf_fetch.PfRemoteLog(self.url, self.local)
+    chunks = []
+    # скачивается только часть лога после конца локальной копии
+    self.assertEqual(self.fetch(remote, chunks.append), len(self.log) - len(self.head))
+    self.assertEqual(b''.join(chunks), self.log[len(self.head):])
+    self.assertEqual(self.read(self.local), self.log)
+    # новых байт нет
+    self.assertEqual(self.fetch(remote), 0)
+    self.assertEqual(self.read(self.local), self.log)
+
+  def test_dropped_connection(self):
+    # соединение закрывается посреди ответа: применённые строки не должны быть применены повторно
+    self.handler_class = PfDroppingRequestHandler
+    self.write(os.path.join(self.server_dir, 'map.log'), self.log)
+    self.write(self.local, self.head)
+    remote: pf_fetch.PfRemoteLog = pf_fetch.PfRemoteLog(self.url, self.local)
+    channels: pftm.PfChannels = pftm.PfChannels(None)
+    argv_prms: dict = {'cache': False, 'coalesce': None, 'frames': None, 'jobs': 1}
+    with contextlib.redirect_stdout(io.StringIO()) as output:
+      offset: int = pftm.process_remote_log(channels, remote, argv_prms)
+    self.assertIn('Connection closed while receiving the log', output.getvalue())
+    local: bytes = self.read(self.local)
+    self.assertTrue(len(self.head) < len(local) < len(self.log))
+    self.assertEqual(local, self.log[:len(local)])
+    # обработка продолжается с конца последней строки, полученной целиком
+    self.assertEqual(offset, local.rindex(b'\n') + 1)
+    expected: pftm.PfChannels = pftm.replay(pf_events.iter_events(self.local, None, 0, offset), pftm.PfChannels(None))
+    self.assertEqual(channels.dump_state(), expected.dump_state())
+    self.assertEqual(channels.validator.anomalies, {})
+
+  def test_overlap_mismatch(self):
+    # конец локальной копии не совпадает с тем же диапазоном лога на сервере
+    self.write(os.path.join(self.server_dir, 'map.log'), self.log)
+    local: bytes = self.head[:-2] + b'x\n'
+    self.write(self.local, local)
+    remote: pf_fetch.PfRemoteLog = pf_fetch.PfRemoteLog(self.url, self.local)
+    with self.assertRaises(pf_fetch.PfFetchReset):
+      self.fetch(remote)
+    self.assertEqual(self.read(self.local), local)
+
+  def test_shorter_log(self):
+    # лог на сервере короче локальной копии
+    self.write(os.path.join(self.server_dir, 'map.log'), self.head)
+    self.write(self.local, self.log)
+    remote: pf_fetch.PfRemoteLog = pf_fetch.PfRemoteLog(self.url, self.local)
+    with self.assertRaises(pf_fetch.PfFetchReset):
+      self.fetch(remote)
+    self.assertEqual(self.read(self.local), self.log)
+
+  def test_rotate_local_copy(self):
+    self.write(self.local, b'second\n')
+    self.write(self.local + '.1', b'first\n')
+    self.assertEqual(pf_fetch.rotate_local_copy(self.local), self.local + '.1')
+    self.assertEqual(self.read(self.local), b'')
+    self.assertEqual(self.read(self.local + '.1'), b'second\n')
+    self.assertEqual(self.read(self.local + '.2'), b'first\n')
+
+  def run_pftm(self, *args: str) -> subprocess.CompletedProcess:
+    return subprocess.run(
+      [sys.executable, 'pftm.py', '--channel=*', '--activity'] + list(args),
+      cwd=os.path.dirname(os.path.abspath(__file__)),
+      capture_output=True,
+      check=True)
+
+  def test_reset(self):
+    # лог на сервере ротирован: новый лог продолжает прежний, но локальную копию не продолжает
+    self.write(os.path.join(self.server_dir, 'map.log'), self.head)
+    self.run_pftm('--url=' + self.url, '--map=' + self.local)
+    self.assertEqual(self.read(self.local), self.head)
+    self.write(os.path.join(self.server_dir, 'map.log'), self.log[len(self.head):])
+    reset: subprocess.CompletedProcess = self.run_pftm('--url=' + self.url, '--map=' + self.local)
+    self.assertIn(b'the local copy is kept as', reset.stdout)
+    self.assertEqual(self.read(self.local + '.1'), self.head)
+    self.assertEqual(self.read(self.local), self.log[len(self.head):])
+    # карты построены по всей истории лога: активность та же, что и при разборе неротированного лога
+    full: str = os.path.join(self.local_dir, 'full.log')
+    self.write(full, self.log)
+    expected: subprocess.CompletedProcess = self.run_pftm('--map=' + full, '--no-cache')
+    self.assertEqual(json.loads(reset.stdout[reset.stdout.index(b'\n{') + 1:]), json.loads(expected.stdout))
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,81 @@
+# -*- encoding: utf-8 -*-
+""" Tests of the follow mode (restart continues from the checkpoint)
+
+$ python -m unittest test_pf_follow
+"""
+import io
+import os
+import tempfile
+import contextlib
+import unittest
+
+import pftm
+import pf_follow
+import pf_generator
+
+
+class TestPfFollow(unittest.TestCase):
+  def setUp(self):
+    self.tmp = tempfile.TemporaryDirectory()
+    self.log: str = os.path.join(self.tmp.name, 'map.log')
+    lines = [line + '\n' for line in pf_generator.PfLogGenerator(1).iter_lines(2000)]
+    # записи, которые не удаётся разобрать, попадают в сводку аномалий
+    lines.insert(500, '{"malformed\n')
+    lines.insert(1500, '{"malformed\n')
+    self.data: bytes = ''.join(lines).encode('utf-8')
+    self.head: bytes = self.data[:self.data.index(b'\n', len(self.data) // 2) + 1]
+
+  def tearDown(self):
+    self.tmp.cleanup()
+
+  def write(self, data: bytes):
+    with open(self.log, 'ab') as f:
+      f.write(data)
+
+  def follow(self, channels: pftm.PfChannels, restore: bool) -> pf_follow.PfFollower:
+    follower: pf_follow.PfFollower = pf_follow.PfFollower(
+      self.log, None, channels, channels.route, on_error=channels.validator.error)
+    if not restore or not follower.restore_checkpoint():
+      follower.open(0)
+    follower.read_available()
+    follower.close()
+    return follower
+
+  def test_resume(self):
+    # счётчики активности и аномалий после перезапуска продолжают посчитанные до него
+    self.write(self.head)
+    self.follow(pftm.PfChannels(None), False).save_checkpoint()
+    self.write(self.data[len(self.head):])
+    resumed: pftm.PfChannels = pftm.PfChannels(None)
+    self.follow(resumed, True)
+    expected: pftm.PfChannels = pftm.PfChannels(None)
+    self.follow(expected, False)
+    self.assertEqual(resumed.validator.anomalies, {'Malformed json:': 2})
+    self.assertEqual(resumed.dump_state()['storage'], expected.dump_state()['storage'])
+    self.assertEqual(resumed.dump_state()['validation'], expected.dump_state()['validation'])
+    if pftm.pf_activity is not None:
+      self.assertEqual(
+        {name: map.activity.summary() for name, map in resumed.maps.items()},
+        {name: map.activity.summary() for name, map in expected.maps.items()})
+
+  def test_damaged_checkpoint(self):
+    self.write(self.data)
+    follower: pf_follow.PfFollower = self.follow(pftm.PfChannels(None), False)
+    follower.save_checkpoint()
+    with open(follower.checkpoint_filename, 'rb') as f:
+      checkpoint: bytes = f.read()
+    for name, damaged in (('truncated', checkpoint[:len(checkpoint) // 2]), ('damaged', checkpoint.replace(b'"storage"', b'"x"'))):
+      with self.subTest(name):
+        with open(follower.checkpoint_filename, 'wb') as f:
+          f.write(damaged)
+        channels: pftm.PfChannels = pftm.PfChannels(None)
+        restored: pf_follow.PfFollower = pf_follow.PfFollower(self.log, None, channels, channels.route)
+        # повреждённый checkpoint не прерывает работу, лог разбирается заново
+        with contextlib.redirect_stdout(io.StringIO()) as output:
+          self.assertFalse(restored.restore_checkpoint())
+        self.assertIn('unable to restore checkpoint', output.getvalue())
+        self.assertEqual(channels.maps, {})
+
+
+if __name__ == '__main__':
+  unittest.main()
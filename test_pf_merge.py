@@ -0,0 +1,41 @@
+# -*- encoding: utf-8 -*-
+""" Tests of the merge of several logs
+
+$ python -m unittest test_pf_merge
+"""
+import os
+import tempfile
+import unittest
+
+import pf_cache
+import pf_merge
+import pf_follow
+
+
+class TestPfMerge(unittest.TestCase):
+  def setUp(self):
+    self.tmp = tempfile.TemporaryDirectory()
+
+  def tearDown(self):
+    self.tmp.cleanup()
+
+  def touch(self, name: str) -> str:
+    filename: str = os.path.join(self.tmp.name, name)
+    open(filename, 'wb').close()
+    return filename
+
+  def test_expand_filenames(self):
+    log: str = self.touch('map_2.log')
+    rotated: str = self.touch('map_2.log.1')
+    # кеш и позиция слежения лежат рядом с логом, но логами не являются
+    self.touch('map_2.log' + pf_cache.CACHE_SUFFIX)
+    self.touch('map_2.log.1' + pf_cache.CACHE_SUFFIX + '.tmp')
+    self.touch('map_2.log' + pf_follow.CHECKPOINT_SUFFIX)
+    self.assertEqual(pf_merge.expand_filenames([os.path.join(self.tmp.name, 'map_2.log*')]), [log, rotated])
+    # явно указанное имя не фильтруется
+    cache: str = log + pf_cache.CACHE_SUFFIX
+    self.assertEqual(pf_merge.expand_filenames([cache, log]), [cache, log])
+
+
+if __name__ == '__main__':
+  unittest.main()